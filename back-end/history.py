@@ -0,0 +1,495 @@
+"""
+Riwayat (time-series) append-only di SQLite mode WAL.
+
+Tabel:
+- detections : hasil deteksi per arah (counts, PCU, model, latency inferensi, sumber upload/stream)
+- schedules  : hasil fuzzy per arah (Green_time / Red_time) yang dikirim ke Pico
+- telemetry  : baris RT / SCHED dari Pico
+
+Tulis tidak pernah di request path: record_*() cuma masuk antrian terbatas (penuh -> dibuang
+& dihitung), 1 thread writer mengumpulkan batch (HISTORY_BATCH baris / HISTORY_FLUSH_MS) lalu
+executemany dalam 1 transaksi. Maintenance berkala: hapus data lewat retensi, checkpoint WAL,
+incremental vacuum (kompaksi file).
+
+Rollup (menit / jam / hari) di-update di transaksi yang sama dengan insert raw (UPSERT tambah
+n / sum), jadi query dashboard cuma baca tabel rollup, tidak scan raw:
+- rollup_pcu   : PCU & counts per arah
+- rollup_sched : green / red per arah (green split)
+- rollup_cycle : histogram panjang siklus (bin ROLLUP_CYCLE_BIN_S detik)
+Output query bisa di-stream per chunk sebagai NDJSON atau Arrow IPC (pyarrow opsional).
+"""
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    import pyarrow as pa
+    HAS_ARROW = True
+except Exception:
+    pa = None
+    HAS_ARROW = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    ts REAL NOT NULL,
+    intersection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    request_id TEXT,
+    model_type TEXT,
+    arah TEXT NOT NULL,
+    car INTEGER NOT NULL,
+    motorcycle INTEGER NOT NULL,
+    bicycle INTEGER NOT NULL,
+    kendaraan_besar INTEGER NOT NULL,
+    pcu REAL NOT NULL,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS ix_detections_ts ON detections (intersection, ts);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    ts REAL NOT NULL,
+    intersection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    arah TEXT NOT NULL,
+    pcu REAL NOT NULL,
+    green REAL NOT NULL,
+    red REAL NOT NULL,
+    serial_sent INTEGER NOT NULL,
+    cycle_s REAL
+);
+CREATE INDEX IF NOT EXISTS ix_schedules_ts ON schedules (intersection, ts);
+
+CREATE TABLE IF NOT EXISTS telemetry (
+    ts REAL NOT NULL,
+    intersection TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_telemetry_ts ON telemetry (intersection, ts);
+
+CREATE TABLE IF NOT EXISTS rollup_pcu (
+    res INTEGER NOT NULL,
+    intersection TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    arah TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    pcu_sum REAL NOT NULL,
+    pcu_max REAL NOT NULL,
+    car INTEGER NOT NULL,
+    motorcycle INTEGER NOT NULL,
+    bicycle INTEGER NOT NULL,
+    kendaraan_besar INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    latency_n INTEGER NOT NULL,
+    PRIMARY KEY (res, intersection, ts, arah)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_sched (
+    res INTEGER NOT NULL,
+    intersection TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    arah TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    green_sum REAL NOT NULL,
+    red_sum REAL NOT NULL,
+    PRIMARY KEY (res, intersection, ts, arah)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_cycle (
+    res INTEGER NOT NULL,
+    intersection TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    cycle_s INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (res, intersection, ts, cycle_s)
+) WITHOUT ROWID;
+"""
+
+INSERTS = {
+    "detections": "INSERT INTO detections VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+    "schedules": "INSERT INTO schedules VALUES (?,?,?,?,?,?,?,?,?)",
+    "telemetry": "INSERT INTO telemetry VALUES (?,?,?,?)",
+}
+
+ROLLUP_RES = {"minute": 60, "hour": 3600, "day": 86400}
+ROLLUP_CYCLE_BIN_S = 5
+
+UPSERTS = {
+    "rollup_pcu": """INSERT INTO rollup_pcu VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT (res, intersection, ts, arah) DO UPDATE SET
+        n = n + excluded.n, pcu_sum = pcu_sum + excluded.pcu_sum, pcu_max = max(pcu_max, excluded.pcu_max),
+        car = car + excluded.car, motorcycle = motorcycle + excluded.motorcycle,
+        bicycle = bicycle + excluded.bicycle, kendaraan_besar = kendaraan_besar + excluded.kendaraan_besar,
+        latency_sum = latency_sum + excluded.latency_sum, latency_n = latency_n + excluded.latency_n""",
+    "rollup_sched": """INSERT INTO rollup_sched VALUES (?,?,?,?,?,?,?)
+        ON CONFLICT (res, intersection, ts, arah) DO UPDATE SET
+        n = n + excluded.n, green_sum = green_sum + excluded.green_sum, red_sum = red_sum + excluded.red_sum""",
+    "rollup_cycle": """INSERT INTO rollup_cycle VALUES (?,?,?,?,?)
+        ON CONFLICT (res, intersection, ts, cycle_s) DO UPDATE SET n = n + excluded.n""",
+}
+
+# bangun ulang rollup dari raw (DB lama tanpa rollup); {b} = ekspresi bucket SQL
+_BACKFILL = {
+    "rollup_pcu": """INSERT INTO rollup_pcu SELECT ?, intersection, {b} AS bt, arah, count(*), sum(pcu), max(pcu),
+        sum(car), sum(motorcycle), sum(bicycle), sum(kendaraan_besar),
+        coalesce(sum(latency_ms), 0), count(latency_ms)
+        FROM detections GROUP BY intersection, bt, arah""",
+    "rollup_sched": """INSERT INTO rollup_sched SELECT ?, intersection, {b} AS bt, arah, count(*), sum(green), sum(red)
+        FROM schedules GROUP BY intersection, bt, arah""",
+    "rollup_cycle": """INSERT INTO rollup_cycle SELECT ?, intersection, {b} AS bt,
+        CAST(cycle_s / {bin} AS INTEGER) * {bin} AS cb, count(*)
+        FROM (SELECT DISTINCT ts, intersection, cycle_s FROM schedules WHERE cycle_s IS NOT NULL)
+        GROUP BY intersection, bt, cb""",
+}
+
+
+def connect(path: str, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum harus di-set sebelum tabel pertama dibuat
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # aman di WAL; yang hilang saat crash hanya batch terakhir
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class HistoryStore:
+    def __init__(self, path: str, batch: int = 500, flush_ms: float = 1000.0, queue_max: int = 10000,
+                 retention_days: float = 30.0, telemetry_retention_days: float = 7.0,
+                 rollup_retention_days: float = 365.0, maint_interval_s: float = 3600.0,
+                 tz_offset_s: int = 0):
+        self.path = path
+        self.batch = max(1, batch)
+        self.flush_s = max(0.01, flush_ms / 1000.0)
+        self.retention_s = {
+            "detections": retention_days * 86400.0,
+            "schedules": retention_days * 86400.0,
+            "telemetry": telemetry_retention_days * 86400.0,
+        }
+        # rollup menit ikut retensi raw, jam / hari disimpan lebih lama
+        self.rollup_retention_s = {
+            ROLLUP_RES["minute"]: retention_days * 86400.0,
+            ROLLUP_RES["hour"]: rollup_retention_days * 86400.0,
+            ROLLUP_RES["day"]: rollup_retention_days * 86400.0,
+        }
+        self.tz_offset_s = int(tz_offset_s)  # batas bucket hari = tengah malam waktu lokal
+        self.maint_interval_s = maint_interval_s
+        self._q = queue.Queue(maxsize=queue_max)
+        self._thread = None
+        self._stop = threading.Event()
+        self._conn = None
+        self.written = {t: 0 for t in INSERTS}
+        self.dropped = 0
+        self.batches = 0
+        self.last_flush_ms = None
+        self.last_maint = None
+        self.error = None
+
+    # ---------- API (dipanggil dari request path; tidak pernah blocking) ----------
+    def _put(self, table: str, rows: list):
+        if self._thread is None or not rows:
+            return
+        try:
+            self._q.put_nowait((table, rows))
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def record_detections(self, intersection: str, pcu_table: dict, source: str, model_type: str = None,
+                          latency_ms: float = None, request_id: str = None, ts: float = None):
+        ts = time.time() if ts is None else ts
+        self._put("detections", [
+            (ts, intersection, source, request_id, model_type, arah,
+             int(r["car"]), int(r["motorcycle"]), int(r["bicycle"]), int(r["kendaraan_besar"]),
+             float(r["PCU_total"]), latency_ms)
+            for arah, r in pcu_table.items()
+        ])
+
+    def record_schedule(self, intersection: str, fuzzy_table: dict, source: str, serial_sent: bool,
+                        cycle_s: float = None, ts: float = None):
+        ts = time.time() if ts is None else ts
+        self._put("schedules", [
+            (ts, intersection, source, arah, float(r["PCU_total"]), float(r["Green_time"]),
+             float(r["Red_time"]), int(bool(serial_sent)), cycle_s)
+            for arah, r in fuzzy_table.items()
+        ])
+
+    def record_telemetry(self, intersection: str, kind: str, line: str, ts: float = None):
+        self._put("telemetry", [(time.time() if ts is None else ts, intersection, kind, line)])
+
+    # ---------- writer ----------
+    def start(self):
+        if self._thread is not None:
+            return
+        d = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(d, exist_ok=True)
+        self._conn = connect(self.path)
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        self._backfill()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush sisa antrian lalu tutup."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _migrate(self):
+        cols = [r[1] for r in self._conn.execute("PRAGMA table_info(schedules)")]
+        if cols and "cycle_s" not in cols:
+            self._conn.execute("ALTER TABLE schedules ADD COLUMN cycle_s REAL")
+
+    def _bucket(self, ts: float, res: int) -> int:
+        off = self.tz_offset_s
+        return int((ts + off) // res) * res - off
+
+    def _backfill(self):
+        """Isi rollup yang masih kosong dari data raw (sekali, saat start)."""
+        with self._conn:
+            for table, sql in _BACKFILL.items():
+                if self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    continue
+                for res in ROLLUP_RES.values():
+                    b = f"(CAST(ts + {self.tz_offset_s} AS INTEGER) / {res}) * {res} - {self.tz_offset_s}"
+                    self._conn.execute(sql.format(b=b, bin=ROLLUP_CYCLE_BIN_S), (res,))
+
+    def _rollups(self, pending: dict) -> dict:
+        """Agregasi 1 batch raw -> baris UPSERT rollup (dijumlahkan ke bucket yang sudah ada)."""
+        pcu, sched, cyc = {}, {}, {}
+        for r in pending.get("detections", ()):
+            ts, inter, arah, p, lat = r[0], r[1], r[5], r[10], r[11]
+            for res in ROLLUP_RES.values():
+                k = (res, inter, self._bucket(ts, res), arah)
+                a = pcu.get(k)
+                if a is None:
+                    a = pcu[k] = [0, 0.0, p, 0, 0, 0, 0, 0.0, 0]
+                a[0] += 1
+                a[1] += p
+                a[2] = max(a[2], p)
+                a[3] += r[6]
+                a[4] += r[7]
+                a[5] += r[8]
+                a[6] += r[9]
+                if lat is not None:
+                    a[7] += lat
+                    a[8] += 1
+        seen = set()
+        for r in pending.get("schedules", ()):
+            ts, inter, arah, g, red, cycle = r[0], r[1], r[3], r[5], r[6], r[8]
+            # 1 record_schedule = 1 siklus (baris per arah punya ts sama)
+            count_cycle = cycle is not None and (ts, inter) not in seen
+            seen.add((ts, inter))
+            for res in ROLLUP_RES.values():
+                bt = self._bucket(ts, res)
+                a = sched.setdefault((res, inter, bt, arah), [0, 0.0, 0.0])
+                a[0] += 1
+                a[1] += g
+                a[2] += red
+                if count_cycle:
+                    k = (res, inter, bt, int(cycle // ROLLUP_CYCLE_BIN_S) * ROLLUP_CYCLE_BIN_S)
+                    cyc[k] = cyc.get(k, 0) + 1
+        return {
+            "rollup_pcu": [k + tuple(v) for k, v in pcu.items()],
+            "rollup_sched": [k + tuple(v) for k, v in sched.items()],
+            "rollup_cycle": [k + (v,) for k, v in cyc.items()],
+        }
+
+    def _drain(self, first):
+        pending = {}
+        n = 0
+        item = first
+        while item is not None:
+            table, rows = item
+            pending.setdefault(table, []).extend(rows)
+            n += len(rows)
+            if n >= self.batch:
+                break
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                item = None
+        return pending
+
+    def _write(self, pending: dict):
+        t0 = time.perf_counter()
+        with self._conn:  # 1 transaksi per batch
+            for table, rows in pending.items():
+                self._conn.executemany(INSERTS[table], rows)
+                self.written[table] += len(rows)
+            for table, rows in self._rollups(pending).items():
+                if rows:
+                    self._conn.executemany(UPSERTS[table], rows)
+        self.batches += 1
+        self.last_flush_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+
+    def _run(self):
+        next_maint = time.monotonic() + min(60.0, self.maint_interval_s)
+        while True:
+            try:
+                first = self._q.get(timeout=self.flush_s)
+            except queue.Empty:
+                first = None
+            if first is not None:
+                # tunggu sebentar supaya batch terkumpul (kecuali sudah penuh)
+                if self._q.qsize() < self.batch and not self._stop.is_set():
+                    self._stop.wait(self.flush_s)
+                try:
+                    self._write(self._drain(first))
+                    while self._q.qsize() >= self.batch:
+                        self._write(self._drain(self._q.get_nowait()))
+                    self.error = None
+                except Exception as e:
+                    self.error = repr(e)
+                    print("[HISTORY] write error:", repr(e))
+            if time.monotonic() >= next_maint:
+                self.maintain()
+                next_maint = time.monotonic() + self.maint_interval_s
+            if self._stop.is_set() and self._q.empty():
+                break
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+        except Exception:
+            pass
+
+    def maintain(self, now: float = None):
+        """Retensi + kompaksi (dipanggil thread writer; aman dipanggil manual saat writer berhenti)."""
+        now = time.time() if now is None else now
+        t0 = time.perf_counter()
+        deleted = {}
+        try:
+            with self._conn:
+                for table, keep_s in self.retention_s.items():
+                    if keep_s > 0:
+                        cur = self._conn.execute(f"DELETE FROM {table} WHERE ts < ?", (now - keep_s,))
+                        deleted[table] = cur.rowcount
+                for res, keep_s in self.rollup_retention_s.items():
+                    if keep_s > 0:
+                        for table in UPSERTS:
+                            cur = self._conn.execute(f"DELETE FROM {table} WHERE res = ? AND ts < ?",
+                                                     (res, now - keep_s))
+                            deleted[table] = deleted.get(table, 0) + cur.rowcount
+            if any(deleted.values()):
+                self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("PRAGMA optimize")
+        except Exception as e:
+            self.error = repr(e)
+            print("[HISTORY] maintenance error:", repr(e))
+            return None
+        self.last_maint = {"ts": now, "deleted": deleted, "ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+        return self.last_maint
+
+    def stats(self) -> dict:
+        size = None
+        try:
+            size = os.path.getsize(self.path) + (os.path.getsize(self.path + "-wal") if os.path.exists(self.path + "-wal") else 0)
+        except OSError:
+            pass
+        return {
+            "enabled": self._thread is not None,
+            "path": self.path,
+            "queued": self._q.qsize(),
+            "written": dict(self.written),
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+            "last_maintenance": self.last_maint,
+            "bytes": size,
+            "error": self.error,
+        }
+
+
+# ===================== QUERY (ROLLUP) =====================
+# kind -> (kolom + tipe arrow, SQL). Parameter: :res, :intersection, :start, :end, :arah (None = semua)
+QUERIES = {
+    "pcu": (
+        [("ts", "int64"), ("arah", "string"), ("n", "int64"), ("pcu_avg", "float64"), ("pcu_max", "float64"),
+         ("car_avg", "float64"), ("motorcycle_avg", "float64"), ("bicycle_avg", "float64"),
+         ("kendaraan_besar_avg", "float64"), ("latency_avg_ms", "float64")],
+        """SELECT ts, arah, n, round(pcu_sum / n, 3), pcu_max,
+            round(1.0 * car / n, 3), round(1.0 * motorcycle / n, 3), round(1.0 * bicycle / n, 3),
+            round(1.0 * kendaraan_besar / n, 3),
+            CASE WHEN latency_n > 0 THEN round(latency_sum / latency_n, 2) END
+        FROM rollup_pcu WHERE res = :res AND intersection = :intersection AND ts >= :start AND ts < :end
+            AND (:arah IS NULL OR arah = :arah)
+        ORDER BY ts, arah""",
+    ),
+    "green_split": (
+        [("ts", "int64"), ("arah", "string"), ("n", "int64"), ("green_avg", "float64"), ("red_avg", "float64"),
+         ("green_split", "float64")],
+        """SELECT * FROM (
+            SELECT ts, arah, n, round(green_sum / n, 2), round(red_sum / n, 2),
+                round((green_sum / n) / sum(green_sum / n) OVER (PARTITION BY ts), 4) AS split
+            FROM rollup_sched WHERE res = :res AND intersection = :intersection AND ts >= :start AND ts < :end
+        ) WHERE (:arah IS NULL OR arah = :arah)
+        ORDER BY ts, arah""",
+    ),
+    "cycle_length": (
+        [("cycle_s", "int64"), ("n", "int64")],
+        """SELECT cycle_s, sum(n) FROM rollup_cycle
+        WHERE res = :res AND intersection = :intersection AND ts >= :start AND ts < :end
+        GROUP BY cycle_s ORDER BY cycle_s""",
+    ),
+}
+
+QUERY_CHUNK_ROWS = 5000
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def query_rows(path: str, kind: str, intersection: str, res: int, start: float, end: float, arah: str = None,
+               chunk: int = QUERY_CHUNK_ROWS):
+    """Generator chunk baris (list of tuple) dari tabel rollup; koneksi read-only sendiri (WAL: tidak memblok writer)."""
+    _, sql = QUERIES[kind]
+    conn = connect(path, readonly=True)
+    try:
+        cur = conn.execute(sql, {"res": res, "intersection": intersection, "start": start, "end": end, "arah": arah})
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def encode_ndjson(kind: str, chunks):
+    names = [c for c, _ in QUERIES[kind][0]]
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(names, r))) + "\n" for r in rows).encode("utf-8")
+
+
+def encode_arrow(kind: str, chunks):
+    """Arrow IPC stream: 1 record batch per chunk (butuh pyarrow)."""
+    cols = QUERIES[kind][0]
+    schema = pa.schema([(c, getattr(pa, t)()) for c, t in cols])
+    buf = io.BytesIO()
+    writer = pa.ipc.new_stream(buf, schema)
+
+    def take():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return data
+
+    yield take()  # schema
+    for rows in chunks:
+        arrays = [pa.array([r[i] for r in rows], type=schema.field(i).type) for i in range(len(cols))]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield take()
+    writer.close()
+    yield take()
@@ -0,0 +1,521 @@
+"""
+Backend ONNX Runtime (CPU) untuk YOLO / RT-DETR / FCOS.
+
+- Export sekali dari .pt/.pth ke ONNX, hasilnya di-cache di ONNX_CACHE_DIR
+  (di-export ulang kalau file sumber lebih baru).
+- OnnxDetector.predict(frames) -> list (boxes_xyxy, cls_ids, scores) di koordinat gambar asli;
+  post-processing kategori/PCU tetap di server.py (postprocess_detections), jadi kontrak
+  (dets, agg_counts, agg_pcu) sama persis dengan jalur PyTorch.
+
+Parity check (PyTorch vs ONNX):
+    python onnx_backend.py parity --images folder_gambar --models yolo,fcos,rtdetr
+
+INT8 (ONNX Runtime quantization, dynamic / static + kalibrasi pakai folder frame simpang):
+    python onnx_backend.py quantize --models yolo,fcos
+    python onnx_backend.py quant-report --images folder_gambar --models yolo,fcos
+"""
+import argparse
+import ast
+import os
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    HAS_ORT = True
+except ImportError:
+    ort = None
+    HAS_ORT = False
+
+
+# ===================== CONFIG =====================
+ONNX_CACHE_DIR = os.getenv("SIGMA_ONNX_DIR", "onnx_cache")
+ORT_INTRA_THREADS = int(os.getenv("SIGMA_ORT_INTRA_THREADS", "0"))  # 0 = default ORT (semua core)
+ORT_INTER_THREADS = int(os.getenv("SIGMA_ORT_INTER_THREADS", "1"))
+ONNX_OPSET = int(os.getenv("SIGMA_ONNX_OPSET", "17"))
+
+NMS_MAX_WH = 7680      # offset per kelas (sama dgn ultralytics)
+NMS_MAX_CANDIDATES = 30000
+
+
+# ===================== EXPORT + CACHE =====================
+def _cache_path(src_path: str, imgsz: int, suffix: str = "") -> str:
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    return os.path.join(ONNX_CACHE_DIR, f"{stem}.imgsz{imgsz}{suffix}.onnx")
+
+def _is_fresh(artifact: str, src_path: str) -> bool:
+    if not os.path.exists(artifact):
+        return False
+    if not os.path.exists(src_path):
+        return True  # sumber hilang tapi artifact ada -> pakai artifact
+    return os.path.getmtime(artifact) >= os.path.getmtime(src_path)
+
+def export_ultralytics(kind: str, pt_path: str, imgsz: int) -> str:
+    out = _cache_path(pt_path, imgsz)
+    if _is_fresh(out, pt_path):
+        return out
+
+    from ultralytics import YOLO, RTDETR
+    model = RTDETR(pt_path) if kind == "rtdetr" else YOLO(pt_path)
+    print(f"[ONNX] exporting {kind} -> {out}")
+    exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=False, opset=ONNX_OPSET)
+
+    os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+    shutil.move(str(exported), out)
+    return out
+
+def export_fcos(pth_path: str, imgsz: int, torch_factory) -> str:
+    """torch_factory() -> model FCOS torchvision yang sudah load state dict."""
+    out = _cache_path(pth_path, imgsz)
+    if _is_fresh(out, pth_path):
+        return out
+
+    import torch
+    model = torch_factory().to("cpu").eval()
+    dummy = torch.rand(3, imgsz, imgsz)
+    print(f"[ONNX] exporting fcos -> {out}")
+    os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+    tmp = out + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            ([dummy],),
+            tmp,
+            opset_version=ONNX_OPSET,
+            input_names=["image"],
+            output_names=["boxes", "scores", "labels"],
+            dynamic_axes={
+                "image": {1: "height", 2: "width"},
+                "boxes": {0: "n"},
+                "scores": {0: "n"},
+                "labels": {0: "n"},
+            },
+        )
+    os.replace(tmp, out)
+    return out
+
+
+# ===================== SESSION =====================
+def make_session(onnx_path: str):
+    if not HAS_ORT:
+        raise RuntimeError("onnxruntime belum terinstall (pip install onnxruntime).")
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if ORT_INTRA_THREADS > 0:
+        so.intra_op_num_threads = ORT_INTRA_THREADS
+    if ORT_INTER_THREADS > 0:
+        so.inter_op_num_threads = ORT_INTER_THREADS
+    return ort.InferenceSession(onnx_path, sess_options=so, providers=["CPUExecutionProvider"])
+
+def _names_from_metadata(sess):
+    meta = sess.get_modelmeta().custom_metadata_map or {}
+    raw = meta.get("names")
+    if not raw:
+        return None
+    try:
+        return {int(k): v for k, v in ast.literal_eval(raw).items()}
+    except Exception:
+        return None
+
+
+# ===================== PRE / POST PROCESS =====================
+def letterbox(bgr, size: int, scale_fill: bool = False):
+    """
+    Sama dengan ultralytics LetterBox(auto=False).
+    Return: (img, gain_xy, pad_xy)
+    """
+    h, w = bgr.shape[:2]
+    if scale_fill:
+        img = cv2.resize(bgr, (size, size), interpolation=cv2.INTER_LINEAR)
+        return img, (size / w, size / h), (0.0, 0.0)
+
+    r = min(size / h, size / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    if (new_w, new_h) != (w, h):
+        bgr = cv2.resize(bgr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(bgr, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return img, (r, r), (float(left), float(top))
+
+def _to_nchw(imgs):
+    """list BGR uint8 (S, S, 3) -> float32 (B, 3, S, S) RGB / 255."""
+    batch = np.stack(imgs)[..., ::-1]
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) * (1.0 / 255.0)
+
+def xywh2xyxy(b):
+    out = np.empty_like(b)
+    out[:, 0] = b[:, 0] - b[:, 2] / 2
+    out[:, 1] = b[:, 1] - b[:, 3] / 2
+    out[:, 2] = b[:, 0] + b[:, 2] / 2
+    out[:, 3] = b[:, 1] + b[:, 3] / 2
+    return out
+
+def nms(boxes, scores, iou_thresh: float):
+    """NMS numpy biasa (boxes xyxy). Return index yang dipertahankan, urut skor turun."""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thresh]
+    return np.asarray(keep, dtype=np.int64)
+
+def _scale_back(boxes, gain, pad, shape):
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / gain[0]
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / gain[1]
+    h, w = shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+    return boxes
+
+
+# ===================== DETECTOR =====================
+class OnnxDetector:
+    """
+    Pengganti model ultralytics / torchvision di ModelRegistry.
+    predict(frames) -> list (boxes_xyxy float32 (N,4), cls_ids int64 (N,), scores float32 (N,)).
+    """
+    backend = "onnx"
+
+    def __init__(self, kind: str, onnx_path: str, imgsz: int, conf: float, iou: float = 0.6,
+                 max_det: int = 500, names=None):
+        self.kind = kind
+        self.path = onnx_path
+        self.imgsz = int(imgsz)
+        self.conf = float(conf)
+        self.iou = float(iou)
+        self.max_det = int(max_det)
+        self.session = make_session(onnx_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = names or _names_from_metadata(self.session) or {}
+        self.nbytes = os.path.getsize(onnx_path)
+
+    def predict(self, frames):
+        if not frames:
+            return []
+        if self.kind == "fcos":
+            return [self._predict_fcos(f) for f in frames]
+
+        scale_fill = self.kind == "rtdetr"
+        prepped = [letterbox(f, self.imgsz, scale_fill=scale_fill) for f in frames]
+        batch = _to_nchw([p[0] for p in prepped])
+        raw = self.session.run(None, {self.input_name: batch})[0]
+
+        out = []
+        for i, frame in enumerate(frames):
+            _, gain, pad = prepped[i]
+            if self.kind == "rtdetr":
+                out.append(self._post_rtdetr(raw[i], frame.shape))
+            else:
+                out.append(self._post_yolo(raw[i], gain, pad, frame.shape))
+        return out
+
+    def _post_yolo(self, pred, gain, pad, shape):
+        # pred: (4 + nc, A) -> (A, 4 + nc)
+        pred = pred.T
+        cls_scores = pred[:, 4:]
+        cls_ids = cls_scores.argmax(1)
+        scores = cls_scores[np.arange(len(cls_ids)), cls_ids]
+        m = scores > self.conf
+        boxes, scores, cls_ids = xywh2xyxy(pred[m, :4]), scores[m], cls_ids[m]
+
+        if scores.size > NMS_MAX_CANDIDATES:
+            top = scores.argsort()[::-1][:NMS_MAX_CANDIDATES]
+            boxes, scores, cls_ids = boxes[top], scores[top], cls_ids[top]
+
+        keep = nms(boxes + (cls_ids[:, None] * NMS_MAX_WH), scores, self.iou)[: self.max_det]
+        boxes = _scale_back(boxes[keep], gain, pad, shape)
+        return boxes.astype(np.float32), cls_ids[keep].astype(np.int64), scores[keep].astype(np.float32)
+
+    def _post_rtdetr(self, pred, shape):
+        # pred: (Q, 4 + nc) -> cxcywh ternormalisasi + skor (sudah sigmoid)
+        cls_scores = pred[:, 4:]
+        cls_ids = cls_scores.argmax(1)
+        scores = cls_scores[np.arange(len(cls_ids)), cls_ids]
+        m = scores > self.conf
+        boxes = xywh2xyxy(pred[m, :4])
+        h, w = shape[:2]
+        boxes[:, [0, 2]] *= w
+        boxes[:, [1, 3]] *= h
+        order = scores[m].argsort()[::-1][: self.max_det]
+        return boxes[order].astype(np.float32), cls_ids[m][order].astype(np.int64), scores[m][order].astype(np.float32)
+
+    def _predict_fcos(self, bgr):
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        x = np.ascontiguousarray(rgb.transpose(2, 0, 1), dtype=np.float32) * (1.0 / 255.0)
+        boxes, scores, labels = self.session.run(None, {self.input_name: x})
+        return boxes.astype(np.float32), labels.astype(np.int64), scores.astype(np.float32)
+
+def load_detector(kind: str, src_path: str, imgsz: int, conf: float, torch_factory=None, names=None):
+    if kind == "fcos":
+        onnx_path = export_fcos(src_path, imgsz, torch_factory)
+    else:
+        onnx_path = export_ultralytics(kind, src_path, imgsz)
+    print(f"[ONNX] {kind} session <- {onnx_path}")
+    return OnnxDetector(kind, onnx_path, imgsz, conf, names=names)
+
+
+# ===================== INT8 QUANTIZATION =====================
+# static butuh folder kalibrasi (frame simpang asli); "auto" = static kalau folder ada, else dynamic
+INT8_MODE = os.getenv("SIGMA_INT8_MODE", "auto").lower()  # auto | static | dynamic
+CALIB_DIR = os.getenv("SIGMA_CALIB_DIR", "calib_frames")
+CALIB_MAX_IMAGES = int(os.getenv("SIGMA_CALIB_MAX_IMAGES", "64"))
+# hanya Conv/MatMul yang dikuantisasi; decode box / NMS tetap float (paling sensitif)
+INT8_OP_TYPES = ["Conv", "MatMul"]
+
+def resolve_int8_mode(mode: str = None) -> str:
+    mode = (mode or INT8_MODE).lower()
+    if mode == "auto":
+        return "static" if _image_files(CALIB_DIR) else "dynamic"
+    if mode not in ("static", "dynamic"):
+        raise ValueError(f"SIGMA_INT8_MODE tidak dikenal: {mode}")
+    return mode
+
+class FrameCalibrationReader:
+    """
+    CalibrationDataReader (duck-typed) untuk quantize_static: frame dari CALIB_DIR,
+    di-preprocess persis seperti OnnxDetector.predict (batch 1).
+    """
+    def __init__(self, kind: str, input_name: str, imgsz: int, folder: str, max_images: int):
+        self.kind = kind
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.frames = [img for _, img in _load_images(folder, max_images)]
+        if not self.frames:
+            raise RuntimeError(f"Folder kalibrasi kosong / tidak ada: {folder}")
+        self._it = iter(self.frames)
+
+    def _prep(self, bgr):
+        if self.kind == "fcos":
+            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+            return np.ascontiguousarray(rgb.transpose(2, 0, 1), dtype=np.float32) * (1.0 / 255.0)
+        img, _, _ = letterbox(bgr, self.imgsz, scale_fill=(self.kind == "rtdetr"))
+        return _to_nchw([img])
+
+    def get_next(self):
+        bgr = next(self._it, None)
+        return None if bgr is None else {self.input_name: self._prep(bgr)}
+
+    def rewind(self):
+        self._it = iter(self.frames)
+
+def quantize_model(kind: str, fp32_path: str, imgsz: int, mode: str = None) -> str:
+    mode = resolve_int8_mode(mode)
+    out = fp32_path[: -len(".onnx")] + f".int8-{mode}.onnx"
+    if _is_fresh(out, fp32_path):
+        return out
+
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    print(f"[INT8] quantizing {kind} ({mode}) -> {out}")
+    tmp = out + ".tmp"
+    if mode == "dynamic":
+        quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8, op_types_to_quantize=INT8_OP_TYPES)
+    else:
+        input_name = make_session(fp32_path).get_inputs()[0].name
+        reader = FrameCalibrationReader(kind, input_name, imgsz, CALIB_DIR, CALIB_MAX_IMAGES)
+        quantize_static(
+            fp32_path,
+            tmp,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            op_types_to_quantize=INT8_OP_TYPES,
+        )
+    os.replace(tmp, out)
+    return out
+
+def _names_from_onnx_file(path: str):
+    try:
+        import onnx
+        meta = {p.key: p.value for p in onnx.load(path, load_external_data=False).metadata_props}
+        return {int(k): v for k, v in ast.literal_eval(meta["names"]).items()}
+    except Exception:
+        return None
+
+def load_int8_detector(kind: str, src_path: str, imgsz: int, conf: float, torch_factory=None, mode: str = None):
+    if kind == "fcos":
+        fp32_path = export_fcos(src_path, imgsz, torch_factory)
+    else:
+        fp32_path = export_ultralytics(kind, src_path, imgsz)
+    q_path = quantize_model(kind, fp32_path, imgsz, mode)
+    print(f"[INT8] {kind} session <- {q_path}")
+    # metadata (names) belum tentu ikut ke model hasil quantize -> ambil dari model fp32
+    return OnnxDetector(kind, q_path, imgsz, conf, names=_names_from_onnx_file(fp32_path))
+
+
+# ===================== PARITY CHECK =====================
+def _box_iou(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = (rb - lt).clip(0).prod(-1)
+    area_a = (a[:, 2:4] - a[:, :2]).clip(0).prod(-1)
+    area_b = (b[:, 2:4] - b[:, :2]).clip(0).prod(-1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def _matched_ratio(dets_a, dets_b, iou_thresh=0.5):
+    """Porsi box A yang punya pasangan (kategori sama, IoU >= thresh) di B."""
+    if len(dets_a) == 0:
+        return 1.0 if len(dets_b) == 0 else 0.0
+    if len(dets_b) == 0:
+        return 0.0
+    iou = _box_iou(dets_a[:, :4].astype(np.float64), dets_b[:, :4].astype(np.float64))
+    same = dets_a[:, None, 4] == dets_b[None, :, 4]
+    return float(((iou >= iou_thresh) & same).any(1).mean())
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+def _image_files(folder: str):
+    """Nama file gambar (urut) di folder, tanpa decode; folder tidak ada -> []."""
+    if not folder or not os.path.isdir(folder):
+        return []
+    return [fn for fn in sorted(os.listdir(folder)) if fn.lower().endswith(IMAGE_EXTS)]
+
+def _load_images(folder: str, max_images: int = None):
+    out = []
+    for fn in _image_files(folder):
+        if max_images is not None and len(out) >= max_images:
+            break
+        img = cv2.imread(os.path.join(folder, fn), cv2.IMREAD_COLOR)
+        if img is not None:
+            out.append((fn, img))
+    return out
+
+def compare_backends(server, kind: str, ref_model, test_model, images, label_ref="torch", label_test="onnx"):
+    """
+    Jalankan 2 model (jalur server yang sama) di gambar yang sama, bandingkan counts/PCU/box.
+    Return: dict ringkasan.
+    """
+    frames = [img for _, img in images]
+
+    t0 = time.perf_counter()
+    ref = server.predict_with_model(kind, ref_model, frames)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    test = server.predict_with_model(kind, test_model, frames)
+    t_test = time.perf_counter() - t0
+
+    rows = []
+    for (fn, _), (d_r, c_r, p_r), (d_t, c_t, p_t) in zip(images, ref, test):
+        rows.append({
+            "image": fn,
+            "counts_equal": c_r == c_t,
+            "count_abs_diff": sum(abs(c_r[k] - c_t[k]) for k in c_r),
+            "pcu_ref": round(p_r, 2),
+            "pcu_test": round(p_t, 2),
+            "pcu_abs_diff": round(abs(p_r - p_t), 2),
+            "box_match": round(_matched_ratio(d_r, d_t), 3),
+        })
+
+    n = max(1, len(rows))
+    return {
+        "model": kind,
+        "images": len(rows),
+        "counts_agreement": round(sum(r["counts_equal"] for r in rows) / n, 3),
+        "mean_pcu_abs_diff": round(sum(r["pcu_abs_diff"] for r in rows) / n, 3),
+        "mean_box_match": round(sum(r["box_match"] for r in rows) / n, 3),
+        f"{label_ref}_ms_per_img": round(t_ref * 1000 / n, 1),
+        f"{label_test}_ms_per_img": round(t_test * 1000 / n, 1),
+        "speedup": round(t_ref / t_test, 2) if t_test > 0 else None,
+        "rows": rows,
+    }
+
+def _print_report(rep, verbose=False):
+    print(f"\n=== {rep['model']} ({rep['images']} images) ===")
+    for k, v in rep.items():
+        if k not in ("rows", "model", "images"):
+            print(f"  {k:22s} {v}")
+    if verbose:
+        for r in rep["rows"]:
+            print("   ", r)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ONNX Runtime backend tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("parity", help="bandingkan PyTorch vs ONNX di folder gambar")
+    p.add_argument("--images", required=True)
+    p.add_argument("--models", default="yolo,fcos,rtdetr")
+    p.add_argument("--min-agreement", type=float, default=0.9,
+                   help="exit code 1 kalau counts_agreement di bawah nilai ini")
+    p.add_argument("-v", "--verbose", action="store_true")
+
+    e = sub.add_parser("export", help="export + cache ONNX saja")
+    e.add_argument("--models", default="yolo,fcos,rtdetr")
+
+    q = sub.add_parser("quantize", help="buat + cache model INT8")
+    q.add_argument("--models", default="yolo,fcos")
+    q.add_argument("--mode", choices=["auto", "static", "dynamic"], default=None)
+
+    r = sub.add_parser("quant-report", help="akurasi (counts/PCU) + speedup INT8 vs FP32 PyTorch")
+    r.add_argument("--images", required=True)
+    r.add_argument("--models", default="yolo,fcos")
+    r.add_argument("--mode", choices=["auto", "static", "dynamic"], default=None)
+    r.add_argument("-v", "--verbose", action="store_true")
+
+    args = ap.parse_args(argv)
+
+    import server  # import di sini: server.py juga mengimport modul ini (lazy)
+    kinds = [k.strip().lower() for k in args.models.split(",") if k.strip()]
+
+    if args.cmd == "export":
+        for kind in kinds:
+            server.load_onnx_detector(kind)
+        return 0
+
+    if args.cmd == "quantize":
+        for kind in kinds:
+            server.load_int8_detector(kind, mode=args.mode)
+        return 0
+
+    images = _load_images(args.images)
+    if not images:
+        print("Tidak ada gambar di", args.images)
+        return 2
+
+    if args.cmd == "quant-report":
+        for kind in kinds:
+            try:
+                ref_model = server.load_torch_model(kind)
+                test_model = server.load_int8_detector(kind, mode=args.mode)
+            except Exception as ex:
+                print(f"[INT8] skip {kind}: {ex}")
+                continue
+            rep = compare_backends(server, kind, ref_model, test_model, images, label_ref="fp32", label_test="int8")
+            _print_report(rep, args.verbose)
+        return 0
+
+    ok = True
+    for kind in kinds:
+        try:
+            ref_model = server.load_torch_model(kind)
+            test_model = server.load_onnx_detector(kind)
+        except Exception as ex:
+            print(f"[PARITY] skip {kind}: {ex}")
+            continue
+        rep = compare_backends(server, kind, ref_model, test_model, images)
+        _print_report(rep, args.verbose)
+        ok &= rep["counts_agreement"] >= args.min_agreement
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
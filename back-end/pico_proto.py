@@ -0,0 +1,108 @@
+"""
+Protokol serial PC <-> Pico (versi V1) + histogram latency.
+
+PC -> Pico (jadwal):
+    $V1,<seq>,gU,rU,gT,rT,gS,rS,gB,rB*<CS>\n
+    CS = XOR semua byte di antara '$' dan '*', 2 digit hex (gaya NMEA).
+
+Pico -> PC:
+    ACK,<seq>              frame diterima & checksum valid (jadwal masuk pending)
+    NAK,<seq>              checksum salah -> PC kirim ulang
+    SCHED,gU,...,rB[,seq]  jadwal mulai dipakai (seq opsional; tanpa seq dicocokkan dari nilainya)
+    RT,...                 sama seperti sebelumnya
+Baris Pico boleh juga dibungkus "$<baris>*<CS>"; checksum salah -> baris dibuang.
+
+Format lama (baris polos gU,rU,...,rB) tetap didukung: server fallback otomatis kalau Pico
+tidak pernah membalas ACK (lihat SIGMA_PICO_PROTO di server.py).
+"""
+import bisect
+
+PROTO_VERSION = "V1"
+
+
+def checksum(body: str) -> str:
+    x = 0
+    for b in body.encode("utf-8"):
+        x ^= b
+    return f"{x:02X}"
+
+
+def frame(body: str) -> str:
+    return f"${body}*{checksum(body)}\n"
+
+
+def encode_schedule(seq: int, payload: str) -> str:
+    """payload = 'gU,rU,gT,rT,gS,rS,gB,rB' -> frame V1 lengkap dengan newline."""
+    return frame(f"{PROTO_VERSION},{seq},{payload}")
+
+
+def unframe(line: str):
+    """
+    '$body*CS' -> body. Baris polos dikembalikan apa adanya.
+    ValueError kalau frame rusak / checksum tidak cocok.
+    """
+    if not line.startswith("$"):
+        return line
+    star = line.rfind("*")
+    if star < 0:
+        raise ValueError("frame tanpa checksum")
+    body, cs = line[1:star], line[star + 1:].strip()
+    if cs.upper() != checksum(body):
+        raise ValueError("checksum salah")
+    return body
+
+
+def decode_schedule(body: str):
+    """Kebalikan encode_schedule (untuk sisi Pico / simulator): return (seq, [8 nilai]) ."""
+    parts = body.split(",")
+    if len(parts) != 10 or parts[0] != PROTO_VERSION:
+        raise ValueError("bukan frame jadwal V1")
+    return int(parts[1]), [float(v) for v in parts[2:]]
+
+
+def schedule_values(payload: str):
+    """'gU,rU,...' -> tuple int (untuk mencocokkan SCHED tanpa seq)."""
+    return tuple(int(round(float(v))) for v in payload.split(",")[:8])
+
+
+# ===================== HISTOGRAM =====================
+LATENCY_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, 120000)
+
+
+class LatencyHistogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # bucket terakhir = > bound terbesar
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.n += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float):
+        """Perkiraan (batas atas bucket)."""
+        if self.n == 0:
+            return None
+        rank = q * self.n
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank and c:
+                return self.bounds[i] if i < len(self.bounds) else round(self.max, 1)
+        return round(self.max, 1)
+
+    def stats(self) -> dict:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.n,
+            "mean_ms": round(self.total / self.n, 1) if self.n else None,
+            "max_ms": round(self.max, 1) if self.n else None,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {l: c for l, c in zip(labels, self.counts) if c},
+        }
@@ -0,0 +1,407 @@
+"""
+Pico virtual di pseudo-terminal (POSIX) untuk test / benchmark end-to-end tanpa board.
+
+    python pico_sim.py run --link /tmp/pico --time-scale 10
+    SIGMA_SERIAL_PORT=/tmp/pico uvicorn server:app
+
+    python pico_sim.py bench --url http://127.0.0.1:8000 --images ../samples -n 20
+
+Perilaku meniru firmware:
+- terima jadwal (frame V1 "$V1,seq,...*CS" -> ACK/NAK, atau baris polos gU,rU,...,rB)
+- jadwal masuk pending, dipakai di awal siklus berikutnya selama 1 siklus, lalu kembali default
+- siklus per arah: all_red -> yellow -> green -> all_red (URUTAN UTARA, TIMUR, SELATAN, BARAT)
+- kirim "SCHED,..." tiap awal siklus (+ ",seq" kalau jadwal V1 baru dipakai) dan "RT,..." tiap 1/rt_hz detik
+
+Gangguan yang bisa diatur: jitter kirim, drop baris masuk/keluar, batas baud.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+import pico_proto
+
+URUTAN_ARAH = ["UTARA", "TIMUR", "SELATAN", "BARAT"]
+YELLOW_TIME = 1.5
+ALL_RED_TIME = 1.0
+DEFAULT_GREEN = 10.0
+DEFAULT_RED = 42.0
+
+
+def build_timeline(greens: dict, yellow: float = YELLOW_TIME, all_red: float = ALL_RED_TIME):
+    tl = []
+    for arah in URUTAN_ARAH:
+        tl.append((arah, "all_red", all_red))
+        tl.append((arah, "yellow", yellow))
+        tl.append((arah, "green", greens[arah]))
+        tl.append((arah, "all_red", all_red))
+    return tl
+
+
+def red_remaining(tl, idx: int, remaining: float) -> dict:
+    """Waktu sampai tiap arah masuk green (0 untuk arah yang sedang green)."""
+    out = {}
+    for target in URUTAN_ARAH:
+        arah, ph, _ = tl[idx]
+        if arah == target and ph == "green":
+            out[target] = 0
+            continue
+        t = remaining
+        for k in range(1, len(tl) + 1):
+            a, p, d = tl[(idx + k) % len(tl)]
+            if a == target and p == "green":
+                break
+            t += d
+        out[target] = int(round(t))
+    return out
+
+
+class VirtualPico:
+    def __init__(self, proto: str = "v1", time_scale: float = 1.0, rt_hz: float = 1.0,
+                 jitter_ms: float = 0.0, rx_drop: float = 0.0, tx_drop: float = 0.0,
+                 baud: int = 0, yellow: float = YELLOW_TIME, all_red: float = ALL_RED_TIME,
+                 seed=None):
+        self.proto = proto
+        self.time_scale = max(time_scale, 1e-3)
+        self.rt_period = 1.0 / max(rt_hz, 0.01)
+        self.jitter_s = jitter_ms / 1000.0
+        self.rx_drop = rx_drop
+        self.tx_drop = tx_drop
+        self.baud = baud
+        self.yellow = yellow
+        self.all_red = all_red
+        self.rng = random.Random(seed)
+
+        self.default = {a: (DEFAULT_GREEN, DEFAULT_RED) for a in URUTAN_ARAH}
+        self.current = dict(self.default)
+        self.pending = None       # (sched, seq|None)
+        self.one_shot = False
+        self.applied_seq = None
+
+        self.master = self.slave = None
+        self.link = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._txq = []
+        self._txn = itertools.count()
+        self._txcv = threading.Condition()
+        self.stats = {"rx_lines": 0, "rx_dropped": 0, "tx_lines": 0, "tx_dropped": 0,
+                      "acks": 0, "naks": 0, "applied": 0, "cycles": 0}
+
+    # ---------- pty ----------
+    def open(self, link: str = None) -> str:
+        import pty
+        import tty
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)  # tanpa echo / translasi newline
+        path = os.ttyname(self.slave)
+        if link:
+            try:
+                os.unlink(link)
+            except FileNotFoundError:
+                pass
+            os.symlink(path, link)
+            self.link = link
+        return link or path
+
+    def close(self):
+        self._stop.set()
+        with self._txcv:
+            self._txcv.notify_all()
+        if self.link:
+            try:
+                os.unlink(self.link)
+            except OSError:
+                pass
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    # ---------- TX (jitter, drop, baud) ----------
+    def emit(self, line: str):
+        if self.tx_drop and self.rng.random() < self.tx_drop:
+            self.stats["tx_dropped"] += 1
+            return
+        due = time.monotonic() + (self.rng.uniform(0, self.jitter_s) if self.jitter_s else 0.0)
+        with self._txcv:
+            heapq.heappush(self._txq, (due, next(self._txn), line))
+            self._txcv.notify()
+
+    def _tx_loop(self):
+        while not self._stop.is_set():
+            with self._txcv:
+                while not self._txq and not self._stop.is_set():
+                    self._txcv.wait()
+                if self._stop.is_set():
+                    return
+                due, _, line = self._txq[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._txcv.wait(wait)
+                    continue
+                heapq.heappop(self._txq)
+            data = (line + "\n").encode("utf-8")
+            try:
+                os.write(self.master, data)
+            except OSError:
+                return
+            self.stats["tx_lines"] += 1
+            if self.baud:
+                time.sleep(len(data) * 10.0 / self.baud)  # 8N1 = 10 bit per byte
+
+    # ---------- RX ----------
+    def _rx_loop(self):
+        buf = b""
+        while not self._stop.is_set():
+            try:
+                chunk = os.read(self.master, 512)
+            except OSError:
+                return
+            if not chunk:
+                return
+            if self.baud:
+                time.sleep(len(chunk) * 10.0 / self.baud)
+            buf += chunk
+            while b"\n" in buf:
+                raw, buf = buf.split(b"\n", 1)
+                line = raw.decode("utf-8", errors="ignore").strip()
+                if not line:
+                    continue
+                if self.rx_drop and self.rng.random() < self.rx_drop:
+                    self.stats["rx_dropped"] += 1
+                    continue
+                self.stats["rx_lines"] += 1
+                self.handle_line(line)
+
+    def handle_line(self, line: str):
+        if line.startswith("$"):
+            if self.proto == "plain":
+                return  # firmware lama: tidak kenal frame
+            try:
+                seq, vals = pico_proto.decode_schedule(pico_proto.unframe(line))
+            except ValueError:
+                self.stats["naks"] += 1
+                parts = line[1:].split(",")
+                if len(parts) > 1 and parts[1].isdigit():
+                    self.emit(f"NAK,{parts[1]}")
+                return
+            self._set_pending(vals, seq)
+            self.stats["acks"] += 1
+            self.emit(f"ACK,{seq}")
+            return
+        try:
+            vals = [float(v) for v in line.split(",")]
+        except ValueError:
+            return
+        if len(vals) == 8:
+            self._set_pending(vals, None)
+
+    def _set_pending(self, vals, seq):
+        sched = {a: (vals[2 * i], vals[2 * i + 1]) for i, a in enumerate(URUTAN_ARAH)}
+        with self._lock:
+            self.pending = (sched, seq)
+
+    # ---------- siklus ----------
+    def _start_cycle(self):
+        with self._lock:
+            seq = None
+            if self.pending is not None:
+                self.current, seq = self.pending
+                self.pending = None
+                self.one_shot = True
+                self.stats["applied"] += 1
+                self.applied_seq = seq
+            elif self.one_shot:
+                self.current = dict(self.default)
+                self.one_shot = False
+            sched = self.current
+        self.stats["cycles"] += 1
+        vals = []
+        for a in URUTAN_ARAH:
+            vals += [str(int(round(sched[a][0]))), str(int(round(sched[a][1])))]
+        self.emit("SCHED," + ",".join(vals) + (f",{seq}" if seq is not None and self.proto == "v1" else ""))
+        return build_timeline({a: sched[a][0] for a in URUTAN_ARAH}, self.yellow, self.all_red)
+
+    def _emit_rt(self, tl, idx, remaining):
+        arah, ph, _ = tl[idx]
+        rem = int(round(remaining))
+        greens = {a: (rem if (a == arah and ph == "green") else 0) for a in URUTAN_ARAH}
+        reds = red_remaining(tl, idx, remaining)
+        self.emit("RT,{},{},{},{},{},{},{},{},{},{}".format(
+            arah, rem,
+            *(greens[a] for a in URUTAN_ARAH),
+            *(reds[a] for a in URUTAN_ARAH),
+        ))
+
+    def run(self):
+        threading.Thread(target=self._rx_loop, name="pico-rx", daemon=True).start()
+        threading.Thread(target=self._tx_loop, name="pico-tx", daemon=True).start()
+        next_rt = time.monotonic()
+        while not self._stop.is_set():
+            tl = self._start_cycle()
+            for idx, (_, _, dur) in enumerate(tl):
+                seg_end = time.monotonic() + dur / self.time_scale
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    if now >= seg_end:
+                        break
+                    if now >= next_rt:
+                        self._emit_rt(tl, idx, (seg_end - now) * self.time_scale)
+                        next_rt = now + self.rt_period
+                    self._stop.wait(min(seg_end, next_rt) - now)
+                if self._stop.is_set():
+                    return
+
+    def start(self):
+        t = threading.Thread(target=self.run, name="pico-sim", daemon=True)
+        t.start()
+        return t
+
+    def stop(self):
+        self.close()
+
+
+# ===================== BENCH =====================
+def _schedule_from_rt(obj: dict):
+    s = obj.get("schedule") or {}
+    try:
+        return tuple(int(round(float(s[a]["Green_time"]))) for a in URUTAN_ARAH)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _pct(vals, q):
+    if not vals:
+        return None
+    vals = sorted(vals)
+    return round(vals[min(len(vals) - 1, int(q * len(vals)))], 1)
+
+def bench(url: str, images: list, n: int, model_type: str, timeout_s: float):
+    """
+    upload (/api/process) -> jadwal terlihat di /api/realtime_pico (SCHED dari Pico).
+    Server harus jalan dengan SIGMA_SERIAL_PORT menunjuk ke pty simulator.
+    """
+    import requests
+
+    dirs = ["utara", "timur", "selatan", "barat"]
+    http_ms, visible_ms, total_ms, missed = [], [], [], 0
+    for i in range(n):
+        # geser gambar per iterasi supaya jadwal berubah-ubah
+        files = {}
+        for k, d in enumerate(dirs):
+            path = images[(i + k) % len(images)]
+            files[d] = (os.path.basename(path), open(path, "rb"), "image/jpeg")
+        t0 = time.monotonic()
+        r = requests.post(f"{url}/api/process", data={"model_type": model_type}, files=files, timeout=120)
+        t1 = time.monotonic()
+        for f in files.values():
+            f[1].close()
+        r.raise_for_status()
+        fz = r.json().get("fuzzy_table") or {}
+        want = tuple(int(round(float(fz.get(a, {}).get("Green_time", DEFAULT_GREEN)))) for a in URUTAN_ARAH)
+
+        seen = None
+        while time.monotonic() - t1 < timeout_s:
+            obj = requests.get(f"{url}/api/realtime_pico", timeout=5).json()
+            age = obj.get("sched_age_ms")
+            # SCHED yang diterima setelah upload dimulai & nilainya sama dengan hasil fuzzy
+            if age is not None and age <= (time.monotonic() - t0) * 1000.0 and _schedule_from_rt(obj) == want:
+                seen = time.monotonic()
+                break
+            time.sleep(0.02)
+
+        http_ms.append((t1 - t0) * 1000.0)
+        if seen is None:
+            missed += 1
+            print(f"[BENCH] #{i}: jadwal tidak terlihat dalam {timeout_s}s")
+            continue
+        visible_ms.append((seen - t1) * 1000.0)
+        total_ms.append((seen - t0) * 1000.0)
+        print(f"[BENCH] #{i}: http={http_ms[-1]:.0f}ms visible={visible_ms[-1]:.0f}ms")
+
+    report = {
+        "n": n,
+        "missed": missed,
+        "upload_ms": {"p50": _pct(http_ms, 0.5), "p90": _pct(http_ms, 0.9), "max": _pct(http_ms, 1.0)},
+        "response_to_visible_ms": {"p50": _pct(visible_ms, 0.5), "p90": _pct(visible_ms, 0.9), "max": _pct(visible_ms, 1.0)},
+        "upload_to_visible_ms": {"p50": _pct(total_ms, 0.5), "p90": _pct(total_ms, 0.9), "max": _pct(total_ms, 1.0)},
+    }
+    try:
+        ser = requests.get(f"{url}/api/metrics", timeout=5).json().get("serial") or {}
+        report["server_serial"] = {k: ser.get(k) for k in ("protocol", "retries", "failed", "write_to_ack", "write_to_applied")}
+    except Exception:
+        pass
+    return report
+
+
+def _list_images(paths):
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out += sorted(os.path.join(p, f) for f in os.listdir(p)
+                          if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+        else:
+            out.append(p)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pico virtual (pty) + benchmark end-to-end")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="jalankan Pico virtual di pty")
+    r.add_argument("--link", default="/tmp/pico", help="symlink ke pty (pakai sebagai SIGMA_SERIAL_PORT)")
+    r.add_argument("--proto", choices=["v1", "plain"], default="v1", help="plain = firmware lama (tanpa ACK)")
+    r.add_argument("--time-scale", type=float, default=1.0, help="percepat siklus (10 = 10x lebih cepat)")
+    r.add_argument("--rt-hz", type=float, default=1.0)
+    r.add_argument("--jitter-ms", type=float, default=0.0)
+    r.add_argument("--rx-drop", type=float, default=0.0, help="peluang baris dari PC hilang")
+    r.add_argument("--tx-drop", type=float, default=0.0, help="peluang baris ke PC hilang")
+    r.add_argument("--baud", type=int, default=0, help="batasi throughput (0 = tanpa batas)")
+    r.add_argument("--seed", type=int, default=None)
+
+    b = sub.add_parser("bench", help="ukur upload -> SCHED terlihat di /api/realtime_pico")
+    b.add_argument("--url", default="http://127.0.0.1:8000")
+    b.add_argument("--images", nargs="+", required=True, help="file / folder gambar (minimal 1)")
+    b.add_argument("-n", type=int, default=10)
+    b.add_argument("--model", default="yolo")
+    b.add_argument("--timeout", type=float, default=180.0, help="detik tunggu per upload (1-2 siklus)")
+
+    args = ap.parse_args(argv)
+
+    if args.cmd == "run":
+        sim = VirtualPico(proto=args.proto, time_scale=args.time_scale, rt_hz=args.rt_hz,
+                          jitter_ms=args.jitter_ms, rx_drop=args.rx_drop, tx_drop=args.tx_drop,
+                          baud=args.baud, seed=args.seed)
+        path = sim.open(args.link)
+        print(f"[PICO-SIM] {path} -> {os.ttyname(sim.slave)} (proto={args.proto}, x{args.time_scale})")
+        try:
+            sim.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sim.close()
+            print("[PICO-SIM] stats:", sim.stats)
+        return 0
+
+    if args.cmd == "bench":
+        import json
+
+        images = _list_images(args.images)
+        if not images:
+            print("tidak ada gambar")
+            return 1
+        print(json.dumps(bench(args.url, images, args.n, args.model, args.timeout), indent=2))
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
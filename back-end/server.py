@@ -1,31 +1,65 @@
 import os
 import time
+import asyncio
+import bisect
+import gc
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import struct
 import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
 import numpy as np
-import pandas as pd
 import serial
 from serial import SerialException
 
-from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from ultralytics import YOLO
-try:
-    from ultralytics import RTDETR
-    HAS_RTDETR = True
-except ImportError:
-    RTDETR = None
-    HAS_RTDETR = False
+import pico_proto
+from history import (HistoryStore, ROLLUP_RES, QUERIES as HISTORY_QUERIES, MEDIA_TYPES as HISTORY_MEDIA_TYPES,
+                     HAS_ARROW, query_rows, encode_ndjson, encode_arrow)
+
+# torch / torchvision / ultralytics berat diimport -> ditunda sampai model pertama di-load
+# (lihat _import_ml), supaya uvicorn bisa langsung bind port.
+torch = None
+fcos_resnet50_fpn = None
+YOLO = None
+RTDETR = None
+HAS_RTDETR = False
+DEVICE = None
+_ml_lock = threading.Lock()
+
+def _import_ml():
+    global torch, fcos_resnet50_fpn, YOLO, RTDETR, HAS_RTDETR, DEVICE
+    if torch is not None:
+        return
+    with _ml_lock:
+        if torch is not None:
+            return
+        import torch as _torch
+        from torchvision.models.detection import fcos_resnet50_fpn as _fcos
+        from ultralytics import YOLO as _YOLO
+        try:
+            from ultralytics import RTDETR as _RTDETR
+            HAS_RTDETR = True
+        except ImportError:
+            _RTDETR = None
+            HAS_RTDETR = False
 
-import torch
-from PIL import Image
-from torchvision import transforms as T
-from torchvision.models.detection import fcos_resnet50_fpn
+        fcos_resnet50_fpn, YOLO, RTDETR = _fcos, _YOLO, _RTDETR
+        DEVICE = _torch.device("cuda" if _torch.cuda.is_available() else "cpu")
+        torch = _torch  # terakhir: jadi penanda import sudah lengkap
 
 
 # ===================== MODEL CONFIG =====================
@@ -51,11 +85,6 @@ LAST_RT = {
     "ts": 0.0,
 }
 
-LAST_RT_LINE = None
-LAST_RT_TS = 0.0
-
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 VEHICLE_CLASSES = {"bicycle", "car", "truck", "bus", "motorcycle"}
 PCU = {
     "motorcycle": 0.5,
@@ -68,72 +97,479 @@ MIN_GREEN_FUZZY = 15
 MAX_GREEN_FUZZY = 45
 
 CLASSES_FCOS_RT = ["bicycle", "car", "truck", "bus", "motorcycle"]
-to_tensor = T.ToTensor()
 
-OUT_DIR = os.path.join("static", "output")
-os.makedirs(OUT_DIR, exist_ok=True)
+# urutan kategori tetap -> index dipakai di array deteksi (kolom ke-5) & np.bincount
+CATEGORIES = ["kendaraan_besar", "car", "motorcycle", "bicycle"]
+CAT_PCU = np.array([PCU.get(k, 0.0) for k in CATEGORIES], dtype=np.float64)
 
 
 # ===================== SERIAL CONFIG (PC -> PICO via COM9) =====================
 SERIAL_PORT = os.getenv("SIGMA_SERIAL_PORT", "COM9")
 SERIAL_BAUD = int(os.getenv("SIGMA_SERIAL_BAUD", "115200"))
 
-# ===================== SERIAL HELPERS =====================
-_serial_lock = threading.Lock()
-_serial_instance = None
+# ===================== SERIAL I/O =====================
+# Port serial hanya dipegang 1 thread ("serial-io"): baca (select di POSIX, read timeout pendek
+# di Windows), tulis dari antrian, reconnect dengan exponential backoff. Request HTTP tidak
+# pernah menyentuh port: kirim jadwal = taruh di antrian (jadwal terbaru menggantikan yang belum
+# terkirim), status dibaca dari snapshot yang di-publish thread I/O.
+SERIAL_IO_TICK_S = float(os.getenv("SIGMA_SERIAL_IO_TICK_S", "0.05"))
+SERIAL_WARMUP_S = float(os.getenv("SIGMA_SERIAL_WARMUP_S", "2.0"))  # Pico butuh jeda setelah port dibuka
+SERIAL_BACKOFF_MIN_S = float(os.getenv("SIGMA_SERIAL_BACKOFF_MIN_S", "0.5"))
+SERIAL_BACKOFF_MAX_S = float(os.getenv("SIGMA_SERIAL_BACKOFF_MAX_S", "30"))
+
+# Protokol jadwal (lihat pico_proto.py): "v1" = frame $V1,seq,...*CS + ACK/retry,
+# "plain" = baris lama gU,rU,...,rB, "auto" = coba v1, fallback plain kalau Pico tidak pernah ACK.
+PICO_PROTO = os.getenv("SIGMA_PICO_PROTO", "auto").lower()
+PICO_ACK_TIMEOUT_S = float(os.getenv("SIGMA_PICO_ACK_TIMEOUT_S", "0.5"))
+PICO_RETRIES = int(os.getenv("SIGMA_PICO_RETRIES", "3"))
+
+try:
+    import select
+    HAS_SELECT = os.name == "posix"
+except ImportError:
+    HAS_SELECT = False
+
+def _make_wake_pipe():
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    os.set_blocking(w, False)
+    return r, w
 
-def _get_serial():
-    global _serial_instance
+def _drain_fd(fd):
     try:
-        if _serial_instance is None or not _serial_instance.is_open:
-            _serial_instance = serial.Serial(
-                SERIAL_PORT,
-                SERIAL_BAUD,
-                timeout=1
-            )
-            time.sleep(2.0)  # Pico warmup
-        return _serial_instance
-    except Exception as e:
-        print("[SERIAL] OPEN ERROR:", e)
-        return None
+        while os.read(fd, 512):
+            pass
+    except (BlockingIOError, OSError):
+        pass
+
+
+class SerialLink:
+    def __init__(self, port: str, baud: int, on_line):
+        self.port = port
+        self.baud = baud
+        self.on_line = on_line      # dipanggil dengan baris RT/SCHED/lainnya (sudah di-unframe)
+        self._ser = None
+        self._rxbuf = bytearray()
+        self._out_lock = threading.Lock()
+        self._out = None            # line jadwal terbaru yang belum ditulis (latest wins)
+        self._stop = threading.Event()
+        self._thread = None
+        self.mux = None             # SerialMux yang memegang link ini (mode multi-port)
+        self._wake_r = self._wake_w = None
+        self._write_after = 0.0
+        self.proto = PICO_PROTO if PICO_PROTO in ("auto", "v1", "plain") else "auto"
+        self._v1_seen = False       # Pico pernah ACK di koneksi ini
+        self._seq = 0
+        self._inflight = None       # frame V1 yang belum di-ACK
+        self._unapplied = deque(maxlen=8)  # (seq, nilai, t_write) menunggu SCHED dari Pico
+        self.ack_latency = pico_proto.LatencyHistogram()
+        self.apply_latency = pico_proto.LatencyHistogram()
+        self.acked = 0
+        self.retries = 0
+        self.naks = 0
+        self.failed = 0
+        self.bad_frames = 0
+        self._backoff = SERIAL_BACKOFF_MIN_S
+        self._next_open = 0.0
+        self.connects = 0
+        self.rx_lines = 0
+        self.tx_lines = 0
+        self.coalesced = 0
+        self.last_error = None
+        self.last_tx = None
+        self.last_tx_ts = None
+        self._publish("not_open")
+
+    # ---------- API (dipanggil dari thread mana saja, tidak blocking) ----------
+    def start(self):
+        """Mode 1 thread per port (tanpa SerialMux)."""
+        if self._thread is None and self.mux is None:
+            if HAS_SELECT:
+                self._wake_r, self._wake_w = _make_wake_pipe()
+            self._thread = threading.Thread(target=self._run, name=f"serial-io-{self.port}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake()
+
+    def send(self, line: str) -> bool:
+        """
+        Antrikan 1 jadwal 'gU,rU,...,rB'. Return True kalau port sedang terhubung (akan
+        terkirim segera); konfirmasi sampai/dipakai Pico ada di stats() (ACK / SCHED).
+        """
+        line = line.strip()
+        inf = self._inflight
+        with self._out_lock:
+            if inf is not None and inf["payload"] == line:
+                # identik dengan frame yang sedang menunggu ACK -> tidak ditulis ulang; pending lain
+                # (lebih lama) ikut batal karena yang terbaru = jadwal ini.
+                # Jadwal yang sudah di-ACK / sudah dipakai TIDAK dibandingkan: Pico memakai jadwal
+                # kiriman cuma 1 siklus lalu kembali ke default, jadi upload berikutnya (walau
+                # nilainya sama) harus tetap ditulis supaya sinkron dengan pending engine server.
+                self._out = None
+                self.coalesced += 1
+                return self.status["ready"]
+            if self._out is not None:
+                self.coalesced += 1
+            self._out = line
+        self._wake()
+        return self.status["ready"]
+
+    def _publish(self, detail: str):
+        # snapshot baru tiap perubahan; pembaca cukup ambil referensinya
+        self.status = {
+            "ready": detail == "ok",
+            "port": self.port,
+            "baud": self.baud,
+            "detail": detail,
+        }
 
-LAST_RT_LINE = None
-LAST_RT_TS = 0.0
-LAST_SCHED = None
-LAST_SCHED_TS = 0.0
-
-def serial_reader_loop():
-    global LAST_RT_LINE, LAST_RT_TS, LAST_SCHED, LAST_SCHED_TS
-    while True:
-        line = ""
-        with _serial_lock:
-            ser = _get_serial()
-            if ser is None:
+    def stats(self) -> dict:
+        with self._out_lock:
+            pending = self._out is not None
+        return {
+            **self.status,
+            "connects": self.connects,
+            "rx_lines": self.rx_lines,
+            "tx_lines": self.tx_lines,
+            "coalesced": self.coalesced,
+            "pending": pending,
+            "last_tx": self.last_tx,
+            "last_tx_ts": self.last_tx_ts,
+            "last_error": self.last_error,
+            "protocol": self.active_protocol(),
+            "seq": self._seq,
+            "acked": self.acked,
+            "retries": self.retries,
+            "naks": self.naks,
+            "failed": self.failed,
+            "bad_frames": self.bad_frames,
+            "awaiting_ack": self._inflight is not None,
+            "write_to_ack": self.ack_latency.stats(),
+            "write_to_applied": self.apply_latency.stats(),
+            "next_retry_s": round(max(0.0, self._next_open - time.monotonic()), 2) if self._ser is None else None,
+            "select": HAS_SELECT,
+        }
+
+    # ---------- thread I/O ----------
+    def _wake(self):
+        if self.mux is not None:
+            self.mux.wake()
+        elif self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except (BlockingIOError, OSError):
                 pass
-            else:
+
+    def _open(self):
+        try:
+            self._ser = serial.Serial(self.port, self.baud, timeout=0 if HAS_SELECT else SERIAL_IO_TICK_S)
+        except Exception as e:
+            self.last_error = str(e)
+            self._next_open = time.monotonic() + self._backoff
+            print(f"[SERIAL] OPEN ERROR: {e} (retry {self._backoff:.1f}s)")
+            self._backoff = min(self._backoff * 2.0, SERIAL_BACKOFF_MAX_S)
+            self._publish("cannot_open")
+            return
+        self.connects += 1
+        self._backoff = SERIAL_BACKOFF_MIN_S
+        self._write_after = time.monotonic() + SERIAL_WARMUP_S
+        self._rxbuf.clear()
+        self._v1_seen = False  # firmware bisa saja diganti selama terputus
+        self._publish("ok")
+        print(f"[SERIAL] open {self.port} @ {self.baud}")
+
+    def _drop(self, err):
+        self.last_error = str(err)
+        print("[SERIAL] I/O error:", err)
+        try:
+            self._ser.close()
+        except Exception:
+            pass
+        self._ser = None
+        if self._inflight is not None:
+            # frame yang belum di-ACK dikirim ulang (seq baru) setelah reconnect
+            with self._out_lock:
+                if self._out is None:
+                    self._out = self._inflight["payload"]
+            self._inflight = None
+        self._next_open = time.monotonic() + self._backoff
+        self._publish("not_open")
+
+    def _read(self):
+        ser = self._ser
+        if HAS_SELECT:
+            rl, _, _ = select.select([ser.fileno(), self._wake_r], [], [], SERIAL_IO_TICK_S * 4)
+            if self._wake_r in rl:
+                _drain_fd(self._wake_r)
+            if ser.fileno() in rl:
+                self._read_ready()
+        else:
+            self._feed(ser.read(ser.in_waiting or 1))  # blocking max SERIAL_IO_TICK_S
+
+    def _read_ready(self):
+        """fd sudah dilaporkan readable oleh select."""
+        chunk = self._ser.read(self._ser.in_waiting or 1)
+        if not chunk:
+            # readable tapi kosong -> device hilang (USB dicabut)
+            raise SerialException("device disconnected")
+        self._feed(chunk)
+
+    def _feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self._rxbuf += chunk
+        while True:
+            i = self._rxbuf.find(b"\n")
+            if i < 0:
+                break
+            line = self._rxbuf[:i].decode("utf-8", errors="ignore").strip()
+            del self._rxbuf[:i + 1]
+            if line:
+                self.rx_lines += 1
                 try:
-                    line = ser.readline().decode("utf-8", errors="ignore").strip()
-                except Exception:
-                    line = ""
+                    self._handle_line(line)
+                except Exception as e:
+                    print("[SERIAL] handler error:", repr(e))
 
-        if not line:
-            time.sleep(0.05)
-            continue
+    # ---------- protokol ----------
+    def active_protocol(self) -> str:
+        if self.proto == "auto":
+            return "v1" if self._v1_seen else ("plain" if self._v1_seen is None else "probing")
+        return self.proto
 
-        if line.startswith("RT,"):
-            LAST_RT_LINE = line
-            LAST_RT_TS = time.time()
-        elif line.startswith("SCHED,"):
-            # format: SCHED,gU,rU,gT,rT,gS,rS,gB,rB
-            LAST_SCHED = line
-            LAST_SCHED_TS = time.time()
+    def _handle_line(self, line: str):
+        try:
+            line = pico_proto.unframe(line)
+        except ValueError:
+            self.bad_frames += 1
+            return
+        now = time.monotonic()
+        if line.startswith(("ACK,", "NAK,")):
+            try:
+                seq = int(line.split(",")[1].split("*")[0])
+            except (IndexError, ValueError):
+                self.bad_frames += 1
+                return
+            self._on_ack(seq, line.startswith("ACK,"), now)
+            return
+        if line.startswith("SCHED,"):
+            self._on_sched(line, now)
+        self.on_line(line)
+
+    def _on_ack(self, seq: int, ok: bool, now: float):
+        inf = self._inflight
+        if inf is None or inf["seq"] != seq:
+            return  # ACK lama (frame sudah digantikan / sudah di-ACK)
+        if not ok:
+            self.naks += 1
+            inf["t_last"] = 0.0  # kirim ulang di putaran berikutnya
+            return
+        self._v1_seen = True
+        self.acked += 1
+        self.ack_latency.observe((now - inf["t_first"]) * 1000.0)
+        self._inflight = None
+
+    def _on_sched(self, line: str, now: float):
+        parts = line.split(",")
+        seq = int(parts[9]) if len(parts) >= 10 and parts[9].isdigit() else None
+        try:
+            vals = pico_proto.schedule_values(",".join(parts[1:9]))
+        except ValueError:
+            vals = None
+        # SCHED dengan seq -> cocok persis; tanpa seq -> jadwal terbaru dengan nilai sama
+        for i in range(len(self._unapplied) - 1, -1, -1):
+            s_seq, s_vals, t_write = self._unapplied[i]
+            if (seq is not None and s_seq == seq) or (seq is None and s_vals == vals):
+                self.apply_latency.observe((now - t_write) * 1000.0)
+                # yang lebih lama dari ini tidak akan pernah dipakai lagi
+                for _ in range(i + 1):
+                    self._unapplied.popleft()
+                return
+
+    def _write(self, data: str):
+        self._ser.write(data.encode("utf-8"))
+        self._ser.flush()
+        self.tx_lines += 1
+        self.last_tx_ts = time.time()
+
+    def _write_pending(self):
+        now = time.monotonic()
+        if now < self._write_after:
+            return
+        self._retry_inflight(now)
+        with self._out_lock:
+            payload, self._out = self._out, None
+        if payload is None:
+            return
+        try:
+            if self.active_protocol() == "plain":
+                self._write(payload + "\n")
+                self._unapplied.append((None, pico_proto.schedule_values(payload), now))
+            else:
+                self._seq += 1
+                line = pico_proto.encode_schedule(self._seq, payload)
+                self._write(line)
+                # frame baru menggantikan frame lama yang belum di-ACK (latest wins)
+                self._inflight = {"seq": self._seq, "payload": payload, "line": line,
+                                  "t_first": now, "t_last": now, "attempts": 1}
+                self._unapplied.append((self._seq, pico_proto.schedule_values(payload), now))
+        except Exception:
+            with self._out_lock:
+                if self._out is None:
+                    self._out = payload  # kirim ulang setelah reconnect
+            raise
+        self.last_tx = payload
+        print(f"[SERIAL] Sent -> {self.port} ({self.active_protocol()}): {payload}")
+
+    def _retry_inflight(self, now: float):
+        inf = self._inflight
+        if inf is None or now - inf["t_last"] < PICO_ACK_TIMEOUT_S:
+            return
+        if inf["attempts"] > PICO_RETRIES:
+            self._inflight = None
+            if self.proto == "auto" and not self._v1_seen:
+                # firmware lama: tidak kenal frame V1 -> kirim ulang sebagai baris polos
+                self._v1_seen = None
+                print("[SERIAL] Pico tidak ACK frame V1 -> fallback format polos")
+                with self._out_lock:
+                    if self._out is None:
+                        self._out = inf["payload"]
+            else:
+                self.failed += 1
+                print(f"[SERIAL] frame seq={inf['seq']} tidak di-ACK setelah {inf['attempts']} kali")
+            return
+        self._write(inf["line"])
+        inf["attempts"] += 1
+        inf["t_last"] = now
+        self.retries += 1
+
+    def _idle_wait(self, timeout: float):
+        if HAS_SELECT:
+            rl, _, _ = select.select([self._wake_r], [], [], timeout)
+            if rl:
+                _drain_fd(self._wake_r)
+        else:
+            self._stop.wait(timeout)
 
-threading.Thread(target=serial_reader_loop, daemon=True).start()
+    def _close(self):
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except Exception:
+                pass
+            self._ser = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._ser is None:
+                wait = self._next_open - time.monotonic()
+                if wait > 0:
+                    self._idle_wait(min(wait, 1.0))
+                    continue
+                self._open()
+                continue
+            try:
+                self._write_pending()
+                self._read()
+            except Exception as e:
+                self._drop(e)
+        self._close()
+
+
+class SerialMux:
+    """
+    Banyak SerialLink (1 per persimpangan) di 1 thread: select() atas semua fd port + 1 wake pipe.
+    Hanya POSIX; di Windows tiap link tetap punya thread sendiri (select tidak bisa untuk COM port).
+    """
+
+    def __init__(self):
+        self.links = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started = False
+        self._wake_r = self._wake_w = None
+        self.loops = 0
+
+    def add(self, link: SerialLink):
+        with self._lock:
+            self.links.append(link)
+        if HAS_SELECT:
+            link.mux = self
+            self.wake()
+        elif self.started:
+            link.start()
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        if not HAS_SELECT:
+            for link in list(self.links):
+                link.start()
+            return
+        self._wake_r, self._wake_w = _make_wake_pipe()
+        self._thread = threading.Thread(target=self._run, name="serial-mux", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for link in list(self.links):
+            link.stop()
+        self.wake()
+
+    def wake(self):
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except (BlockingIOError, OSError):
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.loops += 1
+            now = time.monotonic()
+            timeout = SERIAL_IO_TICK_S * 4  # cukup untuk warmup / retry ACK
+            by_fd = {}
+            with self._lock:
+                links = list(self.links)
+            for link in links:
+                if link._ser is None:
+                    if now >= link._next_open:
+                        link._open()
+                    else:
+                        timeout = min(timeout, link._next_open - now)
+                if link._ser is None:
+                    continue
+                try:
+                    link._write_pending()
+                    by_fd[link._ser.fileno()] = link
+                except Exception as e:
+                    link._drop(e)
+            rl, _, _ = select.select(list(by_fd) + [self._wake_r], [], [], max(timeout, 0.0))
+            for fd in rl:
+                if fd == self._wake_r:
+                    _drain_fd(fd)
+                    continue
+                link = by_fd[fd]
+                try:
+                    link._read_ready()
+                except Exception as e:
+                    link._drop(e)
+        for link in list(self.links):
+            link._close()
+
+    def stats(self) -> dict:
+        return {"links": len(self.links), "select": HAS_SELECT, "loops": self.loops}
+
+serial_mux = SerialMux()
 
 
 def send_durations_to_pico(green_dir: dict, red_dir: dict):
     """
-    (Tetap dibiarkan) helper lama.
+    (Tetap dibiarkan) helper lama, sekarang lewat SerialLink persimpangan default.
     """
     try:
         gU = int(round(green_dir["UTARA"]))
@@ -146,34 +582,28 @@ def send_durations_to_pico(green_dir: dict, red_dir: dict):
         rB = int(round(red_dir["BARAT"]))
 
         payload = f"{gU},{rU},{gT},{rT},{gS},{rS},{gB},{rB}\n"
-
-        ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=1)
-        time.sleep(2.0)  # WAJIB (biar Pico siap)
-        ser.write(payload.encode("utf-8"))
-        ser.close()
-
-        print("[SERIAL] SENT:", payload.strip())
-        return True
+        return intersections.default.send_schedule_line(payload)
 
     except Exception as e:
         print("[SERIAL] ERROR:", e)
         return False
 
 
-def send_durations_to_pico_from_df(df_fuzzy: pd.DataFrame) -> bool:
+def schedule_payload(fuzzy_table: dict) -> str:
     """
-    Kirim 1 baris ke Pico:
-      gU,rU,gT,rT,gS,rS,gB,rB\\n
+    {arah: {"Green_time", "Red_time"}} -> 1 baris untuk Pico:
+      gU,rU,gT,rT,gS,rS,gB,rB\n
+    (arah yang tidak ada -> 10 / 50)
     """
     def g(a: str) -> int:
         try:
-            return int(round(float(df_fuzzy.loc[a, "Green_time"])))
+            return int(round(float(fuzzy_table[a]["Green_time"])))
         except Exception:
             return 10
 
     def r(a: str) -> int:
         try:
-            return int(round(float(df_fuzzy.loc[a, "Red_time"])))
+            return int(round(float(fuzzy_table[a]["Red_time"])))
         except Exception:
             return 50
 
@@ -182,30 +612,114 @@ def send_durations_to_pico_from_df(df_fuzzy: pd.DataFrame) -> bool:
     gS, rS = g("SELATAN"), r("SELATAN")
     gB, rB = g("BARAT"),   r("BARAT")
 
-    line = f"{gU},{rU},{gT},{rT},{gS},{rS},{gB},{rB}\n"
-    data = line.encode("utf-8")
+    return f"{gU},{rU},{gT},{rT},{gS},{rS},{gB},{rB}\n"
 
-    with _serial_lock:
-        ser = _get_serial()
-        if ser is None:
-            print("[SERIAL] Not sent (port not available).")
-            return False
+def send_durations_to_pico_from_table(fuzzy_table: dict, inter=None) -> bool:
+    # non-blocking: masuk antrian SerialLink persimpangan, ditulis thread serial
+    return (inter or intersections.default).send_schedule_line(schedule_payload(fuzzy_table))
+
+def send_durations_to_pico_from_df(df_fuzzy, inter=None) -> bool:
+    """(Kompatibilitas) versi DataFrame dari send_durations_to_pico_from_table."""
+    return send_durations_to_pico_from_table(df_fuzzy.to_dict(orient="index"), inter)
+
+
+# ===================== STARTUP / LIFESPAN =====================
+# Server langsung up; serial reader + state engine dijalankan saat startup,
+# model di-load + warmup di background (lihat /health -> "ready").
+_startup = {"started": False, "ready": False, "t0": None, "ready_s": None, "error": None}
+
+def _warmup_model(name: str):
+    dummy = np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)
+    t0 = time.monotonic()
+    detect_with_key(name, [dummy])
+    models.mark_warm(name)
+    print(f"[STARTUP] {name} warm ({time.monotonic() - t0:.2f}s)")
+
+def _background_model_loader():
+    try:
+        models.preload(PRELOAD_MODELS)
+        for name in PRELOAD_MODELS:
+            if models.is_loaded(name):
+                try:
+                    _warmup_model(name)
+                except Exception as e:
+                    print(f"[STARTUP] warmup {name} failed:", repr(e))
+    except Exception as e:
+        _startup["error"] = repr(e)
+        print("[STARTUP] model loader error:", repr(e))
+    finally:
+        _startup["ready"] = True
+        _startup["ready_s"] = round(time.monotonic() - _startup["t0"], 3)
+        print(f"[STARTUP] ready in {_startup['ready_s']}s")
+
+def start_background_services():
+    if _startup["started"]:
+        return
+    _startup["started"] = True
+    _startup["t0"] = time.monotonic()
+    intersections.start()
+    history.start()
+    threading.Thread(target=_background_model_loader, name="model-loader", daemon=True).start()
+    start_streams()
+
+@asynccontextmanager
+async def lifespan(app):
+    start_background_services()
+    rt_hub.start()
+    yield
+    await rt_hub.stop()
+    stop_streams()
+    intersections.stop()
+    history.stop()
+    _infer_executor.shutdown(wait=False, cancel_futures=True)
+
+_rewarming = set()
+_rewarm_lock = threading.Lock()
+
+def _rewarm_async(name: str):
+    """Load (kalau perlu) + warmup di background; dipicu readiness kalau model preload belum siap."""
+    with _rewarm_lock:
+        if name in _rewarming:
+            return
+        _rewarming.add(name)
+
+    def run():
         try:
-            ser.write(data)
-            ser.flush()
-            print(f"[SERIAL] Sent -> {SERIAL_PORT}: {line.strip()}")
-            return True
-        except SerialException as e:
-            print(f"[SERIAL] Write error: {e}")
-            try:
-                ser.close()
-            except Exception:
-                pass
-            return False
+            _warmup_model(name)
+        except Exception as e:
+            print(f"[MODEL] rewarm {name} failed:", repr(e))
+        finally:
+            with _rewarm_lock:
+                _rewarming.discard(name)
+
+    threading.Thread(target=run, name=f"rewarm-{name}", daemon=True).start()
+
+def readiness() -> dict:
+    per_model = {}
+    for name in models.names():
+        per_model[name] = {
+            "loaded": models.is_loaded(name),
+            "warmed": models.is_warm(name),
+            "servable": models.is_servable(name),
+        }
+    ready = _startup["ready"] and all(per_model[n]["servable"] for n in PRELOAD_MODELS if n in per_model)
+    if _startup["ready"]:
+        # model preload gagal / belum warm setelah startup -> coba lagi di background (ikut backoff registry)
+        for n in PRELOAD_MODELS:
+            if n in per_model and not per_model[n]["servable"]:
+                _rewarm_async(n)
+    return {
+        "ready": ready,
+        "startup_done": _startup["ready"],
+        "startup_s": _startup["ready_s"],
+        "preload": PRELOAD_MODELS,
+        "models": per_model,
+        "error": _startup["error"],
+    }
 
 
 # ===================== FASTAPI SETUP =====================
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -228,12 +742,16 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 # ===================== LOAD MODELS =====================
-print("Loading YOLO model...")
-yolo_model = YOLO(YOLO_MODEL_PATH)
-print("YOLO Loaded.")
+def load_yolo_model():
+    _import_ml()
+    print("Loading YOLO model...")
+    model = YOLO(YOLO_MODEL_PATH)
+    print("YOLO Loaded.")
+    return model
 
-print("Loading FCOS model...")
-def load_fcos_model(model_path: str):
+def load_fcos_model(model_path: str = FCOS_MODEL_PATH):
+    _import_ml()
+    print("Loading FCOS model...")
     num_classes = len(CLASSES_FCOS_RT) + 1  # + background
     model = fcos_resnet50_fpn(
         weights=None,
@@ -251,31 +769,283 @@ def load_fcos_model(model_path: str):
     model.load_state_dict(state)
     model.to(DEVICE)
     model.eval()
+    print("FCOS Loaded.")
     return model
 
-fcos_model = load_fcos_model(FCOS_MODEL_PATH)
-print("FCOS Loaded.")
+def load_rtdetr_model():
+    _import_ml()
+    if not HAS_RTDETR:
+        raise RuntimeError("RT-DETR class not available in ultralytics.")
+    print("Loading RT-DETR model...")
+    model = RTDETR(RTDETR_MODEL_PATH)
+    print("RT-DETR Loaded.")
+    return model
+
+
+def load_torch_model(kind: str):
+    return {"yolo": load_yolo_model, "fcos": load_fcos_model, "rtdetr": load_rtdetr_model}[kind]()
+
+
+# ===================== ONNX RUNTIME BACKEND (opsional) =====================
+# SIGMA_ONNX_MODELS=yolo,fcos -> model tsb jalan lewat ONNX Runtime CPU (lihat onnx_backend.py)
+ONNX_MODELS = {m.strip().lower() for m in os.getenv("SIGMA_ONNX_MODELS", "").split(",") if m.strip()}
+
+def load_onnx_detector(kind: str):
+    import onnx_backend
+
+    if kind == "fcos":
+        # export FCOS butuh model torch-nya (sekali saja, setelah itu pakai cache)
+        return onnx_backend.load_detector("fcos", FCOS_MODEL_PATH, IMGSZ, CONF_THRESH, torch_factory=load_fcos_model)
+    if kind == "rtdetr":
+        return onnx_backend.load_detector("rtdetr", RTDETR_MODEL_PATH, RTDETR_IMGSZ, RTDETR_CONF_THRESH)
+    return onnx_backend.load_detector("yolo", YOLO_MODEL_PATH, YOLO_IMGSZ, YOLO_CONF_THRESH)
+
+def _model_loader(kind: str):
+    if kind in ONNX_MODELS:
+        return lambda: load_onnx_detector(kind)
+    return lambda: load_torch_model(kind)
+
+
+# ===================== INT8 MODE (opsional) =====================
+# model_type "yolo_int8" / "fcos_int8" / "rtdetr_int8", atau SIGMA_INT8_MODELS=yolo,fcos
+# supaya model_type biasa otomatis pakai versi INT8 (ONNX Runtime, lihat onnx_backend.py).
+MODEL_KINDS = ("yolo", "fcos", "rtdetr")
+INT8_SUFFIX = "_int8"
+INT8_MODELS = {m.strip().lower() for m in os.getenv("SIGMA_INT8_MODELS", "").split(",") if m.strip()}
+
+_int8_modes = {}  # kind -> mode quantize (static / dynamic) model INT8 yang ter-load
+
+def int8_mode_for(kind: str) -> str:
+    """Mode INT8 model kind ini: yang dipakai saat load, atau yang akan dipakai kalau belum di-load."""
+    mode = _int8_modes.get(kind)
+    if mode is None:
+        import onnx_backend
+        mode = onnx_backend.resolve_int8_mode()
+    return mode
+
+def load_int8_detector(kind: str, mode: str = None):
+    import onnx_backend
+
+    mode = onnx_backend.resolve_int8_mode(mode)
+    _int8_modes[kind] = mode
+    if kind == "fcos":
+        return onnx_backend.load_int8_detector("fcos", FCOS_MODEL_PATH, IMGSZ, CONF_THRESH,
+                                               torch_factory=load_fcos_model, mode=mode)
+    if kind == "rtdetr":
+        return onnx_backend.load_int8_detector("rtdetr", RTDETR_MODEL_PATH, RTDETR_IMGSZ, RTDETR_CONF_THRESH, mode=mode)
+    return onnx_backend.load_int8_detector("yolo", YOLO_MODEL_PATH, YOLO_IMGSZ, YOLO_CONF_THRESH, mode=mode)
+
+def resolve_model_key(model_type: str) -> str:
+    """
+    model_type dari request -> key di ModelRegistry ("yolo", "fcos_int8", ...).
+    Tidak dikenal -> yolo (perilaku lama).
+    """
+    mt = (model_type or "yolo").lower()
+    int8 = mt.endswith(INT8_SUFFIX)
+    kind = mt[: -len(INT8_SUFFIX)] if int8 else mt
+    if kind not in MODEL_KINDS:
+        kind = "yolo"
+    if int8 or kind in INT8_MODELS:
+        return kind + INT8_SUFFIX
+    return kind
+
+def model_kind(key: str) -> str:
+    return key[: -len(INT8_SUFFIX)] if key.endswith(INT8_SUFFIX) else key
+
+def _all_model_loaders() -> dict:
+    loaders = {kind: _model_loader(kind) for kind in MODEL_KINDS}
+    for kind in MODEL_KINDS:
+        loaders[kind + INT8_SUFFIX] = (lambda k=kind: load_int8_detector(k))
+    return loaders
+
+
+# ===================== MODEL REGISTRY =====================
+# Model baru di-load saat model_type-nya pertama kali dipakai (bukan saat import).
+# Kalau total memori > budget, model idle yang paling lama tidak dipakai (LRU) di-unload.
+MODEL_MEM_BUDGET_MB = float(os.getenv("SIGMA_MODEL_MEM_MB", "0"))  # 0 = tanpa batas
+PRELOAD_MODELS = [m.strip().lower() for m in os.getenv("SIGMA_PRELOAD_MODELS", "yolo").split(",") if m.strip()]
+# load gagal -> dicoba lagi setelah backoff (dobel tiap gagal, maks MAX); bukan mati permanen
+MODEL_RETRY_MIN_S = float(os.getenv("SIGMA_MODEL_RETRY_MIN_S", "5"))
+MODEL_RETRY_MAX_S = float(os.getenv("SIGMA_MODEL_RETRY_MAX_S", "300"))
+
+class ModelUnavailable(Exception):
+    pass
+
+def _model_nbytes(model) -> int:
+    """Perkiraan memori resident: parameter + buffer (ultralytics dibungkus di .model)."""
+    if getattr(model, "backend", "torch") == "onnx":
+        return int(model.nbytes)
+    module = model if isinstance(model, torch.nn.Module) else getattr(model, "model", None)
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    total = 0
+    for t in list(module.parameters()) + list(module.buffers()):
+        total += t.numel() * t.element_size()
+    return total
+
+class ModelRegistry:
+    def __init__(self, loaders: dict, budget_mb: float = 0.0):
+        self._loaders = loaders
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in loaders}
+        self._models = OrderedDict()  # name -> model (urutan = LRU, paling baru di akhir)
+        self._sizes = {}
+        self._in_use = {name: 0 for name in loaders}
+        self._load_s = {}
+        self._loads = {name: 0 for name in loaders}
+        self._evictions = {name: 0 for name in loaders}
+        self._errors = {}    # name -> pesan error load terakhir (tetap dilaporkan setelah sukses)
+        self._failures = {}  # name -> (gagal berturut-turut, monotonic boleh coba lagi)
+        self._warm = set()
+        self._ever_warm = set()  # pernah warm -> kalau ke-evict masih bisa di-load ulang on-demand
+
+    def names(self):
+        return list(self._loaders)
+
+    def is_loaded(self, name: str) -> bool:
+        with self._lock:
+            return name in self._models
+
+    def _load(self, name: str):
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._models:
+                    return
+            fails, retry_at = self._failures.get(name, (0, 0.0))
+            if fails and time.monotonic() < retry_at:
+                raise ModelUnavailable(self._errors[name])
+
+            t0 = time.monotonic()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                fails += 1
+                backoff = min(MODEL_RETRY_MAX_S, MODEL_RETRY_MIN_S * 2 ** (fails - 1))
+                print(f"[MODEL] {name} failed to load ({fails}x, retry in {backoff:.0f}s): {e}")
+                self._errors[name] = str(e)
+                self._failures[name] = (fails, time.monotonic() + backoff)
+                raise ModelUnavailable(str(e))
+
+            self._failures.pop(name, None)
+            with self._lock:
+                self._models[name] = model
+                self._sizes[name] = _model_nbytes(model)
+                self._load_s[name] = round(time.monotonic() - t0, 3)
+                self._loads[name] += 1
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Pinjam model (di-load kalau belum). Selama dipakai, model tidak akan di-evict.
+        """
+        if name not in self._loaders:
+            raise ModelUnavailable(f"unknown model: {name}")
+
+        while True:
+            self._load(name)
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    continue  # ke-evict di antara load & pin -> load ulang
+                self._in_use[name] += 1
+                self._models.move_to_end(name)
+                break
+        self._enforce_budget()
+        ok = False
+        try:
+            yield model
+            ok = True
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                # inference sukses = model sudah warm (juga setelah evict -> load ulang / retry backoff)
+                if ok and name in self._models:
+                    self._warm.add(name)
+                    self._ever_warm.add(name)
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        if self.budget_bytes <= 0:
+            return
+        evicted = []
+        with self._lock:
+            total = sum(self._sizes[n] for n in self._models)
+            for name in list(self._models):
+                if total <= self.budget_bytes:
+                    break
+                if self._in_use[name] > 0:
+                    continue
+                del self._models[name]
+                self._warm.discard(name)
+                total -= self._sizes[name]
+                self._evictions[name] += 1
+                evicted.append(name)
+        if evicted:
+            print("[MODEL] evicted (LRU):", ", ".join(evicted))
+            gc.collect()
+            if DEVICE is not None and DEVICE.type == "cuda":
+                torch.cuda.empty_cache()
+
+    def mark_warm(self, name: str):
+        with self._lock:
+            if name in self._models:
+                self._warm.add(name)
+                self._ever_warm.add(name)
+
+    def is_servable(self, name: str) -> bool:
+        """Warm, atau ke-evict setelah pernah warm & tidak sedang gagal load (di-load ulang saat dipakai)."""
+        with self._lock:
+            if name in self._warm:
+                return True
+            return name not in self._models and name in self._ever_warm and name not in self._failures
+
+    def is_warm(self, name: str) -> bool:
+        with self._lock:
+            return name in self._warm
+
+    def preload(self, names):
+        for name in names:
+            if name not in self._loaders:
+                print(f"[MODEL] preload skip, unknown model: {name}")
+                continue
+            try:
+                self._load(name)
+            except ModelUnavailable:
+                pass
+        self._enforce_budget()
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {}
+            for name in self._loaders:
+                loaded = name in self._models
+                models[name] = {
+                    "loaded": loaded,
+                    "backend": getattr(self._models.get(name), "backend", "torch") if loaded else None,
+                    "warmed": name in self._warm,
+                    "resident_mb": round(self._sizes.get(name, 0) / (1024 * 1024), 2) if loaded else 0.0,
+                    "in_use": self._in_use[name],
+                    "loads": self._loads[name],
+                    "evictions": self._evictions[name],
+                    "last_load_s": self._load_s.get(name),
+                    "error": self._errors.get(name),
+                    "failures": self._failures.get(name, (0, 0.0))[0],
+                    "retry_in_s": (round(max(0.0, self._failures[name][1] - time.monotonic()), 1)
+                                   if name in self._failures else None),
+                }
+            return {
+                "budget_mb": self.budget_bytes / (1024 * 1024) if self.budget_bytes else None,
+                "resident_mb": round(sum(self._sizes[n] for n in self._models) / (1024 * 1024), 2),
+                "lru_order": list(self._models),
+                "models": models,
+            }
+
+models = ModelRegistry(
+    _all_model_loaders(),
+    budget_mb=MODEL_MEM_BUDGET_MB,
+)
 
-if HAS_RTDETR:
-    try:
-        print("Loading RT-DETR model...")
-        rtdetr_model = RTDETR(RTDETR_MODEL_PATH)
-        print("RT-DETR Loaded.")
-    except Exception as e:
-        print(f"RT-DETR failed to load: {e}")
-        rtdetr_model = None
-else:
-    rtdetr_model = None
-    print("RT-DETR class not available in ultralytics. Skipping RT-DETR.")
-
-
-# ===================== STATE =====================
-LAST_FUZZY = {
-    "UTARA":   {"Green_time": 10.0, "Red_time": 50.0},
-    "TIMUR":   {"Green_time": 10.0, "Red_time": 50.0},
-    "SELATAN": {"Green_time": 10.0, "Red_time": 50.0},
-    "BARAT":   {"Green_time": 10.0, "Red_time": 50.0},
-}
 
 # ===================== REALTIME "PICO-STYLE" STATE ENGINE =====================
 # Tujuan: ganti realtime blynk -> server kasih realtime countdown (mirror cycle Pico)
@@ -290,23 +1060,6 @@ DEFAULT_CYCLE_1 = {
 }
 
 
-_state_lock = threading.Lock()
-_current_sched = {
-    a: {"Green_time": float(DEFAULT_CYCLE_1[a]["Green_time"]), "Red_time": float(DEFAULT_CYCLE_1[a]["Red_time"])}
-    for a in URUTAN_ARAH
-}
-_pending_sched = None  # dipakai setelah 1 siklus selesai (mirip Pico apply_pending_update)
-_current_one_shot = False  # NEW: schedule hasil deteksi hanya berlaku 1 cycle
-_cycle_t0 = time.time()
-_current_state = {
-    "active_arah": "UTARA",
-    "phase": "all_red",  # all_red | yellow | green
-    "remaining": 0,
-    "rt_green": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
-    "rt_red": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
-    "using_pending": False,
-}
-
 def _build_timeline(schedule: dict):
     """
     Bangun list segmen fase persis seperti di Pico:
@@ -325,137 +1078,389 @@ def _build_timeline(schedule: dict):
 def _cycle_len(schedule: dict) -> float:
     return sum(d for _, _, d in _build_timeline(schedule))
 
-def _compute_red_remaining(schedule: dict, active_arah: str, phase: str, remaining: float) -> dict:
-    """
-    Mirip fungsi Pico compute_red_remaining(): waktu sampai arah tsb dapat hijau lagi.
-    - Kalau phase != green, maka "remaining" = sisa durasi phase sekarang (yellow/all_red).
-    - Kalau phase == green, remaining = sisa hijau arah aktif.
-    """
-    # kita hitung dengan mensimulasikan timeline dari posisi sekarang sampai tiap arah masuk yellow->green
-    tl = _build_timeline(schedule)
-
-    # cari posisi "sekarang" di timeline: segmen pertama yg match (arah, phase)
-    # catatan: all_red muncul dua kali per arah, tapi itu memang; di sini cukup pakai traversal aktual.
-    # Untuk akurat, kita bangun traversal berjalan dari awal dan cari state berdasarkan t-cycle,
-    # tapi karena kita sudah ada (phase,active,remaining), kita hitung "time to next green" via forward-walk.
-    out = {a: 0 for a in URUTAN_ARAH}
-    if phase == "green":
-        out[active_arah] = 0
-
-    # fungsi helper: waktu sampai target arah masuk phase "green" segmen miliknya
-    def time_to_green(target: str) -> int:
-        t = float(remaining)
-        # berjalan ke depan sesuai urutan setelah segmen sekarang selesai
-        # model posisi saat ini: (active_arah, phase) sedang berjalan
-        found_current = False
-        for arah, ph, dur in tl:
-            if not found_current:
-                if arah == active_arah and ph == phase:
-                    found_current = True
-                continue
-        if not found_current:
-            # fallback
-            return int(round(t))
-
-        # lanjut traversal dari segmen setelah current sampai ketemu (target,"green")
-        passed_current = False
-        for arah, ph, dur in tl:
-            if not passed_current:
-                if arah == active_arah and ph == phase:
-                    passed_current = True
-                continue
-            if arah == target and ph == "green":
-                return int(round(t))
-            t += float(dur)
 
-        # kalau tidak ketemu (harusnya ketemu), berarti wrap ke awal siklus berikutnya
-        for arah, ph, dur in tl:
-            if arah == target and ph == "green":
-                return int(round(t))
-            t += float(dur)
+class CompiledTimeline:
+    """
+    Timeline 1 siklus yang di-compile sekali per ganti jadwal: prefix sum awal segmen
+    (lookup bisect) + offset mulai hijau tiap arah (red remaining = selisih modulo siklus).
+    """
+    __slots__ = ("sched", "arah", "phase", "dur", "starts", "total", "green_at")
+
+    def __init__(self, schedule: dict):
+        segs = _build_timeline(schedule)
+        self.sched = schedule
+        self.arah = [a for a, _, _ in segs]
+        self.phase = [p for _, p, _ in segs]
+        self.dur = [max(0.0, float(d)) for _, _, d in segs]
+        self.starts = list(itertools.accumulate(self.dur, initial=0.0))
+        self.total = self.starts.pop()
+        self.green_at = {a: self.starts[i] for i, (a, p) in enumerate(zip(self.arah, self.phase)) if p == "green"}
+
+    def locate(self, t: float) -> int:
+        # bisect_right -> segmen durasi 0 (green 0 s) otomatis terlewati
+        return min(max(bisect.bisect_right(self.starts, t) - 1, 0), len(self.starts) - 1)
+
+    def boundary(self, t: float) -> float:
+        """Offset akhir segmen yang aktif di t."""
+        i = self.locate(t)
+        return self.starts[i] + self.dur[i]
+
+    def state_at(self, t: float) -> dict:
+        i = self.locate(t)
+        active_arah, phase = self.arah[i], self.phase[i]
+        remaining = max(0.0, self.starts[i] + self.dur[i] - t)
+        remaining_i = int(round(remaining))
+
+        # rt_green: hanya saat phase == green, arah aktif punya countdown
+        rt_green = {a: 0 for a in URUTAN_ARAH}
+        if phase == "green":
+            rt_green[active_arah] = remaining_i
+
+        # waktu sampai tiap arah masuk hijau (siklus berikutnya dianggap jadwal sama, seperti Pico)
+        rt_red = {}
+        for a, g0 in self.green_at.items():
+            if a == active_arah and phase == "green":
+                rt_red[a] = 0
+            else:
+                rt_red[a] = int(round((g0 - t) % self.total))
 
-        return int(round(t))
+        return {
+            "active_arah": active_arah,
+            "phase": phase,
+            "remaining": remaining_i,
+            "rt_green": rt_green,
+            "rt_red": rt_red,
+        }
 
-    for a in URUTAN_ARAH:
-        if a == active_arah and phase == "green":
-            out[a] = 0
-        else:
-            out[a] = time_to_green(a)
-    return out
 
-def _engine_loop():
-    global _cycle_t0, _current_state, _current_sched, _pending_sched, _current_one_shot
-    while True:
-        with _state_lock:
-            sched = _current_sched
-            tl = _build_timeline(sched)
-            total = sum(d for _, _, d in tl)
-
-            # apply pending hanya saat "siklus penuh" sudah lewat
-            now = time.time()
-            t = (now - _cycle_t0)
-            if total > 0 and t >= total:
-                # wrap ke siklus baru
-                _cycle_t0 = now
-                t = 0.0
-
-                # === APPLY / RESET (one-cycle validity) ===
-                if _pending_sched is not None:
-                    # ada update baru -> pakai untuk 1 cycle berikutnya
-                    _current_sched = _pending_sched
-                    _pending_sched = None
-                    _current_one_shot = True
-                else:
-                    # tidak ada update baru -> kalau cycle barusan pakai hasil deteksi, reset ke default
-                    if _current_one_shot:
-                        _current_sched = {
-                            a: {"Green_time": float(DEFAULT_CYCLE_1[a]["Green_time"]), "Red_time": float(DEFAULT_CYCLE_1[a]["Red_time"])}
-                            for a in URUTAN_ARAH
-                        }
-                        _current_one_shot = False
-
-                sched = _current_sched
-                tl = _build_timeline(sched)
-                total = sum(d for _, _, d in tl)
-
-            # cari segmen aktif
-            acc = 0.0
-            active_arah = URUTAN_ARAH[0]
-            phase = "all_red"
-            seg_dur = 0.0
-            seg_start = 0.0
-            for arah, ph, dur in tl:
-                if acc + dur > t:
-                    active_arah = arah
-                    phase = ph
-                    seg_dur = dur
-                    seg_start = acc
-                    break
-                acc += dur
+def _default_sched() -> dict:
+    return {
+        a: {"Green_time": float(DEFAULT_CYCLE_1[a]["Green_time"]), "Red_time": float(DEFAULT_CYCLE_1[a]["Red_time"])}
+        for a in URUTAN_ARAH
+    }
 
-            remaining = max(0.0, (seg_start + seg_dur) - t)
-            remaining_i = int(round(remaining))
 
-            # rt_green: hanya saat phase == green, arah aktif punya countdown
-            rt_green = {a: 0 for a in URUTAN_ARAH}
-            if phase == "green":
-                rt_green[active_arah] = remaining_i
+# ===================== INTERSECTION (MULTI PERSIMPANGAN) =====================
+# Tiap persimpangan: jadwal berjalan + pending (one-shot 1 siklus), last_fuzzy, state Pico
+# (RT/SCHED terakhir) dan port serial sendiri. Semua persimpangan dimajukan oleh 1 thread
+# scheduler (heap batas segmen) dan semua port serial oleh 1 thread SerialMux.
+# Konfigurasi: SIGMA_INTERSECTIONS_FILE = JSON {"simpang_2": {"serial_port": "/dev/ttyACM1",
+# "serial_baud": 115200}, ...}; persimpangan default (SIGMA_INTERSECTION_ID) = SIGMA_SERIAL_PORT
+# dan dipakai oleh route lama (/api/process, /api/realtime_pico, ...).
+DEFAULT_INTERSECTION_ID = os.getenv("SIGMA_INTERSECTION_ID", "default")
+INTERSECTION_ID_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-")
+# segmen pertama route /api/<literal>/... -> tidak boleh jadi id (/api/{id}/process, /api/{id}/realtime)
+RESERVED_INTERSECTION_IDS = {
+    "fuzzy", "history", "intersections", "metrics", "models", "overlay", "process",
+    "realtime", "realtime_blynk", "realtime_pico", "serial_status", "streams",
+}
 
-            rt_red = _compute_red_remaining(sched, active_arah, phase, remaining)
+class Intersection:
+    def __init__(self, iid: str, serial_port: str = None, serial_baud: int = SERIAL_BAUD):
+        self.id = iid
+        self.lock = threading.Lock()
+        self.current_sched = _default_sched()
+        self.pending_sched = None   # dipakai setelah 1 siklus selesai (mirip Pico apply_pending_update)
+        self.one_shot = False       # schedule hasil deteksi hanya berlaku 1 cycle
+        # (timeline siklus berjalan, t0 monotonic siklus) -> diganti utuh (atomic), dibaca tanpa lock
+        self.engine_cur = (CompiledTimeline(self.current_sched), time.monotonic())
+        self.last_fuzzy = {a: {"Green_time": 10.0, "Red_time": 50.0} for a in URUTAN_ARAH}
+        self.last_pcu = {}          # baris pcu_table terakhir per arah (upload / stream)
+        self.rt_line = None
+        self.rt_ts = 0.0
+        self.sched_line = None
+        self.sched_ts = 0.0
+        self.rollovers = 0
+        self.due = None             # batas segmen berikutnya yang dijadwalkan di scheduler
+        self.link = SerialLink(serial_port, serial_baud, self.on_serial_line) if serial_port else None
+
+    # ---------- serial ----------
+    def on_serial_line(self, line: str):
+        if line.startswith("RT,"):
+            self.rt_line = line
+            self.rt_ts = time.time()
+            history.record_telemetry(self.id, "RT", line, self.rt_ts)
+        elif line.startswith("SCHED,"):
+            # format: SCHED,gU,rU,gT,rT,gS,rS,gB,rB (firmware V1 boleh menambah ,seq -> dibuang di sini)
+            self.sched_line = ",".join(line.split(",")[:9])
+            self.sched_ts = time.time()
+            history.record_telemetry(self.id, "SCHED", line, self.sched_ts)
+
+    def send_schedule_line(self, line: str) -> bool:
+        if self.link is None:
+            print(f"[SERIAL] {self.id}: tidak ada port, jadwal tidak dikirim.")
+            return False
+        return self.link.send(line)
+
+    def serial_status(self) -> dict:
+        if self.link is None:
+            return {"ready": False, "port": None, "baud": None, "detail": "no_port"}
+        return self.link.status
+
+    # ---------- engine ----------
+    def set_pending(self, sched: dict):
+        # jangan langsung otak-atik cycle berjalan, apply pas siklus selesai (mirip Pico)
+        with self.lock:
+            self.pending_sched = sched
+
+    def _roll_cycles_locked(self, now: float):
+        """Majukan siklus yang sudah lewat (harus pegang self.lock). Apply pending / reset one-shot."""
+        tl, t0 = self.engine_cur
+        while now - t0 >= tl.total:
+            t0 += tl.total  # tanpa drift: siklus baru mulai tepat di akhir siklus lama
+            self.rollovers += 1
+
+            # === APPLY / RESET (one-cycle validity) ===
+            if self.pending_sched is not None:
+                # ada update baru -> pakai untuk 1 cycle berikutnya
+                self.current_sched = self.pending_sched
+                self.pending_sched = None
+                self.one_shot = True
+            elif self.one_shot:
+                # tidak ada update baru -> cycle barusan pakai hasil deteksi, reset ke default
+                self.current_sched = _default_sched()
+                self.one_shot = False
+            else:
+                # jadwal default stabil -> lompati semua siklus yang terlewat sekaligus
+                t0 += ((now - t0) // tl.total) * tl.total
+                continue
+            tl = CompiledTimeline(self.current_sched)
+        self.engine_cur = (tl, t0)
+
+    def state(self, now: float = None) -> dict:
+        """
+        State engine saat ini, dihitung saat dibaca dari jam monotonic (tanpa polling).
+        Return: active_arah, phase, remaining, rt_green, rt_red, using_pending.
+        """
+        now = time.monotonic() if now is None else now
+        tl, t0 = self.engine_cur
+        if now - t0 >= tl.total:
+            with self.lock:
+                self._roll_cycles_locked(now)
+            tl, t0 = self.engine_cur
+        st = tl.state_at(now - t0)
+        st["using_pending"] = self.pending_sched is not None
+        return st
+
+    def advance(self, now: float) -> float:
+        """Dipanggil scheduler di batas segmen. Return waktu (monotonic) batas segmen berikutnya."""
+        with self.lock:
+            self._roll_cycles_locked(now)
+            tl, t0 = self.engine_cur
+        return t0 + tl.boundary(now - t0)
+
+    # ---------- realtime (Pico) ----------
+    def realtime_pico_state(self) -> dict:
+        """Isi /api/realtime_pico (dipakai juga oleh push channel)."""
+        pico_sched = parse_sched_line(self.sched_line)
+        sched_age_ms = int((time.time() - self.sched_ts) * 1000) if self.sched_line else None
+
+        # ===== CASE 1: RT BELUM ADA (CYCLE PERTAMA) =====
+        if not self.rt_line:
+            return {
+                "active_arah": "",
+                "phase": "",
+                "remaining": 0,
+                "rt_green": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
+                "rt_red": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
+
+                # ✅ DEFAULT CYCLE 1
+                "schedule": pico_sched if pico_sched else DEFAULT_CYCLE_1,
+
+                "age_ms": None,
+                "delay_ms": None,
+                "sched_age_ms": sched_age_ms,
+                # timestamp absolut (unix detik): client push menghitung umur sendiri
+                "rt_ts": None,
+                "sched_ts": self.sched_ts if self.sched_line else None,
+                "server_ts": time.time(),
+            }
+
+        # ===== CASE 2: RT SUDAH ADA =====
+        parts = self.rt_line.split(",")
+        try:
+            _, active, remaining, gU, gT, gS, gB, rU, rT, rS, rB = parts
 
-            _current_state = {
-                "active_arah": active_arah,
-                "phase": phase,
-                "remaining": remaining_i,
-                "rt_green": rt_green,
-                "rt_red": rt_red,
-                "using_pending": (_pending_sched is not None),
+            return {
+                "active_arah": active,
+                "phase": "GREEN",
+                "remaining": int(float(remaining)),
+
+                "rt_green": {
+                    "UTARA": int(float(gU)),
+                    "TIMUR": int(float(gT)),
+                    "SELATAN": int(float(gS)),
+                    "BARAT": int(float(gB)),
+                },
+                "rt_red": {
+                    "UTARA": int(float(rU)),
+                    "TIMUR": int(float(rT)),
+                    "SELATAN": int(float(rS)),
+                    "BARAT": int(float(rB)),
+                },
+
+                # ✅ DEFAULT CYCLE 1
+                "schedule": pico_sched if pico_sched else DEFAULT_CYCLE_1,
+
+                "age_ms": int((time.time() - self.rt_ts) * 1000),
+                "delay_ms": int((time.time() - self.rt_ts) * 1000),
+                "sched_age_ms": sched_age_ms,
+                "rt_ts": self.rt_ts,
+                "sched_ts": self.sched_ts if self.sched_line else None,
+                "server_ts": time.time(),
             }
 
-        time.sleep(0.2)
+        except Exception:
+            return {"error": "bad_rt_format", "raw": self.rt_line}
+
+    def summary(self) -> dict:
+        st = self.state()
+        return {
+            "id": self.id,
+            "active_arah": st["active_arah"],
+            "phase": st["phase"],
+            "remaining": st["remaining"],
+            "using_pending": st["using_pending"],
+            "one_shot": self.one_shot,
+            "rollovers": self.rollovers,
+            "serial": self.serial_status(),
+        }
+
+
+class IntersectionScheduler:
+    """
+    1 thread untuk semua persimpangan: min-heap (waktu batas segmen, id). Thread tidur sampai
+    batas terdekat, memajukan persimpangan itu, lalu menjadwalkan batas berikutnya.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._heap = []
+        self._cv = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._n = itertools.count()
+        self.wakeups = 0
+
+    def schedule(self, inter: Intersection, due: float):
+        with self._cv:
+            inter.due = due
+            heapq.heappush(self._heap, (due, next(self._n), inter.id))
+            if self._heap[0][2] == inter.id:
+                self._cv.notify()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="intersection-timer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._stop:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cv.wait(wait)
+                    else:
+                        self._cv.wait()
+                if self._stop:
+                    return
+                due, _, iid = heapq.heappop(self._heap)
+            inter = self.registry.get(iid)
+            if inter is None or inter.due != due:
+                continue  # entry basi (persimpangan dihapus / dijadwal ulang)
+            self.wakeups += 1
+            try:
+                nxt = inter.advance(time.monotonic())
+            except Exception as e:
+                print(f"[ENGINE] {iid} error:", repr(e))
+                nxt = time.monotonic() + 1.0
+            self.schedule(inter, max(nxt, time.monotonic() + 0.001))
+
+    def stats(self) -> dict:
+        with self._cv:
+            n = len(self._heap)
+        return {"heap": n, "wakeups": self.wakeups}
+
+
+class IntersectionRegistry:
+    def __init__(self, default_id: str):
+        self.default_id = default_id
+        self._items = {}
+        self._lock = threading.Lock()
+        self.scheduler = IntersectionScheduler(self)
+        self.started = False
+
+    @property
+    def default(self) -> Intersection:
+        return self._items[self.default_id]
+
+    def get(self, iid: str):
+        return self._items.get(iid)
+
+    def ids(self):
+        return list(self._items)
+
+    def add(self, iid: str, serial_port: str = None, serial_baud: int = SERIAL_BAUD) -> Intersection:
+        if not iid or not set(iid) <= INTERSECTION_ID_CHARS:
+            raise ValueError(f"id persimpangan tidak valid: {iid!r}")
+        if iid.lower() in RESERVED_INTERSECTION_IDS:
+            raise ValueError(f"id persimpangan {iid!r} bentrok dengan route /api/{iid}/...")
+        with self._lock:
+            if iid in self._items:
+                return self._items[iid]
+            inter = Intersection(iid, serial_port, serial_baud)
+            self._items[iid] = inter
+        if inter.link is not None:
+            serial_mux.add(inter.link)
+        if self.started:
+            self.scheduler.schedule(inter, inter.advance(time.monotonic()))
+        return inter
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        now = time.monotonic()
+        for inter in list(self._items.values()):
+            self.scheduler.schedule(inter, inter.advance(now))
+        self.scheduler.start()
+        serial_mux.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        serial_mux.stop()
+
+def intersections_from_env() -> dict:
+    path = os.getenv("SIGMA_INTERSECTIONS_FILE", "")
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {str(k): (v or {}) for k, v in json.load(f).items()}
+    except Exception as e:
+        print("[ENGINE] gagal baca SIGMA_INTERSECTIONS_FILE:", e)
+        return {}
+
+intersections = IntersectionRegistry(DEFAULT_INTERSECTION_ID)
+intersections.add(DEFAULT_INTERSECTION_ID, SERIAL_PORT, SERIAL_BAUD)
+for _iid, _cfg in intersections_from_env().items():
+    try:
+        intersections.add(_iid, _cfg.get("serial_port"), int(_cfg.get("serial_baud", SERIAL_BAUD)))
+    except ValueError as e:
+        print("[ENGINE]", e)
+
+def engine_state(now: float = None) -> dict:
+    """State engine persimpangan default (lihat Intersection.state)."""
+    return intersections.default.state(now)
 
-_thread_engine = threading.Thread(target=_engine_loop, daemon=True)
-_thread_engine.start()
 
 
 # ===================== HELPERS =====================
@@ -470,12 +1475,19 @@ def kategori_kendaraan(label: str):
         return "car"
     return None
 
-def draw_overlay(frame, dets, agg_counts, agg_pcu):
+def draw_overlay(frame, dets, agg_counts, agg_pcu, scale: float = 1.0):
+    """
+    dets: array int32 (N, 5) -> x1, y1, x2, y2, kategori_idx (lihat CATEGORIES)
+    scale: ukuran gambar asli / ukuran frame (box di koordinat asli, frame boleh hasil reduced decode)
+    """
     img = frame.copy()
 
-    for d in dets:
-        x1, y1, x2, y2 = d["box_xyxy"]
-        label = d["label"]
+    if scale != 1.0 and len(dets):
+        dets = dets.copy()
+        dets[:, :4] = np.rint(dets[:, :4] / scale)
+
+    for x1, y1, x2, y2, cat in dets.tolist():
+        label = CATEGORIES[cat]
 
         cv2.rectangle(img, (x1, y1), (x2, y2), (10, 255, 20), 2)
         cv2.putText(
@@ -509,138 +1521,669 @@ def draw_overlay(frame, dets, agg_counts, agg_pcu):
 
     return img
 
-def detect_yolo(bgr):
-    results = yolo_model(
-        bgr,
-        imgsz=YOLO_IMGSZ,
-        conf=YOLO_CONF_THRESH,
+def _empty_counts():
+    return {"kendaraan_besar": 0, "car": 0, "motorcycle": 0, "bicycle": 0}
+
+EMPTY_DETS = np.zeros((0, 5), dtype=np.int32)
+
+def build_class_lookup(names) -> np.ndarray:
+    """
+    names (dict id->nama / list) -> array: class_id -> index CATEGORIES (-1 = bukan kendaraan).
+    """
+    items = names.items() if isinstance(names, dict) else enumerate(names)
+    items = [(int(i), n) for i, n in items]
+    lut = np.full(max((i for i, _ in items), default=-1) + 1, -1, dtype=np.int64)
+    for i, cls_name in items:
+        if cls_name not in VEHICLE_CLASSES:
+            continue
+        kat = kategori_kendaraan(cls_name)
+        if kat is not None:
+            lut[i] = CATEGORIES.index(kat)
+    return lut
+
+# FCOS: label 0 = background, 1..N = CLASSES_FCOS_RT
+FCOS_CLASS_LUT = build_class_lookup({i + 1: n for i, n in enumerate(CLASSES_FCOS_RT)})
+
+_class_luts = {}
+
+def _class_lookup_for(key: str, names) -> np.ndarray:
+    lut = _class_luts.get(key)
+    if lut is None:
+        lut = _class_luts[key] = build_class_lookup(names)
+    return lut
+
+def postprocess_detections(boxes, cls_ids, lut, scores=None, conf: float = None):
+    """
+    Semua operasi array (tanpa loop per box).
+    boxes: (N, 4) xyxy, cls_ids: (N,), scores: (N,) opsional (filter >= conf).
+    Return: (dets int32 (K, 5), agg_counts, agg_pcu)
+    """
+    cls_ids = np.asarray(cls_ids).astype(np.int64, copy=False).ravel()
+    keep = (cls_ids >= 0) & (cls_ids < len(lut))
+    if scores is not None and conf is not None:
+        keep &= np.asarray(scores).ravel() >= conf
+
+    cats = np.full(cls_ids.shape, -1, dtype=np.int64)
+    cats[keep] = lut[cls_ids[keep]]
+    keep &= cats >= 0
+    cats = cats[keep]
+
+    dets = np.empty((cats.size, 5), dtype=np.int32)
+    dets[:, :4] = np.asarray(boxes).reshape(-1, 4)[keep]  # float -> int32 = truncate (sama spt int())
+    dets[:, 4] = cats
+
+    counts = np.bincount(cats, minlength=len(CATEGORIES))
+    agg_pcu = float(counts @ CAT_PCU)
+    agg_counts = dict(zip(CATEGORIES, counts.tolist()))
+    return dets, agg_counts, agg_pcu
+
+def _ultra_result_to_dets(r, lut):
+    """
+    Ubah 1 hasil ultralytics (Results) -> (dets, agg_counts, agg_pcu).
+    Dipakai bareng oleh YOLO & RT-DETR. Cukup 1x transfer .cpu() per gambar.
+    """
+    if r is None or r.boxes is None or len(r.boxes) == 0:
+        return EMPTY_DETS, _empty_counts(), 0.0
+
+    data = r.boxes.data.cpu().numpy()  # (N, 6): x1, y1, x2, y2, conf, cls
+    return postprocess_detections(data[:, :4], data[:, 5], lut)
+
+# imgsz & conf per model ultralytics
+_ULTRA_ARGS = {
+    "yolo": {"imgsz": YOLO_IMGSZ, "conf": YOLO_CONF_THRESH},
+    "rtdetr": {"imgsz": RTDETR_IMGSZ, "conf": RTDETR_CONF_THRESH},
+}
+
+def _predict_ultralytics(kind: str, model, frames):
+    results = model(
+        list(frames),
         iou=0.6,
         max_det=500,
         verbose=False,
+        **_ULTRA_ARGS[kind],
     )
+    lut = _class_lookup_for(kind, model.names)
+    return [_ultra_result_to_dets(r, lut) for r in results]
+
+# ===================== FCOS PREPROCESS =====================
+# numpy BGR -> tensor CHW float (RGB, /255) tanpa PIL / ToTensor. Frame langsung di-resize
+# ke IMGSZ (sisi panjang, sama seperti transform internal FCOS) dan semua buffer dipakai ulang
+# per (shape, posisi di batch) -> steady state tanpa alokasi per request.
+FCOS_BUFFER_SHAPES_MAX = int(os.getenv("SIGMA_FCOS_BUFFER_SHAPES", "16"))
+
+class FcosInputBuffers:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()  # dipegang selama preprocess + forward (buffer dipakai model)
+        self._bufs = OrderedDict()    # (h, w, slot) -> (resized uint8 HWC, host float CHW, device float CHW)
+
+    def get(self, h: int, w: int, slot: int):
+        key = (h, w, slot)
+        bufs = self._bufs.get(key)
+        if bufs is None:
+            pin = DEVICE.type == "cuda"
+            resized = np.empty((h, w, 3), dtype=np.uint8)
+            host = torch.empty((3, h, w), dtype=torch.float32, pin_memory=pin)
+            dev = torch.empty((3, h, w), dtype=torch.float32, device=DEVICE) if pin else host
+            bufs = self._bufs[key] = (resized, host, dev)
+            while len(self._bufs) > self.max_entries:
+                self._bufs.popitem(last=False)
+        else:
+            self._bufs.move_to_end(key)
+        return bufs
 
-    r = results[0]
-    dets = []
-    agg_counts = {"kendaraan_besar": 0, "car": 0, "motorcycle": 0, "bicycle": 0}
-    agg_pcu = 0.0
+_fcos_buffers = FcosInputBuffers(FCOS_BUFFER_SHAPES_MAX)
 
-    if r is not None and r.boxes is not None and len(r.boxes) > 0:
-        names = yolo_model.names
-        for b in r.boxes:
-            cls_name = names[int(b.cls.item())]
-            if cls_name not in VEHICLE_CLASSES:
-                continue
+def fcos_preprocess(bgr, slot: int = 0):
+    """
+    Return: (tensor CHW float di DEVICE, scale) -> box output model dibagi scale = koordinat frame.
+    Panggil sambil memegang _fcos_buffers.lock.
+    """
+    h, w = bgr.shape[:2]
+    scale = IMGSZ / float(max(h, w))
+    rh, rw = max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+    resized, host, dev = _fcos_buffers.get(rh, rw, slot)
 
-            kat = kategori_kendaraan(cls_name)
-            if kat is None:
-                continue
+    if (rh, rw) == (h, w):
+        np.copyto(resized, bgr)
+    else:
+        cv2.resize(bgr, (rw, rh), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+    # channel swap BGR->RGB + uint8->float + /255 dalam 1 pass per channel
+    src = torch.from_numpy(resized)
+    for c in range(3):
+        torch.mul(src[:, :, 2 - c], 1.0 / 255.0, out=host[c])
+
+    if dev is not host:
+        dev.copy_(host, non_blocking=True)
+    return dev, (rw / float(w), rh / float(h))
+
+def _predict_fcos_torch(model, frames):
+    with _fcos_buffers.lock:
+        img_tensors, scales = [], []
+        for i, bgr in enumerate(frames):
+            t, sc = fcos_preprocess(bgr, slot=i)
+            img_tensors.append(t)
+            scales.append(sc)
+
+        with torch.no_grad():
+            outputs_list = model(img_tensors)
+
+    out = []
+    for outputs, (sx, sy) in zip(outputs_list, scales):
+        boxes = outputs["boxes"].cpu().numpy()
+        labels = outputs["labels"].cpu().numpy()
+        scores = outputs["scores"].cpu().numpy()
+        boxes[:, [0, 2]] /= sx
+        boxes[:, [1, 3]] /= sy
+        out.append(postprocess_detections(boxes, labels, FCOS_CLASS_LUT, scores=scores, conf=CONF_THRESH))
+    return out
 
-            agg_counts[kat] += 1
-            agg_pcu += PCU.get(kat, 0.0)
+def _predict_onnx(kind: str, model, frames):
+    if kind == "fcos":
+        lut, conf = FCOS_CLASS_LUT, CONF_THRESH
+    else:
+        # conf YOLO/RT-DETR sudah difilter di dalam OnnxDetector
+        lut, conf = _class_lookup_for(f"{kind}:onnx", model.names), None
+    return [
+        postprocess_detections(boxes, cls_ids, lut, scores=scores, conf=conf)
+        for boxes, cls_ids, scores in model.predict(frames)
+    ]
 
-            x1, y1, x2, y2 = map(int, b.xyxy.cpu().numpy().ravel())
-            dets.append({"label": kat, "box_xyxy": [x1, y1, x2, y2]})
+def predict_with_model(kind: str, model, frames):
+    """
+    Jalankan 1 batch frame di model tertentu (PyTorch / ONNX).
+    Return: list (dets, agg_counts, agg_pcu), urutan sama dengan input.
+    """
+    if not frames:
+        return []
+    if getattr(model, "backend", "torch") == "onnx":
+        return _predict_onnx(kind, model, frames)
+    if kind == "fcos":
+        return _predict_fcos_torch(model, frames)
+    return _predict_ultralytics(kind, model, frames)
+
+def detect_with_key(key: str, frames):
+    """
+    key = key ModelRegistry ("yolo", "fcos_int8", ...). 1 batch frame -> 1x forward pass.
+    Return: list (dets, agg_counts, agg_pcu), urutan sama dengan input.
+    """
+    if not frames:
+        return []
 
-    return dets, agg_counts, agg_pcu
+    kind = model_kind(key)
+    try:
+        with models.use(key) as model:
+            return predict_with_model(kind, model, frames)
+    except ModelUnavailable:
+        if kind != "rtdetr":
+            raise
+        # RT-DETR tidak tersedia -> hasil kosong (perilaku lama)
+        return [(EMPTY_DETS, _empty_counts(), 0.0) for _ in frames]
+
+def detect_yolo_batch(frames):
+    """
+    Semua frame (list BGR) masuk 1x forward pass YOLO.
+    Return: list (dets, agg_counts, agg_pcu), urutan sama dengan input.
+    """
+    return detect_with_key(resolve_model_key("yolo"), frames)
+
+def detect_yolo(bgr):
+    return detect_yolo_batch([bgr])[0]
+
+def detect_fcos_batch(frames):
+    """
+    FCOS torchvision terima list tensor (ukuran boleh beda) -> 1x forward pass.
+    """
+    return detect_with_key(resolve_model_key("fcos"), frames)
 
 def detect_fcos(bgr):
-    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-    pil_img = Image.fromarray(rgb)
-    img_tensor = to_tensor(pil_img).to(DEVICE)
+    return detect_fcos_batch([bgr])[0]
 
-    with torch.no_grad():
-        outputs = fcos_model([img_tensor])[0]
+def detect_rtdetr_batch(frames):
+    return detect_with_key(resolve_model_key("rtdetr"), frames)
 
-    boxes = outputs["boxes"].cpu().numpy()
-    labels = outputs["labels"].cpu().numpy()
-    scores = outputs["scores"].cpu().numpy()
+def detect_rtdetr(bgr):
+    return detect_rtdetr_batch([bgr])[0]
+
+# ===================== MICRO-BATCHING SCHEDULER =====================
+# Frame dari beberapa request yang datang bersamaan dikumpulkan (max BATCH_MAX_WAIT_MS
+# atau BATCH_MAX_SIZE frame), lalu 1x forward pass, hasil dibagikan ke future masing2.
+BATCH_MAX_WAIT_MS = float(os.getenv("SIGMA_BATCH_MAX_WAIT_MS", "15"))
+BATCH_MAX_SIZE = int(os.getenv("SIGMA_BATCH_MAX_SIZE", "16"))
+
+class MicroBatcher:
+    def __init__(self, name: str, batch_fn, max_batch: int, max_wait_ms: float):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._q = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._frames = 0
+        self._batch_sizes = {}               # ukuran batch -> jumlah
+        self._waits_ms = deque(maxlen=1024)  # antre sampai forward pass mulai
+        self._run_ms = deque(maxlen=256)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, frame) -> Future:
+        self._ensure_thread()
+        fut = Future()
+        self._q.put((time.monotonic(), frame, fut))
+        return fut
+
+    def run(self, frames):
+        """Blocking: submit semua frame lalu tunggu hasilnya (urutan sama dengan input)."""
+        futs = [self.submit(f) for f in frames]
+        return [f.result() for f in futs]
+
+    def _collect(self):
+        first = self._q.get()
+        batch = [first]
+        deadline = first[0] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._q.get(timeout=timeout) if timeout > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-    dets = []
-    agg_counts = {"kendaraan_besar": 0, "car": 0, "motorcycle": 0, "bicycle": 0}
-    agg_pcu = 0.0
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            t_start = time.monotonic()
+            try:
+                outs = self.batch_fn([frame for _, frame, _ in batch])
+                for (_, _, fut), out in zip(batch, outs):
+                    fut.set_result(out)
+            except Exception as e:
+                print(f"[BATCH:{self.name}] ERROR:", repr(e))
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            t_end = time.monotonic()
+
+            with self._stats_lock:
+                self._batches += 1
+                self._frames += len(batch)
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+                self._waits_ms.extend((t_start - t_enq) * 1000.0 for t_enq, _, _ in batch)
+                self._run_ms.append((t_end - t_start) * 1000.0)
+
+    def stats(self) -> dict:
+        def pct(values, p):
+            if not values:
+                return None
+            v = sorted(values)
+            return round(v[min(len(v) - 1, int(p * len(v)))], 2)
+
+        with self._stats_lock:
+            waits = list(self._waits_ms)
+            runs = list(self._run_ms)
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "pending": self._q.qsize(),
+                "batches": self._batches,
+                "frames": self._frames,
+                "avg_batch_size": round(self._frames / self._batches, 2) if self._batches else None,
+                "batch_size_hist": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms": {"p50": pct(waits, 0.50), "p95": pct(waits, 0.95), "max": pct(waits, 1.0)},
+                "forward_ms": {"p50": pct(runs, 0.50), "p95": pct(runs, 0.95), "max": pct(runs, 1.0)},
+            }
 
-    for box, lbl, score in zip(boxes, labels, scores):
-        if score < CONF_THRESH:
-            continue
+# 1 batcher per key registry (yolo, yolo_int8, fcos, ...)
+_batchers = {
+    key: MicroBatcher(key, (lambda frames, k=key: detect_with_key(k, frames)), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    for key in models.names()
+}
 
-        cls_id = int(lbl)
-        if cls_id <= 0 or cls_id > len(CLASSES_FCOS_RT):
-            continue
+def detect_batch(frames, model_type: str):
+    if not frames:
+        return []
+    return _batchers[resolve_model_key(model_type)].run(frames)
+
+# ===================== IMAGE DECODE =====================
+# Upload kamera bisa 4K, padahal model langsung downscale ke imgsz-nya.
+# Kalau sumber jauh lebih besar, decode JPEG langsung di skala 1/2, 1/4, 1/8 (libjpeg DCT scaling).
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
-        cls_name = CLASSES_FCOS_RT[cls_id - 1]
-        if cls_name not in VEHICLE_CLASSES:
-            continue
+def image_size_from_header(buf):
+    """(w, h) dari header JPEG/PNG tanpa decode. None kalau format lain / rusak."""
+    if buf[:8] == b"\x89PNG\r\n\x1a\n" and len(buf) >= 24:
+        w, h = struct.unpack(">II", buf[16:24])
+        return w, h
 
-        kat = kategori_kendaraan(cls_name)
-        if kat is None:
+    if buf[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(buf)
+    while i + 9 < n:
+        if buf[i] != 0xFF:
+            i += 1
             continue
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in _JPEG_SOF:
+            h, w = struct.unpack(">HH", buf[i + 5:i + 9])
+            return w, h
+        i += 2 + struct.unpack(">H", buf[i + 2:i + 4])[0]
+    return None
 
-        x1, y1, x2, y2 = map(int, box)
-        agg_counts[kat] += 1
-        agg_pcu += PCU.get(kat, 0.0)
-        dets.append({"label": kat, "box_xyxy": [x1, y1, x2, y2]})
+def model_input_size(model_type: str) -> int:
+    return {"fcos": IMGSZ, "rtdetr": RTDETR_IMGSZ}.get(model_kind(resolve_model_key(model_type)), YOLO_IMGSZ)
 
-    return dets, agg_counts, agg_pcu
+def decode_image_bytes(img_bytes, target_size: int = None):
+    """
+    Decode tanpa copy (np.frombuffer). Kalau target_size diisi & gambar jauh lebih besar,
+    pakai IMREAD_REDUCED_COLOR_* (sisi panjang hasil decode tetap >= target_size).
+    Return: (bgr | None, scale) -> scale = ukuran asli / ukuran hasil decode.
+    """
+    arr = np.frombuffer(img_bytes, dtype=np.uint8)
+
+    flag = cv2.IMREAD_COLOR
+    size = image_size_from_header(img_bytes) if target_size else None
+    if size is not None:
+        long_side = max(size)
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if long_side / factor >= target_size:
+                flag = reduced_flag
+                break
 
-def detect_rtdetr(bgr):
-    if rtdetr_model is None:
-        agg_counts = {"kendaraan_besar": 0, "car": 0, "motorcycle": 0, "bicycle": 0}
-        return [], agg_counts, 0.0
-
-    results = rtdetr_model(
-        bgr,
-        imgsz=RTDETR_IMGSZ,
-        conf=RTDETR_CONF_THRESH,
-        iou=0.6,
-        max_det=500,
-        verbose=False,
-    )
+    bgr = cv2.imdecode(arr, flag)
+    if bgr is None:
+        return None, 1.0
+    if flag == cv2.IMREAD_COLOR:
+        return bgr, 1.0
+    # pakai sisi panjang (aman walau EXIF orientation memutar gambar)
+    return bgr, max(size) / float(max(bgr.shape[:2]))
+
+# ===================== DETECTION RESULT CACHE =====================
+# Key = hash isi gambar + model (termasuk backend/int8) + imgsz + conf -> hasil deteksi compact.
+# Upload ulang gambar yang sama tidak perlu decode / inference lagi.
+DET_CACHE_MB = float(os.getenv("SIGMA_DET_CACHE_MB", "32"))
+DET_CACHE_DIR = os.getenv("SIGMA_DET_CACHE_DIR", "")  # kosong = tanpa tier disk
+DET_CACHE_DISK_MB = float(os.getenv("SIGMA_DET_CACHE_DISK_MB", "512"))
+
+class DetectionCache:
+    ENTRY_OVERHEAD = 512  # perkiraan byte per entri (dict counts, tuple, key)
+
+    def __init__(self, max_bytes: int, disk_dir: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (dets, counts, pcu)
+        self._bytes = 0
+        self._disk_writes = 0
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(img_bytes, model_type: str) -> str:
+        key = resolve_model_key(model_type)
+        kind = model_kind(key)
+        if kind == "fcos":
+            imgsz, conf = IMGSZ, CONF_THRESH
+        else:
+            imgsz, conf = _ULTRA_ARGS[kind]["imgsz"], _ULTRA_ARGS[kind]["conf"]
+        if key.endswith(INT8_SUFFIX):
+            # static vs dynamic = model berbeda -> entry disk tier tidak boleh tertukar
+            backend = f"onnx-int8-{int8_mode_for(kind)}"
+        else:
+            backend = "onnx" if (kind in ONNX_MODELS and key == kind) else "torch"
+        digest = hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+        return f"{digest}:{key}:{backend}:{imgsz}:{conf}"
+
+    def _entry_size(self, value) -> int:
+        return value[0].nbytes + self.ENTRY_OVERHEAD
+
+    def _disk_path(self, key: str) -> str:
+        name = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.disk_dir, name + ".npz")
+
+    def _put_mem(self, key: str, value):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= self._entry_size(old)
+            self._items[key] = value
+            self._bytes += self._entry_size(value)
+            while self._items and self._bytes > self.max_bytes:
+                _, v = self._items.popitem(last=False)
+                self._bytes -= self._entry_size(v)
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits_mem += 1
+                return value
+
+        value = self._get_disk(key) if self.disk_dir else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+        self._put_mem(key, value)
+        return value
+
+    def put(self, key: str, value):
+        self._put_mem(key, value)
+        if self.disk_dir:
+            self._put_disk(key, value)
+
+    def _get_disk(self, key: str):
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as z:
+                counts = np.asarray(z["counts"], dtype=np.int64)
+                value = (z["dets"].astype(np.int32), dict(zip(CATEGORIES, counts.tolist())), float(z["pcu"]))
+            os.utime(path)  # LRU disk pakai mtime
+            return value
+        except (OSError, KeyError, ValueError):
+            return None
 
-    r = results[0]
-    dets = []
-    agg_counts = {"kendaraan_besar": 0, "car": 0, "motorcycle": 0, "bicycle": 0}
-    agg_pcu = 0.0
-
-    if r is not None and r.boxes is not None and len(r.boxes) > 0:
-        names = rtdetr_model.names
-        for b in r.boxes:
-            cls_id = int(b.cls.item())
-            cls_name = names[cls_id]
-            if cls_name not in VEHICLE_CLASSES:
-                continue
+    def _put_disk(self, key: str, value):
+        dets, counts, pcu = value
+        path = self._disk_path(key)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, dets=dets, counts=np.array([counts[k] for k in CATEGORIES]), pcu=np.float64(pcu))
+            os.replace(tmp, path)
+        except OSError as e:
+            print("[DET_CACHE] disk write error:", e)
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 64 == 0:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        try:
+            files = [os.path.join(self.disk_dir, fn) for fn in os.listdir(self.disk_dir) if fn.endswith(".npz")]
+            stats = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in files))
+        except OSError:
+            return
+        total = sum(sz for _, sz, _ in stats)
+        for _, sz, p in stats:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(p)
+                total -= sz
+            except OSError:
+                pass
 
-            kat = kategori_kendaraan(cls_name)
-            if kat is None:
-                continue
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_mem + self.hits_disk + self.misses
+            return {
+                "entries": len(self._items),
+                "mb": round(self._bytes / (1024 * 1024), 3),
+                "max_mb": self.max_bytes / (1024 * 1024),
+                "disk_dir": self.disk_dir or None,
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_mem + self.hits_disk) / lookups, 3) if lookups else None,
+            }
 
-            x1, y1, x2, y2 = map(int, b.xyxy.cpu().numpy().ravel())
-            agg_counts[kat] += 1
-            agg_pcu += PCU.get(kat, 0.0)
-            dets.append({"label": kat, "box_xyxy": [x1, y1, x2, y2]})
+det_cache = DetectionCache(
+    int(DET_CACHE_MB * 1024 * 1024),
+    disk_dir=DET_CACHE_DIR,
+    disk_max_bytes=int(DET_CACHE_DISK_MB * 1024 * 1024),
+)
 
-    return dets, agg_counts, agg_pcu
 
-def process_image_bytes(img_bytes, model_type: str, save_overlay: bool = True, out_name: str = "OUT"):
-    arr = np.asarray(bytearray(img_bytes), dtype=np.uint8)
-    bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if bgr is None:
-        return None
+# ===================== OVERLAY (LAZY RENDER + LRU) =====================
+# Request deteksi tidak lagi menggambar + imwrite overlay. Yang disimpan cuma bytes upload
+# (JPEG asli, kecil) + deteksi per request_id; render + encode JPEG dikerjakan worker
+# background atau saat GET pertama, hasilnya di-cache (LRU, dibatasi MB) dengan ETag.
+OVERLAY_CACHE_MB = float(os.getenv("SIGMA_OVERLAY_CACHE_MB", "64"))
+OVERLAY_MAX_ITEMS = int(os.getenv("SIGMA_OVERLAY_MAX_ITEMS", "256"))
+OVERLAY_MAX_SIDE = int(os.getenv("SIGMA_OVERLAY_MAX_SIDE", "1280"))
+OVERLAY_JPEG_QUALITY = int(os.getenv("SIGMA_OVERLAY_JPEG_QUALITY", "85"))
+OVERLAY_EAGER = os.getenv("SIGMA_OVERLAY_EAGER", "1") == "1"  # render di background tanpa nunggu GET
+
+class OverlayStore:
+    def __init__(self, max_bytes: int, max_items: int):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # (rid, arah) -> {"src": bytes|None, "det": tuple|None, "jpeg": bytes|None, "etag": str|None}
+        self._bytes = 0
+        self._render_locks = {}
+        self._q = queue.Queue()
+        self._thread = None
+        self.renders = 0
+        self.hits = 0
+
+    @staticmethod
+    def _size(item) -> int:
+        return len(item["src"] or b"") + len(item["jpeg"] or b"")
+
+    def _evict(self):
+        while self._items and (self._bytes > self.max_bytes or len(self._items) > self.max_items):
+            _, old = self._items.popitem(last=False)
+            self._bytes -= self._size(old)
+
+    def put(self, rid: str, arah: str, img_bytes: bytes, dets, counts, pcu):
+        key = (rid, arah)
+        item = {"src": bytes(img_bytes), "det": (dets, counts, pcu), "jpeg": None, "etag": None}
+        with self._lock:
+            self._items[key] = item
+            self._bytes += self._size(item)
+            self._evict()
+        if OVERLAY_EAGER:
+            self._ensure_worker()
+            self._q.put(key)
+        return f"/api/overlay/{rid}/{arah}.jpg"
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name="overlay-render", daemon=True)
+                    self._thread.start()
+
+    def _worker(self):
+        while True:
+            key = self._q.get()
+            try:
+                self.get(*key)
+            except Exception as e:
+                print("[OVERLAY] render error:", repr(e))
+
+    def _render(self, src: bytes, det):
+        dets, counts, pcu = det
+        bgr, scale = decode_image_bytes(src, target_size=OVERLAY_MAX_SIDE)
+        if bgr is None:
+            return None
+        overlay = draw_overlay(bgr, dets, counts, pcu, scale=scale)
+        ok, buf = cv2.imencode(".jpg", overlay, [cv2.IMWRITE_JPEG_QUALITY, OVERLAY_JPEG_QUALITY])
+        return buf.tobytes() if ok else None
+
+    def get(self, rid: str, arah: str):
+        """Return (jpeg_bytes, etag) atau None kalau tidak ada / sudah ter-evict."""
+        key = (rid, arah)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            if item["jpeg"] is not None:
+                self.hits += 1
+                return item["jpeg"], item["etag"]
+            rlock = self._render_locks.setdefault(key, threading.Lock())
+
+        with rlock:  # request lain utk key yang sama nunggu render yang sedang jalan
+            with self._lock:
+                if item["jpeg"] is not None:
+                    return item["jpeg"], item["etag"]
+            try:
+                jpeg = self._render(item["src"], item["det"])
+            finally:
+                # juga saat render raise (gambar rusak) -> lock per key tidak menumpuk
+                with self._lock:
+                    if self._render_locks.get(key) is rlock:
+                        del self._render_locks[key]
+            with self._lock:
+                if jpeg is None:
+                    return None
+                etag = '"' + hashlib.blake2b(jpeg, digest_size=12).hexdigest() + '"'
+                if self._items.get(key) is item:
+                    self._bytes -= self._size(item)
+                    item.update(jpeg=jpeg, etag=etag, src=None, det=None)
+                    self._bytes += self._size(item)
+                    self._evict()
+                self.renders += 1
+                return jpeg, etag
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "rendered": sum(1 for it in self._items.values() if it["jpeg"] is not None),
+                "mb": round(self._bytes / (1024 * 1024), 2),
+                "max_mb": self.max_bytes / (1024 * 1024),
+                "renders": self.renders,
+                "hits": self.hits,
+                "pending_eager": self._q.qsize(),
+            }
 
-    model_type = (model_type or "yolo").lower()
-    if model_type == "fcos":
-        dets, counts, pcu = detect_fcos(bgr)
-    elif model_type == "rtdetr":
-        dets, counts, pcu = detect_rtdetr(bgr)
-    else:
-        dets, counts, pcu = detect_yolo(bgr)
+overlays = OverlayStore(int(OVERLAY_CACHE_MB * 1024 * 1024), OVERLAY_MAX_ITEMS)
 
-    overlay_url = None
-    if save_overlay:
-        overlay = draw_overlay(bgr, dets, counts, pcu)
-        out_path = os.path.join(OUT_DIR, f"{out_name}.jpg")
-        cv2.imwrite(out_path, overlay)
-        overlay_url = f"/static/output/{out_name}.jpg"
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
 
+def _format_result(counts, pcu, overlay_url=None):
     return {
         "pcu_total": round(float(pcu), 2),
         "counts": {
@@ -652,6 +2195,95 @@ def process_image_bytes(img_bytes, model_type: str, save_overlay: bool = True, o
         "overlay_url": overlay_url,
     }
 
+def _rescale_dets(dets, scale: float):
+    """Box dari frame hasil reduced decode -> koordinat gambar asli."""
+    if scale == 1.0 or len(dets) == 0:
+        return dets
+    out = dets.copy()
+    out[:, :4] = np.rint(dets[:, :4] * scale)
+    return out
+
+def process_images_batch(images: dict, model_type: str, save_overlay: bool = True, request_id: str = None):
+    """
+    images: {nama_arah: img_bytes}
+    Cek cache hasil deteksi dulu; sisanya decode -> 1 batch ke model -> dipecah lagi per arah.
+    Overlay tidak digambar di sini; cuma didaftarkan ke OverlayStore (URL per request_id).
+    Return: {nama_arah: result | None (gambar invalid)}, urutan key = urutan input.
+    """
+    rid = request_id or new_request_id()
+    target = model_input_size(model_type)
+
+    detections = {}
+    cache_keys = {}
+    for name, b in images.items():
+        cache_keys[name] = det_cache.key_for(b, model_type)
+        hit = det_cache.get(cache_keys[name])
+        if hit is not None:
+            detections[name] = hit
+
+    misses = [name for name in images if name not in detections]
+    decoded = {name: decode_image_bytes(images[name], target_size=target) for name in misses}
+    valid = [name for name in misses if decoded[name][0] is not None]
+
+    batch_out = detect_batch([decoded[name][0] for name in valid], model_type)
+    for name, (dets, counts, pcu) in zip(valid, batch_out):
+        detections[name] = (_rescale_dets(dets, decoded[name][1]), counts, pcu)
+        det_cache.put(cache_keys[name], detections[name])
+
+    out = {name: None for name in images}
+    for name in images:
+        if name not in detections:
+            continue
+        dets, counts, pcu = detections[name]
+        overlay_url = overlays.put(rid, name, images[name], dets, counts, pcu) if save_overlay else None
+        out[name] = _format_result(counts, pcu, overlay_url)
+    return out
+
+def process_image_bytes(img_bytes, model_type: str, save_overlay: bool = True, out_name: str = "OUT"):
+    return process_images_batch({out_name: img_bytes}, model_type, save_overlay=save_overlay)[out_name]
+
+
+# ===================== INFERENCE EXECUTOR =====================
+# Inference (decode + forward + imwrite) itu blocking -> jangan jalan di event loop uvicorn.
+# Pool thread khusus + antrian terbatas; kalau penuh langsung ditolak (503 + Retry-After).
+INFER_WORKERS = int(os.getenv("SIGMA_INFER_WORKERS", "2"))
+INFER_QUEUE_MAX = int(os.getenv("SIGMA_INFER_QUEUE_MAX", "8"))
+INFER_RETRY_AFTER = int(os.getenv("SIGMA_INFER_RETRY_AFTER", "2"))
+
+_infer_executor = ThreadPoolExecutor(max_workers=INFER_WORKERS, thread_name_prefix="infer")
+# slot = job yang sedang jalan + job yang antri
+_infer_slots = threading.BoundedSemaphore(INFER_WORKERS + INFER_QUEUE_MAX)
+
+class InferenceBusy(Exception):
+    pass
+
+def _submit_inference(fn, *args, **kwargs):
+    if not _infer_slots.acquire(blocking=False):
+        raise InferenceBusy()
+    try:
+        fut = _infer_executor.submit(fn, *args, **kwargs)
+    except Exception:
+        _infer_slots.release()
+        raise
+    # slot dilepas saat job benar2 selesai (bukan saat client disconnect)
+    fut.add_done_callback(lambda _: _infer_slots.release())
+    return fut
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Jalankan fn di pool inference dan await hasilnya.
+    Raise HTTPException 503 (Retry-After) kalau antrian penuh.
+    """
+    try:
+        fut = _submit_inference(fn, *args, **kwargs)
+    except InferenceBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Inference queue penuh, coba lagi sebentar.",
+            headers={"Retry-After": str(INFER_RETRY_AFTER)},
+        )
+    return await asyncio.wrap_future(fut)
+
 
 # ===================== FUZZY =====================
 def fuzzy_low(x):
@@ -677,119 +2309,854 @@ def fuzzy_high(x):
         return (x - 20) / 10.0
     return 1.0
 
+# ---- versi NumPy (vektor) ----
+# Rule base di-compile sekali: tiap membership = daftar (batas kiri, batas kanan, ekspresi) dengan
+# ekspresi & urutan operasi sama persis dengan fungsi skalar di atas -> hasil identik sampai bit,
+# tapi dievaluasi untuk seluruh matriks PCU (skenario x arah) sekaligus. Tanpa DataFrame.
+FUZZY_BASE = 10.0
+FUZZY_EXTRA = 40.0
+FUZZY_MIN_WEIGHT = 0.1
+
+_FUZZY_RULES = (
+    # (bobot rule, [(lo, hi, f(x)) untuk lo < x <= hi], nilai di luar semua segmen)
+    (0.5, [(-np.inf, 0, lambda x: np.ones_like(x)),
+           (0, 15, lambda x: 1 - (x / 15.0)),
+           (15, 25, lambda x: np.maximum(0.0, (25 - x) / 10.0))], 0.0),          # low
+    (1.0, [(10, 20, lambda x: (x - 10) / 10.0),
+           (20, 30, lambda x: (30 - x) / 10.0)], 0.0),                            # med
+    (1.5, [(-np.inf, 20, lambda x: np.zeros_like(x)),
+           (20, 30, lambda x: (x - 20) / 10.0)], 1.0),                            # high
+)
+
+class FuzzyEngine:
+    def __init__(self, rules=_FUZZY_RULES, base=FUZZY_BASE, extra=FUZZY_EXTRA,
+                 g_min=MIN_GREEN_FUZZY, g_max=MAX_GREEN_FUZZY, min_weight=FUZZY_MIN_WEIGHT):
+        self.rules = [(float(w), [(float(lo), float(hi), f) for lo, hi, f in segs], float(other))
+                      for w, segs, other in rules]
+        self.base = base
+        self.extra = extra
+        self.g_min = g_min
+        self.g_max = g_max
+        self.min_weight = min_weight
+
+    def weights(self, P: np.ndarray) -> np.ndarray:
+        """Bobot rule per sel PCU: sum(bobot_rule * membership), minimal min_weight."""
+        w = None
+        for rw, segs, other in self.rules:
+            conds = [(P > lo) & (P <= hi) for lo, hi, _ in segs]
+            mu = np.select(conds, [f(P) for _, _, f in segs], other)
+            w = rw * mu if w is None else w + rw * mu
+        return np.maximum(w, self.min_weight)
+
+    def evaluate(self, pcu, round_2: bool = True):
+        """
+        pcu: (A,) atau (S, A) PCU per arah (S skenario, A arah; urutan arah bebas).
+        Return (green, red) dengan shape sama. red[i] = jumlah green arah lain.
+        """
+        P = np.asarray(pcu, dtype=np.float64)
+        one = P.ndim == 1
+        P = np.atleast_2d(P)
+        w = self.weights(P)
+        SW = np.cumsum(w, axis=1)[:, -1:]  # penjumlahan kiri->kanan seperti sum()
+        green = np.clip(self.base + (w / SW) * self.extra, self.g_min, self.g_max)
+
+        # red_i = g_0 + ... + g_(i-1) + g_(i+1) + ... (urutan sama dengan sum() skalar)
+        A = green.shape[1]
+        prefix = np.zeros_like(green)
+        prefix[:, 1:] = np.cumsum(green, axis=1)[:, :-1]
+        red = np.empty_like(green)
+        for i in range(A):
+            r = prefix[:, i].copy()
+            for j in range(i + 1, A):
+                r += green[:, j]
+            red[:, i] = r
+
+        if round_2:
+            green = np.round(green, 2)
+            red = np.round(red, 2)
+        return (green[0], red[0]) if one else (green, red)
+
+fuzzy_engine = FuzzyEngine()
+
+def fuzzy_schedule(pcu_by_arah: dict) -> dict:
+    """{arah: PCU_total} -> {arah: {"PCU_total", "Green_time", "Red_time"}} (urutan arah dipertahankan)."""
+    names = list(pcu_by_arah)
+    if not names:
+        return {}
+    pcu = [float(pcu_by_arah[n]) for n in names]
+    green, red = fuzzy_engine.evaluate(pcu, round_2=False)
+    return {
+        n: {"PCU_total": p, "Green_time": round(g, 2), "Red_time": round(r, 2)}
+        for n, p, g, r in zip(names, pcu, green.tolist(), red.tolist())
+    }
+
 def compute_fuzzy(df):
-    BASE = 10.0
-    EXTRA = 40.0
-    G_MIN = MIN_GREEN_FUZZY
-    G_MAX = MAX_GREEN_FUZZY
-
-    weights = {}
-    for idx, row in df.iterrows():
-        p = row["PCU_total"]
-        w = 0.5 * fuzzy_low(p) + 1.0 * fuzzy_med(p) + 1.5 * fuzzy_high(p)
-        weights[idx] = max(w, 0.1)
-
-    SW = sum(weights.values()) if len(weights) else 1.0
-    green = {}
-    for idx in df.index:
-        share = weights[idx] / SW
-        g = BASE + share * EXTRA
-        g = max(G_MIN, min(G_MAX, g))
-        green[idx] = g
-
-    rows = []
-    for idx in df.index:
-        g = green[idx]
-        r = sum(green[j] for j in green if j != idx)
-        rows.append(
-            {
-                "Persimpangan": idx,
-                "PCU_total": float(df.loc[idx]["PCU_total"]),
-                "Green_time": round(g, 2),
-                "Red_time": round(r, 2),
-            }
-        )
+    """Versi DataFrame (offline / analitik); request path pakai fuzzy_schedule langsung."""
+    import pandas as pd
 
+    table = fuzzy_schedule({idx: df.loc[idx]["PCU_total"] for idx in df.index})
+    rows = [{"Persimpangan": idx, **v} for idx, v in table.items()]
     return pd.DataFrame(rows).set_index("Persimpangan")
 
 
-# ===================== ROUTES =====================
-@app.get("/health")
-def health():
-    return {"status": "ok"}
+# ===================== HISTORY (TIME-SERIES) =====================
+# Riwayat counts/PCU/latency, jadwal fuzzy & telemetry Pico -> SQLite WAL (history.py).
+# Ditulis async oleh 1 thread writer (batch); request path cuma enqueue. Rollup menit/jam/hari
+# di-update incremental oleh writer yang sama -> /api/history/<pcu|green_split|cycle_length>.
+# SIGMA_HISTORY_DB kosong / "off" -> dimatikan.
+HISTORY_DB = os.getenv("SIGMA_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db"))
+HISTORY_ENABLED = HISTORY_DB.strip().lower() not in ("", "0", "off", "false", "none")
+
+class _NoHistory:
+    def record_detections(self, *a, **kw): pass
+    def record_schedule(self, *a, **kw): pass
+    def record_telemetry(self, *a, **kw): pass
+    def start(self): pass
+    def stop(self, timeout: float = 5.0): pass
+    def stats(self) -> dict: return {"enabled": False}
+
+history = HistoryStore(
+    HISTORY_DB,
+    batch=int(os.getenv("SIGMA_HISTORY_BATCH", "500")),
+    flush_ms=float(os.getenv("SIGMA_HISTORY_FLUSH_MS", "1000")),
+    queue_max=int(os.getenv("SIGMA_HISTORY_QUEUE", "10000")),
+    retention_days=float(os.getenv("SIGMA_HISTORY_RETENTION_DAYS", "30")),
+    telemetry_retention_days=float(os.getenv("SIGMA_HISTORY_TELEMETRY_RETENTION_DAYS", "7")),
+    rollup_retention_days=float(os.getenv("SIGMA_HISTORY_ROLLUP_RETENTION_DAYS", "365")),
+    maint_interval_s=float(os.getenv("SIGMA_HISTORY_MAINT_S", "3600")),
+    # bucket harian mulai tengah malam lokal (default: zona waktu mesin, mis. WIB = +7)
+    tz_offset_s=int(float(os.getenv("SIGMA_HISTORY_TZ_OFFSET_H", str(time.localtime().tm_gmtoff / 3600))) * 3600),
+) if HISTORY_ENABLED else _NoHistory()
+
+
+# ===================== PIPELINE (PCU -> FUZZY -> PICO) =====================
+def pcu_table(batch: dict) -> dict:
+    """
+    {arah: result | None} -> tabel PCU {arah: {PCU_total, car, motorcycle, bicycle, kendaraan_besar}}
+    (arah dengan gambar invalid dilewati). Bentuknya sama dengan pcu_table di response.
+    """
+    table = {}
+    for name, out in batch.items():
+        if out is None:
+            continue
+        c = out["counts"]
+        table[name] = {
+            "PCU_total": out["pcu_total"],
+            "car": c["car"],
+            "motorcycle": c["motorcycle"],
+            "bicycle": c["bicycle"],
+            "kendaraan_besar": c["kendaraan_besar"],
+        }
+    return table
 
-@app.get("/api/realtime_pico")
-def api_realtime_pico():
+def apply_fuzzy_schedule(pcu_tab: dict, inter: Intersection = None, source: str = "upload",
+                         model_type: str = None, latency_ms: float = None, request_id: str = None):
+    """
+    tabel PCU -> fuzzy -> last_fuzzy -> kirim ke Pico -> pending schedule state engine (+ riwayat).
+    Dipakai /api/process, /api/{id}/process dan sampler stream kamera.
+    inter: persimpangan tujuan (default: persimpangan default).
+    source/model_type/latency_ms/request_id: cuma untuk riwayat.
+    Return: (pcu_table, fuzzy_table, serial_ok) -> dict siap JSON
+    """
+    inter = inter or intersections.default
 
-    def parse_sched(line: str):
-        # SCHED,gU,rU,gT,rT,gS,rS,gB,rB
-        parts = (line or "").split(",")
-        if len(parts) != 9:
-            return None
-        try:
-            _, gU, rU, gT, rT, gS, rS, gB, rB = parts
-            return {
-                "UTARA":   {"Green_time": float(gU), "Red_time": float(rU)},
-                "TIMUR":   {"Green_time": float(gT), "Red_time": float(rT)},
-                "SELATAN": {"Green_time": float(gS), "Red_time": float(rS)},
-                "BARAT":   {"Green_time": float(gB), "Red_time": float(rB)},
+    fuzzy_tab = fuzzy_schedule({arah: row["PCU_total"] for arah, row in pcu_tab.items()})
+
+    new_last = {}
+    for arah in URUTAN_ARAH:
+        if arah in fuzzy_tab:
+            new_last[arah] = {
+                "Green_time": float(fuzzy_tab[arah]["Green_time"]),
+                "Red_time": float(fuzzy_tab[arah]["Red_time"]),
             }
-        except Exception:
-            return None
+        else:
+            new_last[arah] = inter.last_fuzzy.get(arah, {"Green_time": 10.0, "Red_time": 50.0})
+
+    inter.last_fuzzy = new_last
+    inter.last_pcu = {**inter.last_pcu, **pcu_tab}
+
+    # kirim ke Pico (tetap)
+    serial_ok = send_durations_to_pico_from_table(fuzzy_tab, inter)
+
+    # update realtime engine: jangan langsung otak-atik cycle berjalan,
+    # kita simpan pending dan apply pas siklus selesai (mirip Pico).
+    inter.set_pending({
+        a: {"Green_time": float(new_last[a]["Green_time"]), "Red_time": float(new_last[a]["Red_time"])}
+        for a in URUTAN_ARAH
+    })
+
+    now = time.time()
+    history.record_detections(inter.id, pcu_tab, source, model_type, latency_ms, request_id, ts=now)
+    history.record_schedule(inter.id, fuzzy_tab, source, serial_ok, _cycle_len(new_last), ts=now)
+
+    return pcu_tab, fuzzy_tab, serial_ok
+
+
+# ===================== STREAM INGESTION (KAMERA / VIDEO PER ARAH) =====================
+# Sumber per arah: SIGMA_STREAM_UTARA=rtsp://... / http://... / file video / folder gambar
+# (atau SIGMA_STREAMS_FILE = JSON {"UTARA": "...", ...}). Tiap sumber punya 1 capture thread
+# yang cuma menyimpan frame terbaru (frame lama dibuang, tidak ada backlog); sampler
+# mengambil frame terbaru tiap STREAM_SAMPLE_S detik -> deteksi -> fuzzy -> Pico / pending.
+STREAM_MODEL_TYPE = os.getenv("SIGMA_STREAM_MODEL", "yolo")
+STREAM_SAMPLE_S = float(os.getenv("SIGMA_STREAM_SAMPLE_S", "5"))
+STREAM_MAX_FRAME_AGE_S = float(os.getenv("SIGMA_STREAM_MAX_FRAME_AGE_S", "10"))
+STREAM_FOLDER_FPS = float(os.getenv("SIGMA_STREAM_FOLDER_FPS", "1"))
+STREAM_RECONNECT_MAX_S = float(os.getenv("SIGMA_STREAM_RECONNECT_MAX_S", "30"))
+_IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+def stream_sources_from_env() -> dict:
+    sources = {}
+    path = os.getenv("SIGMA_STREAMS_FILE", "")
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                sources.update({k.upper(): v for k, v in json.load(f).items() if v})
+        except Exception as e:
+            print("[STREAM] gagal baca SIGMA_STREAMS_FILE:", e)
+    for arah in URUTAN_ARAH:
+        v = os.getenv(f"SIGMA_STREAM_{arah}", "")
+        if v:
+            sources[arah] = v
+    return {a: sources[a] for a in URUTAN_ARAH if a in sources}
+
+class CaptureThread(threading.Thread):
+    """1 sumber -> slot frame terbaru (drop-old)."""
+
+    def __init__(self, arah: str, source: str, stop_event: threading.Event):
+        super().__init__(name=f"capture-{arah}", daemon=True)
+        self.arah = arah
+        self.source = source
+        self.stop_event = stop_event
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frame_ts = 0.0
+        self.seq = 0          # naik tiap frame baru
+        self.frames = 0
+        self.reconnects = 0
+        self.connected = False
+        self.error = None
+
+    def latest(self):
+        """Return (frame, seq, age_s) atau (None, seq, None)."""
+        with self._lock:
+            if self._frame is None:
+                return None, self.seq, None
+            return self._frame, self.seq, time.monotonic() - self._frame_ts
+
+    def _publish(self, frame):
+        with self._lock:
+            self._frame = frame
+            self._frame_ts = time.monotonic()
+            self.seq += 1
+        self.frames += 1
+
+    def run(self):
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            try:
+                if os.path.isdir(self.source):
+                    self._run_folder()
+                else:
+                    self._run_capture()
+                backoff = 1.0
+            except Exception as e:
+                self.error = repr(e)
+                print(f"[STREAM:{self.arah}] error:", repr(e))
+            self.connected = False
+            if self.stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, STREAM_RECONNECT_MAX_S)
+            self.reconnects += 1
 
-    pico_sched = parse_sched(LAST_SCHED)
+    def _run_folder(self):
+        files = sorted(
+            os.path.join(self.source, fn) for fn in os.listdir(self.source) if fn.lower().endswith(_IMG_EXTS)
+        )
+        if not files:
+            raise RuntimeError(f"folder kosong: {self.source}")
+        self.connected = True
+        period = 1.0 / max(STREAM_FOLDER_FPS, 1e-3)
+        while not self.stop_event.is_set():
+            for path in files:  # loop terus (mode testing)
+                frame = cv2.imread(path, cv2.IMREAD_COLOR)
+                if frame is not None:
+                    self._publish(frame)
+                if self.stop_event.wait(period):
+                    return
+
+    def _run_capture(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise RuntimeError(f"tidak bisa buka sumber: {self.source}")
+        is_file = os.path.isfile(self.source)
+        # file video diputar sesuai fps aslinya (kalau tidak, terbaca secepat CPU)
+        period = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25.0) if is_file else 0.0
+        try:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # live: jangan numpuk buffer di driver
+        except Exception:
+            pass
+        self.connected = True
+        self.error = None
+        try:
+            next_t = time.monotonic()
+            while not self.stop_event.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    if is_file:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # loop file video
+                        continue
+                    raise RuntimeError("stream terputus")
+                self._publish(frame)
+                if period:
+                    next_t += period
+                    delay = next_t - time.monotonic()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+                    else:
+                        next_t = time.monotonic()
+        finally:
+            cap.release()
+
+    def status(self) -> dict:
+        _, seq, age = self.latest()
+        return {
+            "source": self.source,
+            "connected": self.connected,
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+            "frame_age_s": round(age, 2) if age is not None else None,
+            "error": self.error,
+        }
 
-    # ===== CASE 1: RT BELUM ADA (CYCLE PERTAMA) =====
-    if not LAST_RT_LINE:
+# ===================== MOTION GATING =====================
+# Sebelum deteksi: bandingkan thumbnail grayscale kecil dengan thumbnail saat inference terakhir.
+# Kalau beda rata2 < MOTION_THRESH dan hasil lama belum lewat MOTION_MAX_STALE_S -> pakai hasil lama.
+MOTION_THRESH = float(os.getenv("SIGMA_MOTION_THRESH", "2.5"))          # mean abs diff (0..255)
+MOTION_MAX_STALE_S = float(os.getenv("SIGMA_MOTION_MAX_STALE_S", "30"))
+MOTION_THUMB = (64, 36)
+
+class MotionGate:
+    def __init__(self, thresh: float, max_stale_s: float):
+        self.thresh = thresh
+        self.max_stale_s = max_stale_s
+        self._ref = None
+        self._ref_ts = 0.0
+        self.last_result = None
+        self.checks = 0
+        self.skipped = 0
+        self.last_diff = None
+
+    @staticmethod
+    def signature(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, MOTION_THUMB, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def check(self, frame):
+        """
+        Return: (perlu_inference, signature). Kalau False, pakai self.last_result.
+        """
+        self.checks += 1
+        sig = self.signature(frame)
+        if self._ref is None or self.last_result is None:
+            return True, sig
+        if time.monotonic() - self._ref_ts >= self.max_stale_s:
+            return True, sig
+        self.last_diff = float(cv2.absdiff(sig, self._ref).mean())
+        if self.last_diff >= self.thresh:
+            return True, sig
+        self.skipped += 1
+        return False, sig
+
+    def update(self, sig, result):
+        self._ref = sig
+        self._ref_ts = time.monotonic()
+        self.last_result = result
+
+    def stats(self) -> dict:
         return {
-            "active_arah": "",
-            "phase": "",
-            "remaining": 0,
-            "rt_green": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
-            "rt_red": {"UTARA": 0, "TIMUR": 0, "SELATAN": 0, "BARAT": 0},
+            "checks": self.checks,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / self.checks, 3) if self.checks else None,
+            "last_diff": round(self.last_diff, 2) if self.last_diff is not None else None,
+        }
 
-            # ✅ DEFAULT CYCLE 1
-            "schedule": pico_sched if pico_sched else DEFAULT_CYCLE_1,
+# ===================== TRACKING (OPSIONAL) =====================
+# SIGMA_TRACKING=1 -> sampler jalan di TRACK_FPS, detector hanya tiap TRACK_DETECT_EVERY frame
+# (di antaranya track di-propagate Kalman, lihat tracker.py). PCU ke fuzzy = okupansi track aktif;
+# flow = track yang melewati stop line (SIGMA_STOPLINE_<ARAH>="x1,y1,x2,y2", piksel frame stream).
+TRACKING_ENABLED = os.getenv("SIGMA_TRACKING", "0") == "1"
+TRACK_FPS = float(os.getenv("SIGMA_TRACK_FPS", "5"))
+TRACK_DETECT_EVERY = max(1, int(os.getenv("SIGMA_TRACK_DETECT_EVERY", "3")))
+TRACK_IOU = float(os.getenv("SIGMA_TRACK_IOU", "0.3"))
+TRACK_MAX_AGE = int(os.getenv("SIGMA_TRACK_MAX_AGE", str(max(10, 3 * TRACK_DETECT_EVERY))))
+TRACK_MIN_HITS = int(os.getenv("SIGMA_TRACK_MIN_HITS", "2"))
+
+def stop_line_from_env(arah: str):
+    raw = os.getenv(f"SIGMA_STOPLINE_{arah}", "")
+    if not raw:
+        return None
+    try:
+        vals = [float(v) for v in raw.split(",")]
+        return vals if len(vals) == 4 else None
+    except ValueError:
+        print(f"[TRACK] stop line {arah} tidak valid:", raw)
+        return None
+
+def make_tracker(arah: str):
+    from tracker import MultiObjectTracker
+
+    return MultiObjectTracker(
+        len(CATEGORIES),
+        iou_thresh=TRACK_IOU,
+        max_age=TRACK_MAX_AGE,
+        min_hits=TRACK_MIN_HITS,
+        stop_line=stop_line_from_env(arah),
+    )
+
+class StreamSampler(threading.Thread):
+    def __init__(self, captures: dict, model_type: str, interval_s: float, stop_event: threading.Event,
+                 tracking: bool = False):
+        super().__init__(name="stream-sampler", daemon=True)
+        self.captures = captures
+        self.model_type = model_type
+        self.interval_s = max(0.05, interval_s)
+        self.stop_event = stop_event
+        self.runs = 0
+        self.last_run_ms = None
+        self.last_pcu = {}
+        self.last_ts = None
+        self.error = None
+        self.gates = {arah: MotionGate(MOTION_THRESH, MOTION_MAX_STALE_S) for arah in captures}
+        self.trackers = {arah: make_tracker(arah) for arah in captures} if tracking else {}
+        self._ticks = {arah: 0 for arah in captures}
+        self._last_dets = {}   # deteksi terakhir per arah (dipakai ulang kalau motion gate skip)
+        self._last_seq = {}
+        self.applied = 0
+        self.skipped_unchanged = 0
+        self.skipped_incomplete = 0
+
+    def latest_frames(self, new_only: bool = False) -> dict:
+        frames = {}
+        for arah, cap in self.captures.items():
+            frame, seq, age = cap.latest()
+            if frame is None or age > STREAM_MAX_FRAME_AGE_S:
+                continue
+            if new_only and self._last_seq.get(arah) == seq:
+                continue
+            self._last_seq[arah] = seq
+            frames[arah] = frame
+        return frames
+
+    def sample_once(self):
+        frames = self.latest_frames()
+        if not frames:
+            return None
+        t0 = time.perf_counter()
+        batch = {}
+        todo, sigs = [], {}
+        for arah, frame in frames.items():
+            need, sigs[arah] = self.gates[arah].check(frame)
+            if need:
+                todo.append(arah)
+            else:
+                batch[arah] = self.gates[arah].last_result
+
+        outs = detect_batch([frames[a] for a in todo], self.model_type)
+        for arah, (_, counts, pcu) in zip(todo, outs):
+            batch[arah] = _format_result(counts, pcu)
+            self.gates[arah].update(sigs[arah], batch[arah])
+
+        batch = {a: batch[a] for a in frames}  # urutan arah tetap
+        self._apply(batch, "stream", round((time.perf_counter() - t0) * 1000.0, 2))
+        return batch
+
+    def _apply(self, batch: dict, source: str, latency_ms: float = None) -> bool:
+        """
+        Hasil stream -> apply_fuzzy_schedule persimpangan default, dengan 2 syarat:
+        - fuzzy selalu dihitung atas 4 arah: arah tanpa sumber stream diisi PCU terakhir yang
+          diketahui (upload / stream sebelumnya); masih ada yang kosong -> tidak di-apply
+        - tabel sama dengan yang terakhir di-apply -> skip (jadwal identik tidak dikirim ulang)
+        """
+        inter = intersections.default
+        tab = {**inter.last_pcu, **pcu_table(batch)}
+        if any(a not in tab for a in URUTAN_ARAH):
+            self.skipped_incomplete += 1
+            return False
+        tab = {a: tab[a] for a in URUTAN_ARAH}
+        if all(inter.last_pcu.get(a) == tab[a] for a in URUTAN_ARAH):
+            self.skipped_unchanged += 1
+            return False
+        apply_fuzzy_schedule(tab, source=source, model_type=self.model_type, latency_ms=latency_ms)
+        self.applied += 1
+        return True
 
-            "age_ms": None,
-            "delay_ms": None,
+    def track_once(self):
+        """
+        1 tick tracking: deteksi hanya untuk arah yang gilirannya (tiap N frame) & ada gerakan.
+        Giliran deteksi yang di-skip motion gate (scene diam) -> tracker di-update lagi dengan
+        deteksi terakhir, supaya antrian kendaraan berhenti tidak kedaluwarsa (max_age).
+        step(None) cuma untuk tick di antara giliran deteksi.
+        """
+        frames = self.latest_frames(new_only=True)
+        todo, sigs = [], {}
+        for arah, frame in frames.items():
+            turn = self._ticks[arah] % TRACK_DETECT_EVERY == 0
+            self._ticks[arah] += 1
+            if not turn:
+                self.trackers[arah].step(None)
+                continue
+            need, sigs[arah] = self.gates[arah].check(frame)
+            if need:
+                todo.append(arah)
+            else:
+                self.trackers[arah].step(self._last_dets.get(arah))
+
+        outs = detect_batch([frames[a] for a in todo], self.model_type)
+        for arah, (dets, counts, pcu) in zip(todo, outs):
+            self.trackers[arah].step(dets)
+            self._last_dets[arah] = dets
+            self.gates[arah].update(sigs[arah], _format_result(counts, pcu))
+
+    def tracked_results(self) -> dict:
+        batch = {}
+        for arah, trk in self.trackers.items():
+            if self.captures[arah].latest()[0] is None:
+                continue
+            occ = trk.occupancy()
+            counts = dict(zip(CATEGORIES, occ.tolist()))
+            batch[arah] = _format_result(counts, float(occ @ CAT_PCU))
+        return batch
+
+    def _record(self, batch, t0):
+        if batch:
+            self.runs += 1
+            self.last_pcu = {a: out["pcu_total"] for a, out in batch.items()}
+            self.last_ts = time.time()
+            self.error = None
+        self.last_run_ms = round((time.monotonic() - t0) * 1000.0, 1)
+
+    def run(self):
+        if self.trackers:
+            return self._run_tracking()
+        while not self.stop_event.wait(self.interval_s):
+            t0 = time.monotonic()
+            try:
+                self._record(self.sample_once(), t0)
+            except Exception as e:
+                self.error = repr(e)
+                print("[STREAM] sampler error:", repr(e))
+
+    def _run_tracking(self):
+        period = 1.0 / max(TRACK_FPS, 0.1)
+        next_apply = time.monotonic() + self.interval_s
+        while not self.stop_event.wait(period):
+            t0 = time.monotonic()
+            try:
+                self.track_once()
+                if t0 >= next_apply:
+                    next_apply = t0 + self.interval_s
+                    batch = self.tracked_results()
+                    if batch:
+                        self._apply(batch, "track")
+                    self._record(batch, t0)
+            except Exception as e:
+                self.error = repr(e)
+                print("[STREAM] tracking error:", repr(e))
+
+    def status(self) -> dict:
+        return {
+            "model_type": self.model_type,
+            "interval_s": self.interval_s,
+            "runs": self.runs,
+            "last_run_ms": self.last_run_ms,
+            "last_pcu": self.last_pcu,
+            "last_ts": self.last_ts,
+            "error": self.error,
+            "applied": self.applied,
+            "skipped_unchanged": self.skipped_unchanged,
+            "skipped_incomplete": self.skipped_incomplete,
+            "gating": self.gating_stats(),
+            "tracking": self.tracking_stats(),
         }
 
-    # ===== CASE 2: RT SUDAH ADA =====
-    parts = LAST_RT_LINE.split(",")
-    try:
-        _, active, remaining, gU, gT, gS, gB, rU, rT, rS, rB = parts
+    def gating_stats(self) -> dict:
+        per = {a: g.stats() for a, g in self.gates.items()}
+        checks = sum(g.checks for g in self.gates.values())
+        skipped = sum(g.skipped for g in self.gates.values())
+        return {
+            "thresh": MOTION_THRESH,
+            "max_stale_s": MOTION_MAX_STALE_S,
+            "skip_ratio": round(skipped / checks, 3) if checks else None,
+            "per_arah": per,
+        }
 
+    def tracking_stats(self):
+        if not self.trackers:
+            return None
+        per = {}
+        for arah, trk in self.trackers.items():
+            st = trk.stats()
+            st["occupancy"] = dict(zip(CATEGORIES, trk.occupancy().tolist()))
+            st["flow"] = dict(zip(CATEGORIES, st.pop("crossings")))
+            per[arah] = st
+        return {"fps": TRACK_FPS, "detect_every": TRACK_DETECT_EVERY, "per_arah": per}
+
+_streams = {"stop": threading.Event(), "captures": {}, "sampler": None}
+
+def start_streams(sources: dict = None):
+    sources = stream_sources_from_env() if sources is None else sources
+    if not sources or _streams["sampler"] is not None:
+        return
+    stop = _streams["stop"]
+    captures = {arah: CaptureThread(arah, src, stop) for arah, src in sources.items()}
+    for cap in captures.values():
+        cap.start()
+    sampler = StreamSampler(captures, STREAM_MODEL_TYPE, STREAM_SAMPLE_S, stop, tracking=TRACKING_ENABLED)
+    sampler.start()
+    _streams["captures"] = captures
+    _streams["sampler"] = sampler
+    print("[STREAM] aktif:", ", ".join(f"{a}={s}" for a, s in sources.items()))
+
+def stop_streams():
+    _streams["stop"].set()
+
+
+# ===================== REALTIME STATE (PICO) =====================
+def parse_sched_line(line: str):
+    # SCHED,gU,rU,gT,rT,gS,rS,gB,rB
+    parts = (line or "").split(",")
+    if len(parts) != 9:
+        return None
+    try:
+        _, gU, rU, gT, rT, gS, rS, gB, rB = parts
         return {
-            "active_arah": active,
-            "phase": "GREEN",
-            "remaining": int(float(remaining)),
-
-            "rt_green": {
-                "UTARA": int(float(gU)),
-                "TIMUR": int(float(gT)),
-                "SELATAN": int(float(gS)),
-                "BARAT": int(float(gB)),
-            },
-            "rt_red": {
-                "UTARA": int(float(rU)),
-                "TIMUR": int(float(rT)),
-                "SELATAN": int(float(rS)),
-                "BARAT": int(float(rB)),
-            },
+            "UTARA":   {"Green_time": float(gU), "Red_time": float(rU)},
+            "TIMUR":   {"Green_time": float(gT), "Red_time": float(rT)},
+            "SELATAN": {"Green_time": float(gS), "Red_time": float(rS)},
+            "BARAT":   {"Green_time": float(gB), "Red_time": float(rB)},
+        }
+    except Exception:
+        return None
 
-            # 🔴 DAN DI SINI JUGA
-            # ✅ DEFAULT CYCLE 1
-            "schedule": pico_sched if pico_sched else DEFAULT_CYCLE_1,
+def realtime_pico_state() -> dict:
+    """Isi /api/realtime_pico persimpangan default (lihat Intersection.realtime_pico_state)."""
+    return intersections.default.realtime_pico_state()
+
+def serial_status_snapshot() -> dict:
+    """Status serial dari snapshot SerialLink (tidak menyentuh port)."""
+    return intersections.default.serial_status()
+
+
+# ===================== REALTIME PUSH (SSE) =====================
+# Satu producer (task asyncio) cek signature state tiap RT_PUSH_TICK_MS; pesan gabungan
+# (rt + serial + fase engine) hanya dibangun & di-broadcast kalau ada yang berubah.
+# Tiap client punya queue terbatas: kalau penuh (client lambat) client di-drop, EventSource
+# di browser reconnect sendiri dan langsung dapat snapshot terbaru.
+# age_ms/delay_ms di pesan push = umur saat pesan dibangun; client menghitung umur berjalan dari
+# rt_ts/sched_ts (absolut) + server_ts (koreksi beda jam client-server).
+RT_PUSH_TICK_MS = float(os.getenv("SIGMA_RT_PUSH_TICK_MS", "100"))
+RT_CLIENT_QUEUE = int(os.getenv("SIGMA_RT_CLIENT_QUEUE", "8"))
+RT_HEARTBEAT_S = float(os.getenv("SIGMA_RT_HEARTBEAT_S", "15"))
+
+def realtime_signature(inter: Intersection = None):
+    inter = inter or intersections.default
+    st = inter.state()
+    return (
+        inter.rt_line,
+        inter.sched_line,
+        inter.serial_status()["ready"],
+        st["active_arah"],
+        st["phase"],
+        st["using_pending"],
+    )
+
+def realtime_message(inter: Intersection = None) -> dict:
+    inter = inter or intersections.default
+    st = inter.state()
+    return {
+        "rt": inter.realtime_pico_state(),
+        "serial": inter.serial_status(),
+        "engine": {
+            "active_arah": st["active_arah"],
+            "phase": st["phase"],
+            "remaining": st["remaining"],
+            "using_pending": st["using_pending"],
+        },
+    }
+
+class RealtimeHub:
+    def __init__(self, tick_ms: float, client_queue: int):
+        self.tick_s = max(0.02, tick_ms / 1000.0)
+        self.client_queue = max(1, client_queue)
+        self._subs = set()
+        self._task = None
+        self._sig = None
+        self._last = None  # (seq, data json)
+        self.seq = 0
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._produce())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for q in list(self._subs):
+            self._close(q)
+
+    def _snapshot(self):
+        sig = realtime_signature()
+        if sig != self._sig or self._last is None:
+            self._sig = sig
+            self.seq += 1
+            self._last = (self.seq, json.dumps(realtime_message()))
+            return True
+        return False
 
-            "age_ms": int((time.time() - LAST_RT_TS) * 1000),
-            "delay_ms": int((time.time() - LAST_RT_TS) * 1000),
+    async def _produce(self):
+        while True:
+            try:
+                if self._subs and self._snapshot():
+                    self._publish(self._last)
+            except Exception as e:
+                print("[RT] producer error:", repr(e))
+            await asyncio.sleep(self.tick_s)
+
+    def _publish(self, item):
+        self.published += 1
+        for q in list(self._subs):
+            try:
+                q.put_nowait(item)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                print("[RT] client lambat, di-drop")
+                self._close(q)
+
+    def _close(self, q):
+        self._subs.discard(q)
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)  # sentinel -> stream selesai
+
+    def subscribe(self):
+        q = asyncio.Queue(maxsize=self.client_queue)
+        # perubahan yang belum sempat di-broadcast producer -> kirim dulu ke client lama,
+        # supaya mereka tidak melompati seq ini
+        if self._snapshot():
+            self._publish(self._last)
+        q.put_nowait(self._last)
+        self._subs.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self._subs.discard(q)
+
+    async def sse(self):
+        # subscribe di dalam generator: kalau client putus sebelum iterasi pertama,
+        # queue tidak pernah terdaftar (finally di bawah tidak akan jalan)
+        q = self.subscribe()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(q.get(), timeout=RT_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    return
+                seq, data = item
+                yield f"id: {seq}\nevent: state\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subs),
+            "seq": self.seq,
+            "published": self.published,
+            "dropped_clients": self.dropped,
+            "tick_ms": round(self.tick_s * 1000.0, 1),
         }
 
-    except Exception:
-        return {"error": "bad_rt_format", "raw": LAST_RT_LINE}
+rt_hub = RealtimeHub(RT_PUSH_TICK_MS, RT_CLIENT_QUEUE)
 
 
+# ===================== ROUTES =====================
+@app.get("/health")
+def health():
+    # "status" = liveness (proses hidup); "ready" = model preload sudah loaded + warm
+    r = readiness()
+    return {"status": "ok", "ready": r["ready"], "models": r["models"]}
+
+@app.get("/health/ready")
+def health_ready():
+    r = readiness()
+    if not r["ready"]:
+        return JSONResponse(status_code=503, content=r, headers={"Retry-After": "1"})
+    return r
+
+@app.get("/api/metrics")
+def api_metrics():
+    return {
+        "batching": {name: b.stats() for name, b in _batchers.items()},
+        "overlay_cache": overlays.stats(),
+        "detection_cache": det_cache.stats(),
+        "realtime_push": rt_hub.stats(),
+        "history": history.stats(),
+        "serial": intersections.default.link.stats() if intersections.default.link else None,
+        "engine": {
+            "intersections": len(intersections.ids()),
+            "scheduler": intersections.scheduler.stats(),
+            "serial_mux": serial_mux.stats(),
+        },
+    }
+
+@app.get("/api/models")
+def api_models():
+    return models.stats()
+
+@app.get("/api/overlay/{request_id}/{arah}.jpg")
+def api_overlay(request_id: str, arah: str, request: Request):
+    got = overlays.get(request_id, arah.upper())
+    if got is None:
+        raise HTTPException(status_code=404, detail="overlay tidak ada / sudah kedaluwarsa")
+    jpeg, etag = got
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=jpeg, media_type="image/jpeg", headers=headers)
+
+@app.get("/api/streams")
+def api_streams():
+    sampler = _streams["sampler"]
+    return {
+        "enabled": sampler is not None,
+        "sources": {a: c.status() for a, c in _streams["captures"].items()},
+        "sampler": sampler.status() if sampler else None,
+    }
+
+@app.get("/api/realtime_pico")
+def api_realtime_pico():
+    return realtime_pico_state()
+
+@app.get("/api/realtime/stream")
+async def api_realtime_stream():
+    """
+    Server-Sent Events: event "state" = {"rt": /api/realtime_pico, "serial": /api/serial_status,
+    "engine": fase engine}, dikirim hanya saat ada perubahan.
+    """
+    return StreamingResponse(
+        rt_hub.sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # (Endpoint lama blynk tetap ada, tapi dimatikan biar tidak mengganggu)
@@ -798,79 +3165,34 @@ async def api_realtime_blynk():
     raise HTTPException(status_code=410, detail="Blynk realtime dimatikan. Pakai /api/realtime_pico")
 
 
-@app.post("/api/process")
-async def api_process(
-    model_type: str = Form("yolo"),
-    utara: UploadFile = File(...),
-    timur: UploadFile = File(...),
-    selatan: UploadFile = File(...),
-    barat: UploadFile = File(...),
-):
-    global LAST_FUZZY, _pending_sched
-
+async def _process_for(inter: Intersection, model_type: str, files: dict) -> dict:
     try:
-        intersections = {
-            "UTARA": utara,
-            "TIMUR": timur,
-            "SELATAN": selatan,
-            "BARAT": barat,
-        }
-
         results = {}
-        rows = []
-
-        for name, file in intersections.items():
-            img_bytes = await file.read()
-            out = process_image_bytes(img_bytes, model_type=model_type, save_overlay=True, out_name=name)
-            if out is None:
-                results[name] = {"error": "invalid_image"}
-                continue
-
-            results[name] = out
-            rows.append({
-                "Persimpangan": name,
-                "PCU_total": out["pcu_total"],
-                "car": out["counts"]["car"],
-                "motorcycle": out["counts"]["motorcycle"],
-                "bicycle": out["counts"]["bicycle"],
-                "kendaraan_besar": out["counts"]["kendaraan_besar"],
-            })
-
-        if len(rows) > 0:
-            df_pcu = pd.DataFrame(rows).set_index("Persimpangan")
-            df_fuzzy = compute_fuzzy(df_pcu)
-
-            new_last = {}
-            for arah in ["UTARA", "TIMUR", "SELATAN", "BARAT"]:
-                if arah in df_fuzzy.index:
-                    new_last[arah] = {
-                        "Green_time": float(df_fuzzy.loc[arah, "Green_time"]),
-                        "Red_time": float(df_fuzzy.loc[arah, "Red_time"]),
-                    }
-                else:
-                    new_last[arah] = LAST_FUZZY.get(arah, {"Green_time": 10.0, "Red_time": 50.0})
 
-            LAST_FUZZY = new_last
+        images = {name: await file.read() for name, file in files.items()}
+        rid = new_request_id()
+        t0 = time.perf_counter()
+        batch = await run_inference(process_images_batch, images, model_type=model_type, save_overlay=True,
+                                    request_id=rid)
+        latency_ms = round((time.perf_counter() - t0) * 1000.0, 2)
 
-            # kirim ke Pico (tetap)
-            serial_ok = send_durations_to_pico_from_df(df_fuzzy)
+        for name, out in batch.items():
+            results[name] = out if out is not None else {"error": "invalid_image"}
 
-            # update realtime engine: jangan langsung otak-atik cycle berjalan,
-            # kita simpan pending dan apply pas siklus selesai (mirip Pico).
-            with _state_lock:
-                _pending_sched = {
-                    a: {"Green_time": float(LAST_FUZZY[a]["Green_time"]), "Red_time": float(LAST_FUZZY[a]["Red_time"])}
-                    for a in URUTAN_ARAH
-                }
+        serial = inter.serial_status()
+        pcu_tab = pcu_table(batch)
+        if len(pcu_tab) > 0:
+            pcu_tab, fuzzy_tab, serial_ok = apply_fuzzy_schedule(pcu_tab, inter, "upload", model_type,
+                                                                 latency_ms, rid)
 
             return {
                 "model_type": model_type,
                 "results": results,
-                "pcu_table": df_pcu.to_dict(orient="index"),
-                "fuzzy_table": df_fuzzy.to_dict(orient="index"),
+                "pcu_table": pcu_tab,
+                "fuzzy_table": fuzzy_tab,
                 "serial_sent": serial_ok,
-                "serial_port": SERIAL_PORT,
-                "serial_baud": SERIAL_BAUD,
+                "serial_port": serial["port"],
+                "serial_baud": serial["baud"],
             }
 
         return {
@@ -879,14 +3201,140 @@ async def api_process(
             "pcu_table": {},
             "fuzzy_table": {},
             "serial_sent": False,
-            "serial_port": SERIAL_PORT,
-            "serial_baud": SERIAL_BAUD,
+            "serial_port": serial["port"],
+            "serial_baud": serial["baud"],
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print("[/api/process ERROR]", repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+def _get_intersection(intersection_id: str) -> Intersection:
+    inter = intersections.get(intersection_id)
+    if inter is None:
+        raise HTTPException(status_code=404, detail=f"persimpangan '{intersection_id}' tidak ada")
+    return inter
+
+@app.post("/api/process")
+async def api_process(
+    model_type: str = Form("yolo"),
+    utara: UploadFile = File(...),
+    timur: UploadFile = File(...),
+    selatan: UploadFile = File(...),
+    barat: UploadFile = File(...),
+):
+    files = {"UTARA": utara, "TIMUR": timur, "SELATAN": selatan, "BARAT": barat}
+    return await _process_for(intersections.default, model_type, files)
+
+FUZZY_EVAL_MAX_ROWS = int(os.getenv("SIGMA_FUZZY_EVAL_MAX_ROWS", "100000"))
+
+@app.post("/api/fuzzy/evaluate")
+async def api_fuzzy_evaluate(request: Request):
+    """
+    What-if fuzzy tanpa deteksi / tanpa kirim ke Pico.
+    Body JSON: {"pcu": {"UTARA": 12.5, ...}} -> tabel per arah, atau
+               {"pcu": [[pU, pT, pS, pB], ...]} -> {"green": [[...]], "red": [[...]]} (baris = skenario).
+    """
+    body = await request.json()
+    pcu = body.get("pcu") if isinstance(body, dict) else None
+    if isinstance(pcu, dict):
+        try:
+            return {"fuzzy_table": fuzzy_schedule({str(k): float(v) for k, v in pcu.items()})}
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=422, detail="pcu harus angka")
+    try:
+        P = np.asarray(pcu, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="pcu harus dict arah->angka atau matriks angka")
+    if P.ndim != 2 or P.shape[0] == 0 or P.shape[1] == 0:
+        raise HTTPException(status_code=422, detail="pcu matriks harus 2D (skenario x arah)")
+    if P.shape[0] > FUZZY_EVAL_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"maksimal {FUZZY_EVAL_MAX_ROWS} skenario per request")
+    green, red = fuzzy_engine.evaluate(P)
+    return {"green": green.tolist(), "red": red.tolist()}
+
+@app.get("/api/intersections")
+def api_intersections():
+    return {
+        "default": intersections.default_id,
+        "intersections": [intersections.get(i).summary() for i in intersections.ids()],
+    }
+
+@app.get("/api/history/{kind}")
+def api_history(
+    kind: str,
+    request: Request,
+    intersection: str = None,
+    res: str = "hour",
+    start: float = None,
+    end: float = None,
+    arah: str = None,
+    fmt: str = Query(None, alias="format"),
+):
+    """
+    Query rollup riwayat: kind = pcu | green_split | cycle_length, res = minute | hour | day,
+    start/end = unix detik (default 24 jam terakhir).
+    format = json | ndjson | arrow (default dari header Accept); ndjson/arrow di-stream per chunk.
+    """
+    if not HISTORY_ENABLED:
+        raise HTTPException(status_code=503, detail="history dimatikan (SIGMA_HISTORY_DB)")
+    if kind not in HISTORY_QUERIES:
+        raise HTTPException(status_code=404, detail=f"kind harus salah satu dari {list(HISTORY_QUERIES)}")
+    if res not in ROLLUP_RES:
+        raise HTTPException(status_code=400, detail=f"res harus salah satu dari {list(ROLLUP_RES)}")
+    if fmt is None:
+        accept = request.headers.get("accept", "")
+        fmt = next((f for f in ("arrow", "ndjson") if HISTORY_MEDIA_TYPES[f] in accept), "json")
+    if fmt not in HISTORY_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format harus salah satu dari {list(HISTORY_MEDIA_TYPES)}")
+    if fmt == "arrow" and not HAS_ARROW:
+        raise HTTPException(status_code=406, detail="pyarrow tidak terpasang, pakai format=ndjson")
+
+    inter_id = intersection or intersections.default_id
+    end = time.time() if end is None else end
+    start = end - 86400.0 if start is None else start
+    chunks = query_rows(HISTORY_DB, kind, inter_id, ROLLUP_RES[res], start, end, arah)
+
+    if fmt == "json":
+        names = [c for c, _ in HISTORY_QUERIES[kind][0]]
+        return {
+            "intersection": inter_id,
+            "kind": kind,
+            "res": res,
+            "start": start,
+            "end": end,
+            "rows": [dict(zip(names, r)) for rows in chunks for r in rows],
+        }
+    encode = encode_arrow if fmt == "arrow" else encode_ndjson
+    return StreamingResponse(encode(kind, chunks), media_type=HISTORY_MEDIA_TYPES[fmt])
+
+@app.post("/api/{intersection_id}/process")
+async def api_process_intersection(
+    intersection_id: str,
+    model_type: str = Form("yolo"),
+    utara: UploadFile = File(...),
+    timur: UploadFile = File(...),
+    selatan: UploadFile = File(...),
+    barat: UploadFile = File(...),
+):
+    inter = _get_intersection(intersection_id)
+    files = {"UTARA": utara, "TIMUR": timur, "SELATAN": selatan, "BARAT": barat}
+    out = await _process_for(inter, model_type, files)
+    out["intersection_id"] = inter.id
+    return out
+
+@app.get("/api/{intersection_id}/realtime")
+def api_realtime_intersection(intersection_id: str):
+    """Sama seperti /api/realtime_pico + state engine server untuk 1 persimpangan."""
+    inter = _get_intersection(intersection_id)
+    out = inter.realtime_pico_state()
+    out["intersection_id"] = inter.id
+    out["engine"] = inter.state()
+    out["serial"] = inter.serial_status()
+    return out
+
 
 @app.get("/", response_class=HTMLResponse)
 def ui(request: Request):
@@ -909,27 +3357,12 @@ async def process(
     """
     intersections = {"UTARA": utara, "TIMUR": timur, "SELATAN": selatan, "BARAT": barat}
 
-    output_paths = {}
-    rows = []
+    images = {name: await file.read() for name, file in intersections.items()}
+    batch = await run_inference(process_images_batch, images, model_type=model_type, save_overlay=True)
 
-    for name, file in intersections.items():
-        img_bytes = await file.read()
-        out = process_image_bytes(img_bytes, model_type=model_type, save_overlay=True, out_name=name)
-        if out is None:
-            continue
-
-        output_paths[name] = out["overlay_url"]
-        rows.append({
-            "Persimpangan": name,
-            "PCU_total": out["pcu_total"],
-            "car": out["counts"]["car"],
-            "motorcycle": out["counts"]["motorcycle"],
-            "bicycle": out["counts"]["bicycle"],
-            "kendaraan_besar": out["counts"]["kendaraan_besar"],
-        })
-
-    df_pcu = pd.DataFrame(rows).set_index("Persimpangan") if len(rows) else pd.DataFrame()
-    df_fuzzy = compute_fuzzy(df_pcu) if len(rows) else pd.DataFrame()
+    output_paths = {name: out["overlay_url"] for name, out in batch.items() if out is not None}
+    pcu_tab = pcu_table(batch)
+    fuzzy_tab = fuzzy_schedule({arah: row["PCU_total"] for arah, row in pcu_tab.items()})
 
     return templates.TemplateResponse(
         "index.html",
@@ -937,8 +3370,8 @@ async def process(
             "request": request,
             "result": {
                 "images": output_paths,
-                "pcu_table": df_pcu.to_dict(orient="index") if len(rows) else {},
-                "fuzzy_table": df_fuzzy.to_dict(orient="index") if len(rows) else {},
+                "pcu_table": pcu_tab,
+                "fuzzy_table": fuzzy_tab,
                 "model_type": model_type,
             },
         },
@@ -949,13 +3382,13 @@ def pico_state():
     """
     Endpoint lama kamu (tetap).
     """
-    global LAST_FUZZY
+    last_fuzzy = intersections.default.last_fuzzy
 
     def g(a):
-        return float(LAST_FUZZY.get(a, {}).get("Green_time", 10.0))
+        return float(last_fuzzy.get(a, {}).get("Green_time", 10.0))
 
     def r(a):
-        return float(LAST_FUZZY.get(a, {}).get("Red_time", 50.0))
+        return float(last_fuzzy.get(a, {}).get("Red_time", 50.0))
 
     gU = g("UTARA");   rU = r("UTARA")
     gT = g("TIMUR");   rT = r("TIMUR")
@@ -967,14 +3400,4 @@ def pico_state():
 
 @app.get("/api/serial_status")
 def api_serial_status():
-    with _serial_lock:
-        try:
-            ser = _get_serial()
-            if ser is None:
-                return {"ready": False, "port": SERIAL_PORT, "baud": SERIAL_BAUD, "detail": "cannot_open"}
-            # optional: cek is_open
-            if not getattr(ser, "is_open", False):
-                return {"ready": False, "port": SERIAL_PORT, "baud": SERIAL_BAUD, "detail": "not_open"}
-            return {"ready": True, "port": SERIAL_PORT, "baud": SERIAL_BAUD, "detail": "ok"}
-        except Exception as e:
-            return {"ready": False, "port": SERIAL_PORT, "baud": SERIAL_BAUD, "detail": str(e)}
\ No newline at end of file
+    return serial_status_snapshot()
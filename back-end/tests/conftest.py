@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modul back-end (server.py, tracker.py, ...) diimport langsung, sama seperti uvicorn server:app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,13 @@
+import server
+
+
+def test_cache_key_includes_int8_quantization_mode(monkeypatch):
+    img = b"\xff\xd8 frame"
+    monkeypatch.setitem(server._int8_modes, "yolo", "dynamic")
+    k_dynamic = server.DetectionCache.key_for(img, "yolo_int8")
+    monkeypatch.setitem(server._int8_modes, "yolo", "static")
+    k_static = server.DetectionCache.key_for(img, "yolo_int8")
+    assert k_dynamic != k_static
+    assert "int8-static" in k_static
+    # model non-INT8 tidak terpengaruh
+    assert server.DetectionCache.key_for(img, "yolo") == server.DetectionCache.key_for(img, "yolo")
@@ -0,0 +1,24 @@
+import pytest
+
+import server
+
+
+def test_reserved_ids_cover_literal_api_routes():
+    segments = set()
+    for route in server.app.routes:
+        parts = getattr(route, "path", "").split("/")
+        if len(parts) > 2 and parts[1] == "api" and not parts[2].startswith("{"):
+            segments.add(parts[2])
+    assert segments <= server.RESERVED_INTERSECTION_IDS
+
+
+@pytest.mark.parametrize("iid", ["history", "Overlay", "streams", "bad/id", ""])
+def test_add_rejects_reserved_or_invalid_ids(iid):
+    reg = server.IntersectionRegistry("default")
+    with pytest.raises(ValueError):
+        reg.add(iid)
+
+
+def test_add_accepts_plain_id():
+    reg = server.IntersectionRegistry("default")
+    assert reg.add("simpang_2").id == "simpang_2"
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import server
+
+
+class FakeModel:
+    backend = "onnx"
+    nbytes = 1024
+
+
+def test_failed_load_is_retried_after_backoff(monkeypatch):
+    monkeypatch.setattr(server, "MODEL_RETRY_MIN_S", 0.05)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("weights belum ada")
+        return FakeModel()
+
+    reg = server.ModelRegistry({"yolo": flaky})
+    with pytest.raises(server.ModelUnavailable):
+        with reg.use("yolo"):
+            pass
+    # masih dalam backoff -> tidak memanggil loader lagi
+    with pytest.raises(server.ModelUnavailable):
+        with reg.use("yolo"):
+            pass
+    assert len(calls) == 1
+    assert reg.stats()["models"]["yolo"]["failures"] == 1
+
+    time.sleep(0.06)
+    with reg.use("yolo") as model:
+        assert isinstance(model, FakeModel)
+    st = reg.stats()["models"]["yolo"]
+    assert st["loaded"] and st["failures"] == 0
+    assert st["error"] == "weights belum ada"
+
+
+def test_preload_model_ready_after_evict_and_reload(monkeypatch):
+    # budget cuma muat 1 model -> pakai "b" meng-evict "a"
+    reg = server.ModelRegistry({"a": FakeModel, "b": FakeModel}, budget_mb=1500 / (1024 * 1024))
+    monkeypatch.setattr(server, "models", reg)
+    monkeypatch.setattr(server, "PRELOAD_MODELS", ["a"])
+    monkeypatch.setitem(server._startup, "ready", True)
+
+    reg.preload(["a"])
+    reg.mark_warm("a")
+    assert server.readiness()["ready"]
+
+    with reg.use("b"):
+        pass
+    assert not reg.is_loaded("a")
+    # ke-evict tapi bisa di-load ulang on-demand -> pod tetap ready
+    assert server.readiness()["ready"]
+
+    with reg.use("a"):
+        pass
+    r = server.readiness()
+    assert r["ready"] and r["models"]["a"]["loaded"] and r["models"]["a"]["warmed"]
+
+
+def test_preload_model_warmed_after_retry(monkeypatch):
+    monkeypatch.setattr(server, "MODEL_RETRY_MIN_S", 0.0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("OOM")
+        return FakeModel()
+
+    reg = server.ModelRegistry({"a": flaky})
+    monkeypatch.setattr(server, "models", reg)
+    monkeypatch.setattr(server, "PRELOAD_MODELS", ["a"])
+    monkeypatch.setitem(server._startup, "ready", True)
+    warmed = []
+
+    def fake_warmup(name):
+        with reg.use(name):
+            pass
+        warmed.append(name)
+
+    monkeypatch.setattr(server, "_warmup_model", fake_warmup)
+    reg.preload(["a"])
+    assert not server.readiness()["ready"]  # gagal -> readiness memicu rewarm di background
+    for _ in range(100):
+        if warmed:
+            break
+        time.sleep(0.01)
+    assert server.readiness()["ready"]
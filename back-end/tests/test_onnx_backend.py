@@ -0,0 +1,19 @@
+import cv2
+import numpy as np
+
+import onnx_backend
+
+
+def test_auto_int8_mode_without_calib_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(onnx_backend, "CALIB_DIR", str(tmp_path / "missing"))
+    assert onnx_backend.resolve_int8_mode("auto") == "dynamic"
+    assert onnx_backend._load_images(str(tmp_path / "missing")) == []
+
+
+def test_auto_int8_mode_needs_image_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(onnx_backend, "CALIB_DIR", str(tmp_path))
+    (tmp_path / "notes.txt").write_text("bukan gambar")
+    assert onnx_backend.resolve_int8_mode("auto") == "dynamic"
+    cv2.imwrite(str(tmp_path / "frame.jpg"), np.zeros((8, 8, 3), dtype=np.uint8))
+    assert onnx_backend.resolve_int8_mode("auto") == "static"
+    assert [fn for fn, _ in onnx_backend._load_images(str(tmp_path), max_images=1)] == ["frame.jpg"]
@@ -0,0 +1,18 @@
+import pytest
+
+import server
+
+
+def test_render_lock_released_when_render_fails(monkeypatch):
+    monkeypatch.setattr(server, "OVERLAY_EAGER", False)
+    store = server.OverlayStore(1 << 20, 16)
+
+    def broken(src, det):
+        raise ValueError("gambar rusak")
+
+    monkeypatch.setattr(store, "_render", broken)
+    store.put("rid", "UTARA", b"bukan jpeg", None, {}, 0.0)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            store.get("rid", "UTARA")
+    assert store._render_locks == {}
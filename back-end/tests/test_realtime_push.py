@@ -0,0 +1,48 @@
+import asyncio
+
+import server
+
+
+def test_sse_registers_subscriber_only_while_iterating():
+    async def run():
+        hub = server.RealtimeHub(tick_ms=50, client_queue=4)
+        gen = hub.sse()
+        # StreamingResponse belum mulai iterasi (client putus duluan) -> tidak ada queue yang bocor
+        assert hub.stats()["subscribers"] == 0
+        first = await gen.__anext__()
+        assert first.startswith("id: 1\nevent: state\n")
+        assert hub.stats()["subscribers"] == 1
+        await gen.aclose()
+        assert hub.stats()["subscribers"] == 0
+
+    asyncio.run(run())
+
+
+def test_realtime_message_carries_absolute_timestamps():
+    inter = server.Intersection("t_rt")
+    inter.on_serial_line("RT,UTARA,5,5,0,0,0,0,10,20,30")
+    rt = server.realtime_message(inter)["rt"]
+    assert rt["rt_ts"] == inter.rt_ts
+    assert rt["server_ts"] >= rt["rt_ts"]
+
+
+def test_change_before_new_subscriber_reaches_existing_clients(monkeypatch):
+    inter = server.intersections.default
+    monkeypatch.setattr(inter, "rt_line", None)
+    monkeypatch.setattr(inter, "rt_ts", 0.0)
+
+    async def run():
+        hub = server.RealtimeHub(tick_ms=50, client_queue=4)
+        inter.on_serial_line("RT,UTARA,5,5,0,0,0,0,10,20,30")
+        old = hub.sse()
+        assert (await old.__anext__()).startswith("id: 1\n")
+
+        # berubah tepat sebelum client baru connect (producer belum tick)
+        inter.on_serial_line("RT,TIMUR,7,0,7,0,0,10,0,20,30")
+        new = hub.sse()
+        assert (await new.__anext__()).startswith("id: 2\n")
+        assert (await asyncio.wait_for(old.__anext__(), 1.0)).startswith("id: 2\n")
+        await old.aclose()
+        await new.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import server
+
+SCHED_A = "20,40,20,40,20,40,20,40"
+SCHED_B = "30,40,20,40,20,40,20,40"
+
+
+class FakeSerial:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data.decode("utf-8"))
+
+    def flush(self):
+        pass
+
+
+def _link(proto):
+    link = server.SerialLink("/dev/fake", 115200, lambda line: None)
+    link.proto = proto
+    link._ser = FakeSerial()
+    return link
+
+
+def test_identical_schedule_awaiting_ack_not_rewritten():
+    link = _link("v1")
+    link.send(SCHED_A)
+    link._write_pending()
+    assert len(link._ser.written) == 1
+
+    # sama dengan frame yang sedang menunggu ACK -> tidak ditulis, seq tidak naik
+    link.send(SCHED_A)
+    link._write_pending()
+    assert len(link._ser.written) == 1
+    assert link._seq == 1 and link.coalesced == 1
+
+    # pending berbeda lalu kembali ke jadwal yang masih in-flight -> pending batal
+    link.send(SCHED_B)
+    link.send(SCHED_A)
+    link._write_pending()
+    assert len(link._ser.written) == 1
+
+
+def test_identical_schedule_rewritten_after_ack():
+    # Pico memakai jadwal kiriman 1 siklus saja -> upload berikutnya yang sama tetap ditulis
+    link = _link("v1")
+    link.send(SCHED_A)
+    link._write_pending()
+    link._handle_line("ACK,1")
+    link.send(SCHED_A)
+    link._write_pending()
+    assert len(link._ser.written) == 2 and link._seq == 2
+
+
+def test_identical_plain_schedule_rewritten():
+    link = _link("plain")
+    link.send(SCHED_A)
+    link._write_pending()
+    link.send(SCHED_A)
+    link._write_pending()
+    assert link._ser.written == [SCHED_A + "\n", SCHED_A + "\n"]
@@ -0,0 +1,48 @@
+import numpy as np
+
+from tracker import MultiObjectTracker
+
+CAR = 1
+
+
+def _dets(*boxes, cat=CAR):
+    return np.array([[*b, cat] for b in boxes], dtype=np.int32)
+
+
+def test_static_detections_stay_counted():
+    trk = MultiObjectTracker(4, max_age=5, min_hits=2)
+    dets = _dets((10, 10, 60, 40), (100, 10, 150, 40), (200, 10, 250, 40))
+    for _ in range(50):
+        trk.step(dets)
+    assert trk.occupancy().tolist() == [0, 3, 0, 0]
+    assert len(trk.tracks) == 3
+
+
+def test_tracks_expire_after_max_age_without_detections():
+    trk = MultiObjectTracker(4, max_age=5, min_hits=2)
+    dets = _dets((10, 10, 60, 40))
+    trk.step(dets)
+    trk.step(dets)
+    assert trk.occupancy()[CAR] == 1
+    for _ in range(6):
+        trk.step(None)
+    assert trk.occupancy()[CAR] == 0
+
+
+def test_crossing_counted_once():
+    trk = MultiObjectTracker(4, min_hits=2, stop_line=(0, 100, 300, 100))
+    for y in range(40, 200, 10):
+        trk.step(_dets((50, y, 90, y + 30)))
+    for y in range(200, 40, -10):
+        trk.step(_dets((50, y, 90, y + 30)))
+    assert trk.crossings[CAR] == 1
+    assert len(trk.tracks) == 1
+
+
+def test_fast_mover_kept_with_sparse_detections():
+    # detector tiap 3 frame: box sudah tidak overlap dengan prediksi -> fallback jarak pusat
+    trk = MultiObjectTracker(4, max_age=10, min_hits=2)
+    for i in range(12):
+        x = 10 + 20 * i  # 60 px antar deteksi, box lebar 50 -> IoU 0
+        trk.step(_dets((x, 10, x + 50, 40)) if i % 3 == 0 else None)
+    assert trk._next_id == 2
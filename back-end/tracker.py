@@ -0,0 +1,229 @@
+"""
+Multi-object tracker ringan (CPU, numpy saja) untuk stream per arah.
+
+- Kalman filter constant-velocity per track (state SORT: cx, cy, area, aspect + kecepatan).
+- Asosiasi IoU greedy per kategori (gaya SORT), sisa pasangan dicoba lagi dengan jarak pusat.
+  Deteksi yang masuk sudah lolos threshold confidence server, jadi tidak ada tahap skor rendah.
+- step(None) = frame tanpa deteksi -> track cuma di-propagate (predict), jadi detector
+  boleh jalan tiap N frame saja.
+- occupancy() = jumlah track aktif per kategori (antrian);
+  crossings = track yang melewati stop line (flow), dihitung sekali per track.
+
+Input deteksi = array compact server.py: int32 (N, 5) -> x1, y1, x2, y2, kategori_idx.
+"""
+import numpy as np
+
+
+# ===================== KALMAN =====================
+def _xyxy_to_z(b):
+    w = max(float(b[2] - b[0]), 1.0)
+    h = max(float(b[3] - b[1]), 1.0)
+    return np.array([b[0] + w / 2.0, b[1] + h / 2.0, w * h, w / h], dtype=np.float64)
+
+def _x_to_xyxy(x):
+    s = max(float(x[2]), 1.0)
+    r = max(float(x[3]), 1e-3)
+    w = np.sqrt(s * r)
+    h = s / w
+    return np.array([x[0] - w / 2.0, x[1] - h / 2.0, x[0] + w / 2.0, x[1] + h / 2.0])
+
+_F = np.eye(7)
+_F[0, 4] = _F[1, 5] = _F[2, 6] = 1.0
+_H = np.eye(4, 7)
+_Q = np.diag([1.0, 1.0, 1.0, 1e-4, 1e-2, 1e-2, 1e-4])
+_R = np.diag([1.0, 1.0, 10.0, 1e-2])
+
+
+class Track:
+    __slots__ = ("id", "cat", "x", "P", "hits", "age", "time_since_update", "side", "crossed")
+
+    def __init__(self, tid: int, box, cat: int):
+        self.id = tid
+        self.cat = int(cat)
+        self.x = np.zeros(7)
+        self.x[:4] = _xyxy_to_z(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+        self.hits = 1
+        self.age = 0
+        self.time_since_update = 0
+        self.side = None      # sisi stop line terakhir (+1 / -1)
+        self.crossed = False
+
+    def predict(self):
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0.0
+        self.x = _F @ self.x
+        self.P = _F @ self.P @ _F.T + _Q
+        self.age += 1
+        self.time_since_update += 1
+
+    def update(self, box):
+        z = _xyxy_to_z(box)
+        y = z - _H @ self.x
+        S = _H @ self.P @ _H.T + _R
+        K = self.P @ _H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ _H) @ self.P
+        self.hits += 1
+        self.time_since_update = 0
+
+    def box(self):
+        return _x_to_xyxy(self.x)
+
+    def center(self):
+        return float(self.x[0]), float(self.x[1])
+
+
+# ===================== ASOSIASI =====================
+def iou_matrix(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = (rb - lt).clip(0).prod(-1)
+    area_a = (a[:, 2:4] - a[:, :2]).clip(0).prod(-1)
+    area_b = (b[:, 2:4] - b[:, :2]).clip(0).prod(-1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def greedy_match(iou, thresh: float):
+    """Pasangkan (track, det) dari IoU terbesar. Return list pasangan, sisa track, sisa det."""
+    pairs = []
+    if iou.size:
+        cand = np.argwhere(iou >= thresh)
+        order = np.argsort(-iou[cand[:, 0], cand[:, 1]])
+        used_t, used_d = set(), set()
+        for t, d in cand[order]:
+            if t in used_t or d in used_d:
+                continue
+            used_t.add(t)
+            used_d.add(d)
+            pairs.append((int(t), int(d)))
+    mt = {t for t, _ in pairs}
+    md = {d for _, d in pairs}
+    return pairs, [t for t in range(iou.shape[0]) if t not in mt], [d for d in range(iou.shape[1]) if d not in md]
+
+def center_dist_matrix(a, b):
+    """Jarak pusat box dinormalisasi diagonal box track (a)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    ca = (a[:, :2] + a[:, 2:4]) / 2.0
+    cb = (b[:, :2] + b[:, 2:4]) / 2.0
+    diag = np.hypot(a[:, 2] - a[:, 0], a[:, 3] - a[:, 1]).clip(1.0)
+    return np.hypot(ca[:, None, 0] - cb[None, :, 0], ca[:, None, 1] - cb[None, :, 1]) / diag[:, None]
+
+
+# ===================== TRACKER =====================
+class MultiObjectTracker:
+    def __init__(self, n_categories: int, iou_thresh: float = 0.3, max_age: int = 10, min_hits: int = 2,
+                 dist_gate: float = 1.5, stop_line=None):
+        self.n_categories = n_categories
+        self.iou_thresh = iou_thresh
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.dist_gate = dist_gate
+        self.stop_line = None if stop_line is None else np.asarray(stop_line, dtype=np.float64).reshape(4)
+        self.tracks = []
+        self._next_id = 1
+        self.frames = 0
+        self.detect_frames = 0
+        self.crossings = np.zeros(n_categories, dtype=np.int64)
+
+    def _side(self, pt):
+        x1, y1, x2, y2 = self.stop_line
+        v = (x2 - x1) * (pt[1] - y1) - (y2 - y1) * (pt[0] - x1)
+        return 1 if v >= 0 else -1
+
+    def _on_segment(self, pt) -> bool:
+        # proyeksi titik jatuh di dalam segmen stop line (bukan perpanjangannya)
+        x1, y1, x2, y2 = self.stop_line
+        dx, dy = x2 - x1, y2 - y1
+        L2 = dx * dx + dy * dy
+        if L2 <= 0:
+            return False
+        t = ((pt[0] - x1) * dx + (pt[1] - y1) * dy) / L2
+        return 0.0 <= t <= 1.0
+
+    def _associate(self, tracks, boxes, cats):
+        """
+        IoU greedy, hanya track & deteksi dengan kategori sama. Sisa pasangan dicoba lagi
+        dengan jarak pusat (<= dist_gate x diagonal box): kalau detector jalan tiap N frame,
+        kendaraan cepat bisa sudah tidak overlap dengan prediksi (terutama track yang
+        kecepatannya belum diketahui).
+        """
+        if not tracks or len(boxes) == 0:
+            return [], list(range(len(tracks))), list(range(len(boxes)))
+        tb = np.array([t.box() for t in tracks])
+        same = np.array([t.cat for t in tracks])[:, None] == cats[None, :]
+        iou = np.where(same, iou_matrix(tb, boxes), 0.0)
+        pairs, rest_t, rest_d = greedy_match(iou, self.iou_thresh)
+        if rest_t and rest_d and self.dist_gate > 0:
+            rt, rd = np.array(rest_t), np.array(rest_d)
+            dist = center_dist_matrix(tb[rt], boxes[rd])
+            # skor makin besar makin dekat; di luar gate / beda kategori -> 0
+            sim = np.where(same[np.ix_(rt, rd)] & (dist <= self.dist_gate), 1.0 / (1.0 + dist), 0.0)
+            p2, rt2, rd2 = greedy_match(sim, 1e-9)
+            pairs += [(int(rt[t]), int(rd[d])) for t, d in p2]
+            rest_t, rest_d = [int(rt[t]) for t in rt2], [int(rd[d]) for d in rd2]
+        return pairs, rest_t, rest_d
+
+    def step(self, dets=None):
+        """dets: int32 (N, 5) atau None (frame tanpa deteksi -> predict saja)."""
+        self.frames += 1
+        for t in self.tracks:
+            t.predict()
+
+        if dets is not None:
+            self.detect_frames += 1
+            dets = np.asarray(dets).reshape(-1, 5)
+            boxes = dets[:, :4].astype(np.float64)
+            cats = dets[:, 4].astype(np.int64)
+
+            pairs, _, rest_d = self._associate(self.tracks, boxes, cats)
+            for ti, di in pairs:
+                self.tracks[ti].update(boxes[di])
+            for di in rest_d:
+                self.tracks.append(Track(self._next_id, boxes[di], cats[di]))
+                self._next_id += 1
+
+        self.tracks = [t for t in self.tracks if t.time_since_update <= self.max_age]
+        if self.stop_line is not None:
+            self._update_crossings()
+
+    def _update_crossings(self):
+        for t in self.tracks:
+            if t.hits < self.min_hits:
+                continue
+            c = t.center()
+            side = self._side(c)
+            if t.side is not None and side != t.side and not t.crossed and self._on_segment(c):
+                t.crossed = True
+                if 0 <= t.cat < self.n_categories:
+                    self.crossings[t.cat] += 1
+            t.side = side
+
+    def active(self):
+        return [t for t in self.tracks if t.hits >= self.min_hits]
+
+    def occupancy(self) -> np.ndarray:
+        """Jumlah track aktif (terkonfirmasi) per kategori."""
+        cats = np.array([t.cat for t in self.active()], dtype=np.int64)
+        return np.bincount(cats[(cats >= 0) & (cats < self.n_categories)], minlength=self.n_categories)
+
+    def boxes(self) -> np.ndarray:
+        """Track aktif sebagai array compact int32 (N, 5)."""
+        act = self.active()
+        out = np.empty((len(act), 5), dtype=np.int32)
+        for i, t in enumerate(act):
+            out[i, :4] = np.rint(t.box())
+            out[i, 4] = t.cat
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "tracks": len(self.tracks),
+            "active": len(self.active()),
+            "frames": self.frames,
+            "detect_frames": self.detect_frames,
+            "detect_ratio": round(self.detect_frames / self.frames, 3) if self.frames else None,
+            "crossings": self.crossings.tolist(),
+        }
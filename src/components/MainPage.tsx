@@ -1,12 +1,12 @@
 // ✅ PERUBAHAN MINIMAL: tambah TAB (Detection / Monitor Pico)
 // - Navbar tidak diubah
 // - Pindah tab tidak reset (panel mounted, pakai display none/block)
-// - Polling realtime jalan hanya saat tab Monitor Pico dibuka
+// - Realtime (SSE push) jalan hanya saat tab Monitor Pico dibuka
 // - Tab button dipaling atas & dibuat lebar (full width)
 // - Header (badge + judul + deskripsi) dipindah ke bawah tab bar,
 //   dan hanya muncul sesuai tab yang aktif
 
-import React, { useEffect, useMemo, useState } from "react";
+import React, { useEffect, useMemo, useRef, useState } from "react";
 import { FaRepeat } from "react-icons/fa6";
 import {
   Box,
@@ -98,6 +98,17 @@ type RtPicoResponse = {
   schedule?: Record<string, { Green_time: number; Red_time: number }>;
   delay_ms?: number;
   age_ms?: number;
+  // timestamp absolut (unix detik) -> umur dihitung di client
+  rt_ts?: number | null;
+  sched_ts?: number | null;
+  server_ts?: number;
+};
+
+// ✅ pesan push /api/realtime/stream
+type RtStreamMessage = {
+  rt: RtPicoResponse;
+  serial: { ready: boolean; port: string; baud: number; detail: string };
+  engine: { active_arah: string; phase: string; remaining: number; using_pending: boolean };
 };
 
 export default function MainPage() {
@@ -145,6 +156,8 @@ export default function MainPage() {
   const [rtLastUpdate, setRtLastUpdate] = useState<number>(0);
   const [rtErrorCount, setRtErrorCount] = useState<number>(0);
   const [rtDelay, setRtDelay] = useState<number | null>(null);
+  // waktu RT terakhir dari Pico, dalam jam client (ms); null = belum ada RT
+  const rtTsRef = useRef<number | null>(null);
 
   // untuk paksa remount input file agar bisa upload ulang tanpa reload
   const [fileInputKey, setFileInputKey] = useState(0);
@@ -251,98 +264,88 @@ export default function MainPage() {
     }
   };
 
-  // ✅ Polling realtime hanya saat TAB realtime aktif
+  // ✅ Realtime via server push (SSE) hanya saat TAB realtime aktif
+  // server kirim event "state" = { rt, serial, engine } hanya saat ada perubahan
+  const applyRt = (obj: RtPicoResponse) => {
+    const g = obj.schedule || {};
+    const rtR = obj.rt_red || {};
+    const active = obj.active_arah;
+    const remaining = Number(obj.remaining ?? 0) || 0;
+
+    const list: Array<{ label: string; value: number }> = [
+      { label: "Green_North", value: Number(g["UTARA"]?.Green_time ?? 0) },
+      { label: "Red_North", value: Number(g["UTARA"]?.Red_time ?? 0) },
+
+      { label: "Green_East", value: Number(g["TIMUR"]?.Green_time ?? 0) },
+      { label: "Red_East", value: Number(g["TIMUR"]?.Red_time ?? 0) },
+
+      { label: "Green_South", value: Number(g["SELATAN"]?.Green_time ?? 0) },
+      { label: "Red_South", value: Number(g["SELATAN"]?.Red_time ?? 0) },
+
+      { label: "Green_West", value: Number(g["BARAT"]?.Green_time ?? 0) },
+      { label: "Red_West", value: Number(g["BARAT"]?.Red_time ?? 0) },
+
+      { label: "Green_RT_North", value: active === "UTARA" ? remaining : 0 },
+      { label: "Green_RT_East", value: active === "TIMUR" ? remaining : 0 },
+      { label: "Green_RT_South", value: active === "SELATAN" ? remaining : 0 },
+      { label: "Green_RT_West", value: active === "BARAT" ? remaining : 0 },
+
+      { label: "Red_RT_North", value: Number(rtR["UTARA"] ?? 0) },
+      { label: "Red_RT_East", value: Number(rtR["TIMUR"] ?? 0) },
+      { label: "Red_RT_South", value: Number(rtR["SELATAN"] ?? 0) },
+      { label: "Red_RT_West", value: Number(rtR["BARAT"] ?? 0) },
+    ];
+
+    setRtData(list);
+    setRtLastUpdate(Date.now());
+    if (obj.rt_ts != null && obj.server_ts != null) {
+      // koreksi beda jam client-server pakai server_ts saat pesan diterima
+      rtTsRef.current = obj.rt_ts * 1000 + (Date.now() - obj.server_ts * 1000);
+      setRtDelay(Math.max(0, Math.round(Date.now() - rtTsRef.current)));
+    } else {
+      rtTsRef.current = null;
+      setRtDelay(obj.delay_ms ?? null);
+    }
+  };
+
+  // push hanya datang saat state berubah -> umur RT terus dihitung di client
+  // (kalau Pico diam, delay ikut naik seperti saat polling dulu)
   useEffect(() => {
     if (activeTab !== "realtime") return;
-    if (serialReady === false) return;
-
-    let alive = true;
-
-    const fetchRT = async () => {
-      try {
-        const r = await fetch(`${API_BASE}/api/realtime_pico`, { cache: "no-store" });
-        if (!r.ok) return;
-
-        const obj = (await r.json()) as RtPicoResponse;
-
-        const g = obj.schedule || {};
-        const rtR = obj.rt_red || {};
-        const active = obj.active_arah;
-        const remaining = Number(obj.remaining ?? 0) || 0;
-
-        const list: Array<{ label: string; value: number }> = [
-          { label: "Green_North", value: Number(g["UTARA"]?.Green_time ?? 0) },
-          { label: "Red_North", value: Number(g["UTARA"]?.Red_time ?? 0) },
-
-          { label: "Green_East", value: Number(g["TIMUR"]?.Green_time ?? 0) },
-          { label: "Red_East", value: Number(g["TIMUR"]?.Red_time ?? 0) },
-
-          { label: "Green_South", value: Number(g["SELATAN"]?.Green_time ?? 0) },
-          { label: "Red_South", value: Number(g["SELATAN"]?.Red_time ?? 0) },
-
-          { label: "Green_West", value: Number(g["BARAT"]?.Green_time ?? 0) },
-          { label: "Red_West", value: Number(g["BARAT"]?.Red_time ?? 0) },
-
-          { label: "Green_RT_North", value: active === "UTARA" ? remaining : 0 },
-          { label: "Green_RT_East", value: active === "TIMUR" ? remaining : 0 },
-          { label: "Green_RT_South", value: active === "SELATAN" ? remaining : 0 },
-          { label: "Green_RT_West", value: active === "BARAT" ? remaining : 0 },
-
-          { label: "Red_RT_North", value: Number(rtR["UTARA"] ?? 0) },
-          { label: "Red_RT_East", value: Number(rtR["TIMUR"] ?? 0) },
-          { label: "Red_RT_South", value: Number(rtR["SELATAN"] ?? 0) },
-          { label: "Red_RT_West", value: Number(rtR["BARAT"] ?? 0) },
-        ];
-
-        if (alive) {
-          setRtData(list);
-          setRtLastUpdate(Date.now());
-          setRtDelay(obj.delay_ms ?? null);
-        }
-      } catch {
-        setRtErrorCount((c) => c + 1);
+    const id = window.setInterval(() => {
+      if (rtTsRef.current !== null) {
+        setRtDelay(Math.max(0, Math.round(Date.now() - rtTsRef.current)));
       }
-    };
-
-    fetchRT();
-    const t = setInterval(fetchRT, 1000);
-    return () => {
-      alive = false;
-      clearInterval(t);
-    };
+    }, 500);
+    return () => window.clearInterval(id);
   }, [activeTab]);
 
   useEffect(() => {
     if (activeTab !== "realtime") return;
-    if (serialReady === false) return;
-  
-    let stop = false;
-  
-    const ping = async () => {
+
+    const es = new EventSource(`${API_BASE}/api/realtime/stream`);
+
+    es.addEventListener("state", (ev) => {
       try {
-        const r = await fetch(`${API_BASE}/api/serial_status`, { cache: "no-store" });
-        if (!r.ok) return;
-        const j = await r.json();
-        if (!stop) {
-          setSerialReady(!!j.ready);
-          setSerialDetail(String(j.detail ?? ""));
-        }
+        const msg = JSON.parse((ev as MessageEvent).data) as RtStreamMessage;
+        setSerialReady(!!msg.serial?.ready);
+        setSerialDetail(String(msg.serial?.detail ?? ""));
+        if (msg.rt) applyRt(msg.rt);
       } catch {
-        if (!stop) {
-          setSerialReady(false);
-          setSerialDetail("fetch_error");
-        }
+        setRtErrorCount((c) => c + 1);
       }
+    });
+
+    // EventSource reconnect otomatis; di sini cuma dicatat
+    es.onerror = () => {
+      setRtErrorCount((c) => c + 1);
+      setSerialDetail("stream_reconnecting");
     };
-  
-    ping();
-    const t = setInterval(ping, 1500);
-  
+
     return () => {
-      stop = true;
-      clearInterval(t);
+      es.close();
     };
-  }, [activeTab]);  
+  }, [activeTab]);
 
   // ====== UI constants ======
   const bgGradient = useColorModeValue(